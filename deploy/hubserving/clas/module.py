@@ -16,16 +16,20 @@ import os
 import sys
 sys.path.insert(0, ".")
 
+import binascii
 import time
+from concurrent.futures import ThreadPoolExecutor
 
+import cv2
 import numpy as np
 import paddle.nn as nn
 from paddlehub.module.module import moduleinfo, serving
 
 from hubserving.clas.params import get_default_confg
 from python.predict_cls import ClsPredictor
+from python.preprocess import create_operators
 from utils import config
-from utils.encode_decode import b64_to_np
+from utils.encode_decode import b64_to_np, b64_to_image
 
 
 @moduleinfo(
@@ -36,15 +40,35 @@ from utils.encode_decode import b64_to_np
     author_email="paddle-dev@baidu.com",
     type="cv/class")
 class ClasSystem(nn.Layer):
-    def __init__(self, use_gpu=None, enable_mkldnn=None):
+    def __init__(self,
+                 use_gpu=None,
+                 enable_mkldnn=None,
+                 predictor_pool_size=None,
+                 preprocess_threads=None):
         """
         initialize with the necessary elements
         """
         self._config = self._load_config(
-            use_gpu=use_gpu, enable_mkldnn=enable_mkldnn)
-        self.cls_predictor = ClsPredictor(self._config)
+            use_gpu=use_gpu,
+            enable_mkldnn=enable_mkldnn,
+            predictor_pool_size=predictor_pool_size,
+            preprocess_threads=preprocess_threads)
+        # PreProcess is applied by the service to the encoded images only
+        self.cls_predictor = ClsPredictor({
+            key: value
+            for key, value in self._config.items() if key != "PreProcess"
+        })
+        self.preprocess_ops = create_operators(self._config["PreProcess"][
+            "transform_ops"])
+        self.max_batch_size = self._config.Global.get("max_batch_size", 32)
+        self._executor = ThreadPoolExecutor(
+            max_workers=self._config.Global.get("preprocess_threads", 4))
 
-    def _load_config(self, use_gpu=None, enable_mkldnn=None):
+    def _load_config(self,
+                     use_gpu=None,
+                     enable_mkldnn=None,
+                     predictor_pool_size=None,
+                     preprocess_threads=None):
         cfg = get_default_confg()
         cfg = config.AttrDict(cfg)
         config.create_attr_dict(cfg)
@@ -52,6 +76,10 @@ class ClasSystem(nn.Layer):
             cfg.Global.use_gpu = use_gpu
         if enable_mkldnn is not None:
             cfg.Global.enable_mkldnn = enable_mkldnn
+        if predictor_pool_size is not None:
+            cfg.Global.predictor_pool_size = predictor_pool_size
+        if preprocess_threads is not None:
+            cfg.Global.preprocess_threads = preprocess_threads
         cfg.enable_benchmark = False
         if cfg.Global.use_gpu:
             try:
@@ -79,11 +107,73 @@ class ClasSystem(nn.Layer):
         preds = self.cls_predictor.postprocess(outputs)
         return {"prediction": preds, "elapse": elapse}
 
+    def _decode_and_preprocess(self, b64str):
+        """
+        returns None if the image cannot be decoded or preprocessed, so that
+        only this image fails in the request
+        """
+        try:
+            img = b64_to_image(b64str)
+        except (binascii.Error, ValueError, TypeError, AttributeError,
+                cv2.error) as ex:
+            print("failed to decode image: {}".format(ex))
+            return None
+        if img is None:
+            return None
+        try:
+            for ops in self.preprocess_ops:
+                img = ops(img)
+        except Exception as ex:
+            print("failed to preprocess image: {}".format(ex))
+            return None
+        return img
+
+    def _predict_batch(self, batch, rows, preds):
+        outputs = self.cls_predictor.predict(batch)
+        for row, pred in zip(rows, self.cls_predictor.postprocess(outputs)):
+            preds[row] = pred
+
+    def predict_encoded(self, images):
+        """
+        decode and preprocess the images in the thread pool and predict them
+        in batches of max_batch_size, the images are still being preprocessed
+        while the former batches are predicted
+        Args:
+            images(list): base64 encoded image files, such as jpeg or png
+        """
+        starttime = time.time()
+        preds = [None] * len(images)
+        batch, rows = [], []
+        for row, img in enumerate(
+                self._executor.map(self._decode_and_preprocess, images)):
+            if img is None:
+                preds[row] = {
+                    "error": "failed to decode or preprocess image {}".format(
+                        row)
+                }
+                continue
+            batch.append(img)
+            rows.append(row)
+            if len(batch) == self.max_batch_size:
+                self._predict_batch(batch, rows, preds)
+                batch, rows = [], []
+        if len(batch) > 0:
+            self._predict_batch(batch, rows, preds)
+        elapse = time.time() - starttime
+        return {"prediction": preds, "elapse": elapse}
+
     @serving
-    def serving_method(self, images, revert_params):
+    def serving_method(self, images, revert_params=None):
         """
         Run as a service.
+        images is a list of base64 encoded image files, which are decoded and
+        preprocessed by the service, or a base64 encoded float tensor of
+        preprocessed images together with its revert_params
         """
+        if revert_params is None:
+            if not isinstance(images, list):
+                images = [images]
+            return self.predict_encoded(images)
         input_data = b64_to_np(images, revert_params)
         results = self.predict(inputs=list(input_data))
         return results
@@ -30,7 +30,34 @@ def get_default_confg():
             'ir_optim': False,
             "gpu_mem": 8000,
             'enable_profile': False,
-            "enable_benchmark": False
+            "enable_benchmark": False,
+            "predictor_pool_size": 1,
+            # threads decoding and preprocessing the encoded images
+            "preprocess_threads": 4,
+            # the encoded images of a request are predicted in batches
+            "max_batch_size": 32
+        },
+        # run on the server for the encoded images only, the float tensors
+        # of the other requests are preprocessed by the clients
+        'PreProcess': {
+            'transform_ops': [{
+                'ResizeImage': {
+                    'resize_short': 256
+                }
+            }, {
+                'CropImage': {
+                    'size': 224
+                }
+            }, {
+                'NormalizeImage': {
+                    'scale': 0.00392157,
+                    'mean': [0.485, 0.456, 0.406],
+                    'std': [0.229, 0.224, 0.225],
+                    'order': ''
+                }
+            }, {
+                'ToCHWImage': None
+            }]
         },
         'PostProcess': {
             'main_indicator': 'Topk',
@@ -29,7 +29,7 @@ import cv2
 from utils import logger
 from utils.get_image_list import get_image_list
 from utils import config
-from utils.encode_decode import np_to_b64
+from utils.encode_decode import np_to_b64, bytes_to_b64
 from python.preprocess import create_operators
 
 
@@ -45,6 +45,7 @@ def get_args():
     parser.add_argument("--crop_size", type=int, default=224)
     parser.add_argument("--normalize", type=str2bool, default=True)
     parser.add_argument("--to_chw", type=str2bool, default=True)
+    parser.add_argument("--send_image", type=str2bool, default=True)
     return parser.parse_args()
 
 
@@ -95,12 +96,21 @@ def main(args):
     img_name_list = []
     cnt = 0
     for idx, img_path in enumerate(image_path_list):
-        img = cv2.imread(img_path)
+        if args.send_image:
+            # send the encoded file, the service decodes and preprocesses it
+            with open(img_path, "rb") as f:
+                img = f.read()
+        else:
+            img = cv2.imread(img_path)
         if img is None:
             logger.warning(
                 f"Image file failed to read and has been skipped. The path: {img_path}"
             )
             continue
+        elif args.send_image:
+            img_data_list.append(bytes_to_b64(img))
+            img_name_list.append(img_path.split('/')[-1])
+            cnt += 1
         else:
             for ops in preprocess_ops:
                 img = ops(img)
@@ -111,15 +121,18 @@ def main(args):
             img_name_list.append(img_name)
             cnt += 1
         if cnt % args.batch_size == 0 or (idx + 1) == len(image_path_list):
-            inputs = np.array(img_data_list)
-            b64str, revert_shape = np_to_b64(inputs)
-            data = {
-                "images": b64str,
-                "revert_params": {
-                    "shape": revert_shape,
-                    "dtype": str(inputs.dtype)
+            if args.send_image:
+                data = {"images": img_data_list}
+            else:
+                inputs = np.array(img_data_list)
+                b64str, revert_shape = np_to_b64(inputs)
+                data = {
+                    "images": b64str,
+                    "revert_params": {
+                        "shape": revert_shape,
+                        "dtype": str(inputs.dtype)
+                    }
                 }
-            }
             try:
                 r = requests.post(
                     url=args.server_url,
@@ -141,6 +154,11 @@ def main(args):
                 predict_time += elapse
 
                 for number, result_list in enumerate(preds):
+                    if "error" in result_list:
+                        logger.error(
+                            f"File:{img_name_list[number]}, {result_list['error']}"
+                        )
+                        continue
                     all_score += result_list["scores"][0]
                     pred_str = ", ".join(
                         [f"{k}: {result_list[k]}" for k in result_list])
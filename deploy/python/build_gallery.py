@@ -23,20 +23,25 @@ import numpy as np
 from tqdm import tqdm
 
 from python.predict_rec import RecPredictor
-from vector_search import Graph_Index
+from vector_search import Graph_Index, pack_index
 
 from utils import logger
 from utils import config
 
 
-def split_datafile(data_file, image_root, delimiter="\t"):
+def split_datafile(data_file, image_root, delimiter="\t", attr_names=None):
     '''
         data_file: image path and info, which can be splitted by spacer 
         image_root: image path root
         delimiter: delimiter 
+        attr_names: names of the integer attributes in the columns after
+            the info, such as brand or store ids used by filtered search
+        returns: image paths, infos and a dict of the attributes
     '''
     gallery_images = []
     gallery_docs = []
+    attr_names = attr_names or []
+    gallery_attrs = {name: [] for name in attr_names}
     with open(data_file, 'r', encoding='utf-8') as f:
         lines = f.readlines()
         for _, ori_line in enumerate(lines):
@@ -48,8 +53,12 @@ def split_datafile(data_file, image_root, delimiter="\t"):
             image_doc = line[1]
             gallery_images.append(image_file)
             gallery_docs.append(image_doc)
+            assert text_num >= 2 + len(attr_names), \
+                f"line({ori_line}) should have the attributes {attr_names}"
+            for name, value in zip(attr_names, line[2:]):
+                gallery_attrs[name].append(int(value))
 
-    return gallery_images, gallery_docs
+    return gallery_images, gallery_docs, gallery_attrs
 
 
 class GalleryBuilder(object):
@@ -64,8 +73,9 @@ class GalleryBuilder(object):
         '''
             build index from scratch
         '''
-        gallery_images, gallery_docs = split_datafile(
-            config['data_file'], config['image_root'], config['delimiter'])
+        gallery_images, gallery_docs, gallery_attrs = split_datafile(
+            config['data_file'], config['image_root'], config['delimiter'],
+            config.get('attr_names', None))
 
         # extract gallery features
         gallery_features = np.zeros(
@@ -87,7 +97,12 @@ class GalleryBuilder(object):
             gallery_docs=gallery_docs,
             pq_size=config['pq_size'],
             index_path=config['index_path'],
-            append_index=config["append_index"])
+            append_index=config["append_index"],
+            gallery_attrs=gallery_attrs)
+        # one file mapped read-only by the serving processes, replacing it
+        # makes them load the new version
+        if config.get('pack_path', None):
+            pack_index(config['index_path'], config['pack_path'])
 
 
 def main(config):
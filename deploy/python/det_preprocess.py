@@ -199,6 +199,43 @@ class DetPadStride(object):
         return padding_im, im_info
 
 
+class DetShapeBuckets(object):
+    """ assign images to a small set of padded shapes so that images of
+    different sizes can run in one batch and predictor shape caches stay warm
+    Args:
+        buckets (list): candidate padded shapes as [[h, w], ...]
+        stride (int): bucket shapes are aligned to multiples of stride
+    """
+
+    def __init__(self, buckets=None, stride=0):
+        self.stride = stride
+        buckets = [] if buckets is None else buckets
+        self.buckets = sorted(
+            set(self.align(bucket) for bucket in buckets),
+            key=lambda x: (x[0] * x[1], x))
+
+    def align(self, shape):
+        h, w = int(shape[0]), int(shape[1])
+        if self.stride > 0:
+            h = int(np.ceil(float(h) / self.stride) * self.stride)
+            w = int(np.ceil(float(w) / self.stride) * self.stride)
+        return (h, w)
+
+    def __call__(self, shape):
+        """
+        Args:
+            shape (tuple): (h, w) of the preprocessed image
+        Returns:
+            bucket (tuple): the smallest bucket which can hold the image,
+                or the aligned image shape if no bucket is large enough
+        """
+        h, w = shape
+        for bucket in self.buckets:
+            if bucket[0] >= h and bucket[1] >= w:
+                return bucket
+        return self.align(shape)
+
+
 def det_preprocess(im, im_info, preprocess_ops):
     for operator in preprocess_ops:
         im, im_info = operator(im, im_info)
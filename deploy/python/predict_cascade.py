@@ -0,0 +1,386 @@
+# Copyright (c) 2021 PaddlePaddle Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import os
+import sys
+import json
+import time
+
+__dir__ = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.abspath(os.path.join(__dir__, '../')))
+
+import cv2
+import numpy as np
+
+from utils import logger
+from utils import config
+from utils.get_image_list import iter_image_list
+from python.predict_cls import ClsPredictor
+from python.postprocess import build_postprocess
+
+CRITERIONS = ["max_score", "margin"]
+# thresholds are scores in [0, 1], a larger one sends every row on
+NEVER_ACCEPT = 1.01
+
+
+def confidence(probs, criterion="max_score"):
+    """
+    Args:
+        probs(np.ndarray): [batch, class_num] probabilities
+        criterion(str): max_score uses the top-1 probability, margin uses
+            the difference between the top-1 and top-2 probabilities
+    Returns:
+        confidence(np.ndarray): [batch]
+    """
+    if criterion == "max_score" or probs.shape[1] < 2:
+        return probs.max(axis=1)
+    top2 = -np.partition(-probs, 1, axis=1)[:, :2]
+    return top2[:, 0] - top2[:, 1]
+
+
+def softmax(x):
+    x = x - x.max(axis=1, keepdims=True)
+    x = np.exp(x)
+    return x / x.sum(axis=1, keepdims=True)
+
+
+class CascadeClsPredictor(object):
+    """
+    run classification models from the cheapest to the most expensive one,
+    a row of the batch is answered by the first stage whose confidence
+    reaches the threshold of the stage, and only the other rows are sent to
+    the next stage, the last stage answers all the rows it gets. All the
+    stages must predict the same classes.
+    Args:
+        config(dict): inference config, the stages are listed in
+            Cascade.stages, every stage has its own inference_model_dir,
+            threshold and optionally PreProcess, the other settings are
+            shared with Global and PreProcess
+    """
+
+    def __init__(self, config):
+        cascade_config = config["Cascade"]
+        self.criterion = cascade_config.get("criterion", "max_score")
+        assert self.criterion in CRITERIONS, \
+            "criterion should be one of {}, but got {}".format(
+                CRITERIONS, self.criterion)
+        # set it when the models are exported without softmax
+        self.use_softmax = cascade_config.get("softmax", False)
+        stage_configs = cascade_config["stages"]
+        assert len(stage_configs) > 0, "no stage is set in Cascade.stages"
+
+        self.stages = []
+        self.thresholds = []
+        self.preprocess_keys = []
+        for stage_config in stage_configs:
+            global_config = config["Global"].__class__(config["Global"])
+            global_config["inference_model_dir"] = stage_config[
+                "inference_model_dir"]
+            preprocess = stage_config.get("PreProcess",
+                                          config.get("PreProcess", None))
+            self.stages.append(
+                ClsPredictor({
+                    "Global": global_config,
+                    "PreProcess": preprocess or {}
+                }))
+            self.thresholds.append(
+                stage_config.get("threshold", NEVER_ACCEPT))
+            # stages with the same PreProcess share the preprocessed images
+            self.preprocess_keys.append(json.dumps(preprocess, sort_keys=True))
+        self.postprocess = build_postprocess(config.get("PostProcess", None))
+        self.timer = self.stages[0].timer
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.stats = {
+            "rows": 0,
+            "batches": 0,
+            "time": 0.,
+            "stage_rows": [0] * len(self.stages),
+            "stage_answered": [0] * len(self.stages),
+            "stage_time": [0.] * len(self.stages),
+            "stage_calls": [0] * len(self.stages),
+        }
+
+    def _preprocess(self, stage_id, images, rows, cache):
+        key = self.preprocess_keys[stage_id]
+        cache = cache.setdefault(key, {})
+        with self.timer("preprocess"):
+            for row in rows:
+                if row not in cache:
+                    image = images[row]
+                    for ops in self.stages[stage_id].preprocess_ops:
+                        image = ops(image)
+                    cache[row] = image
+        return [cache[row] for row in rows]
+
+    def run_stage(self, stage_id, images, rows, cache=None):
+        """
+        Args:
+            stage_id(int): index of the stage
+            images(list): decoded images of the batch
+            rows(np.ndarray): rows of the batch to run
+            cache(dict): preprocessed images shared by the stages
+        Returns:
+            probs(np.ndarray): [len(rows), class_num] probabilities
+        """
+        inputs = self._preprocess(stage_id, images, rows,
+                                  {} if cache is None else cache)
+        stage = self.stages[stage_id]
+        with stage.predictor_pool.get() as predictor:
+            with self.timer("inference_stage{}".format(stage_id)):
+                tic = time.perf_counter()
+                output = predictor.run(predictor.stack_input(inputs))[0]
+                self.stats["stage_time"][stage_id] += time.perf_counter() - tic
+        self.stats["stage_calls"][stage_id] += 1
+        self.stats["stage_rows"][stage_id] += len(rows)
+        return softmax(output) if self.use_softmax else output
+
+    def predict(self, images):
+        """
+        Returns:
+            probs(np.ndarray): [batch, class_num] probabilities in the order
+                of the images
+            stage_ids(np.ndarray): [batch] stage answering every row
+        """
+        if not isinstance(images, (list, )):
+            images = [images]
+        tic = time.perf_counter()
+        num = len(images)
+        pending = np.arange(num)
+        stage_ids = np.full([num], -1, dtype="int64")
+        probs = None
+        cache = {}
+        for stage_id in range(len(self.stages)):
+            output = self.run_stage(stage_id, images, pending, cache)
+            if probs is None:
+                probs = np.zeros([num, output.shape[1]], dtype=output.dtype)
+            assert output.shape[1] == probs.shape[1], \
+                "all the stages should predict the same number of classes"
+            if stage_id == len(self.stages) - 1:
+                accept = np.ones([len(pending)], dtype=bool)
+            else:
+                accept = confidence(
+                    output, self.criterion) >= self.thresholds[stage_id]
+            probs[pending[accept]] = output[accept]
+            stage_ids[pending[accept]] = stage_id
+            self.stats["stage_answered"][stage_id] += int(accept.sum())
+            pending = pending[~accept]
+            if len(pending) == 0:
+                break
+        self.stats["rows"] += num
+        self.stats["batches"] += 1
+        self.stats["time"] += time.perf_counter() - tic
+        return probs, stage_ids
+
+    def summary(self):
+        """
+        Returns:
+            summary(dict): fraction of the rows answered by every stage, and
+                the effective latency per batch and per image in ms
+        """
+        stats = self.stats
+        rows = max(stats["rows"], 1)
+        summary = {
+            "rows": stats["rows"],
+            "answered_ratio":
+            [answered / rows for answered in stats["stage_answered"]],
+            "reached_ratio": [num / rows for num in stats["stage_rows"]],
+            "stage_latency_ms": [
+                1000 * cost / max(calls, 1)
+                for cost, calls in zip(stats["stage_time"], stats[
+                    "stage_calls"])
+            ],
+            "latency_ms": 1000 * stats["time"] / max(stats["batches"], 1),
+            "latency_per_image_ms": 1000 * stats["time"] / rows,
+        }
+        return summary
+
+    def log_summary(self):
+        summary = self.summary()
+        for stage_id in range(len(self.stages)):
+            logger.info(
+                "[Cascade] stage {}: threshold: {}, reached: {:.2%}, "
+                "answered: {:.2%}, latency: {:.3f} ms/call".format(
+                    stage_id, self.thresholds[stage_id]
+                    if stage_id < len(self.stages) - 1 else "-", summary[
+                        "reached_ratio"][stage_id], summary["answered_ratio"][
+                            stage_id], summary["stage_latency_ms"][stage_id]))
+        logger.info("[Cascade] rows: {}, effective latency: {:.3f} ms/batch, "
+                    "{:.3f} ms/image".format(summary["rows"], summary[
+                        "latency_ms"], summary["latency_per_image_ms"]))
+
+
+def read_eval_list(file_list, image_root=""):
+    """
+    every line of the list file is an image path and its label
+    """
+    paths, labels = [], []
+    with open(file_list, "r") as fin:
+        for line in fin:
+            line = line.strip()
+            if not line:
+                continue
+            path, label = line.split()[:2]
+            paths.append(os.path.join(image_root, path))
+            labels.append(int(label))
+    return paths, np.array(labels, dtype="int64")
+
+
+def calibrate_thresholds(stage_probs, labels, criterion, target_accuracy):
+    """
+    choose the threshold of every stage except the last one in turn, it is
+    the lowest threshold for which the rows reaching the stage and answered
+    by it are at least target_accuracy accurate
+    Args:
+        stage_probs(list): [num, class_num] probabilities of every stage
+        labels(np.ndarray): [num] labels
+    Returns:
+        thresholds(list): threshold of every stage except the last one
+        stage_ids(np.ndarray): [num] stage answering every row
+    """
+    num = len(labels)
+    pending = np.ones([num], dtype=bool)
+    stage_ids = np.full([num], len(stage_probs) - 1, dtype="int64")
+    thresholds = []
+    for stage_id, probs in enumerate(stage_probs[:-1]):
+        conf = confidence(probs, criterion)
+        rows = np.nonzero(pending)[0]
+        order = rows[np.argsort(-conf[rows], kind="stable")]
+        correct = probs[order].argmax(axis=1) == labels[order]
+        accuracy = np.cumsum(correct) / np.arange(1, len(order) + 1)
+        valid = np.nonzero(accuracy >= target_accuracy)[0]
+        if len(valid) == 0:
+            threshold = NEVER_ACCEPT
+        else:
+            threshold = float(conf[order[valid[-1]]])
+        thresholds.append(threshold)
+        accept = np.logical_and(pending, conf >= threshold)
+        stage_ids[accept] = stage_id
+        pending = np.logical_and(pending, ~accept)
+    return thresholds, stage_ids
+
+
+def calibrate(config):
+    """
+    run every stage on the images of Cascade.calibration.file_list, choose
+    the thresholds and report the accuracy and the cost of the cascade
+    """
+    calib_config = config["Cascade"]["calibration"]
+    predictor = CascadeClsPredictor(config)
+    paths, labels = read_eval_list(calib_config["file_list"],
+                                   calib_config.get("image_root", ""))
+    batch_size = config["Global"]["batch_size"]
+    num_stages = len(predictor.stages)
+    stage_probs = [[] for _ in range(num_stages)]
+    for start in range(0, len(paths), batch_size):
+        images = [
+            cv2.imread(path)[:, :, ::-1]
+            for path in paths[start:start + batch_size]
+        ]
+        rows = np.arange(len(images))
+        cache = {}
+        for stage_id in range(num_stages):
+            stage_probs[stage_id].append(
+                predictor.run_stage(stage_id, images, rows, cache))
+    stage_probs = [np.concatenate(probs) for probs in stage_probs]
+    image_cost = [
+        cost / max(num, 1)
+        for cost, num in zip(predictor.stats["stage_time"], predictor.stats[
+            "stage_rows"])
+    ]
+
+    last_accuracy = float(
+        (stage_probs[-1].argmax(axis=1) == labels).mean())
+    # by default early answers are as accurate as the last stage
+    target_accuracy = calib_config.get("target_accuracy", last_accuracy)
+    thresholds, stage_ids = calibrate_thresholds(
+        stage_probs, labels, predictor.criterion, target_accuracy)
+    preds = np.array([
+        stage_probs[stage_id][row].argmax()
+        for row, stage_id in enumerate(stage_ids)
+    ])
+    reached = [float((stage_ids >= i).mean()) for i in range(num_stages)]
+    answered = [float((stage_ids == i).mean()) for i in range(num_stages)]
+    result = {
+        "criterion": predictor.criterion,
+        "target_accuracy": float(target_accuracy),
+        "thresholds": thresholds,
+        "answered_ratio": answered,
+        "accuracy": float((preds == labels).mean()),
+        "last_stage_accuracy": last_accuracy,
+        # inference cost per image relative to running the last stage only
+        "relative_cost":
+        sum(r * c for r, c in zip(reached, image_cost)) /
+        max(image_cost[-1], 1e-12),
+    }
+    for stage_id in range(num_stages):
+        logger.info("[Calibration] stage {}: threshold: {}, answered: "
+                    "{:.2%}, latency: {:.3f} ms/image".format(
+                        stage_id, thresholds[stage_id] if stage_id <
+                        num_stages - 1 else "-", answered[stage_id], 1000 *
+                        image_cost[stage_id]))
+    logger.info("[Calibration] accuracy: {:.4f} (last stage only: {:.4f}), "
+                "relative cost: {:.3f}".format(result[
+                    "accuracy"], last_accuracy, result["relative_cost"]))
+    save_path = calib_config.get("save_path", None)
+    if save_path is not None:
+        save_dir = os.path.dirname(save_path)
+        if save_dir:
+            os.makedirs(save_dir, exist_ok=True)
+        with open(save_path, "w") as f:
+            json.dump(result, f, indent=4)
+        logger.info("calibration result is saved in {}".format(save_path))
+    return result
+
+
+def main(config):
+    predictor = CascadeClsPredictor(config)
+    image_list = iter_image_list(
+        config["Global"]["infer_imgs"],
+        recursive=config["Global"].get("recursive", False))
+    batch_size = config["Global"]["batch_size"]
+
+    def predict_batch(images, image_files):
+        probs, stage_ids = predictor.predict(images)
+        results = None
+        if predictor.postprocess is not None:
+            with predictor.timer("postprocess"):
+                results = predictor.postprocess(probs, image_files)
+        if results is None:
+            results = [{"file_name": image_file} for image_file in image_files]
+        for result, stage_id in zip(results, stage_ids):
+            result["stage"] = int(stage_id)
+            print(result)
+
+    images, image_files = [], []
+    for image_file in image_list:
+        images.append(cv2.imread(image_file)[:, :, ::-1])
+        image_files.append(image_file)
+        if len(images) == batch_size:
+            predict_batch(images, image_files)
+            images, image_files = [], []
+    if len(images) > 0:
+        predict_batch(images, image_files)
+    predictor.log_summary()
+    predictor.timer.log_summary()
+    return
+
+
+if __name__ == "__main__":
+    args = config.parse_args()
+    config = config.get_config(args.config, overrides=args.override, show=True)
+    if config["Cascade"].get("calibrate", False):
+        calibrate(config)
+    else:
+        main(config)
@@ -20,8 +20,9 @@ sys.path.append(os.path.abspath(os.path.join(__dir__, '../')))
 from utils import logger
 from utils import config
 from utils.predictor import Predictor
-from utils.get_image_list import get_image_list
-from det_preprocess import det_preprocess
+from utils.benchmark import run_benchmark
+from utils.get_image_list import get_image_list, iter_image_list
+from det_preprocess import det_preprocess, DetShapeBuckets
 from preprocess import create_operators
 
 import os
@@ -29,6 +30,7 @@ import argparse
 import time
 import yaml
 import ast
+import itertools
 from functools import reduce
 import cv2
 import numpy as np
@@ -44,35 +46,46 @@ class DetPredictor(Predictor):
             "transform_ops"])
         self.config = config
 
+        # images are padded to one of these shapes to run in batch
+        stride = 0
+        for op in self.preprocess_ops:
+            stride = max(stride, getattr(op, "coarsest_stride", 0))
+        self.shape_buckets = DetShapeBuckets(
+            config["DetPreProcess"].get("shape_buckets", None), stride)
+
     def preprocess(self, img):
         im_info = {
             'scale_factor': np.array(
                 [1., 1.], dtype=np.float32),
             'im_shape': np.array(
                 img.shape[:2], dtype=np.float32),
-            'input_shape': self.config["Global"]["image_shape"],
-            "scale_factor": np.array(
-                [1., 1.], dtype=np.float32)
+            'input_shape': list(self.config["Global"]["image_shape"]),
         }
         im, im_info = det_preprocess(img, im_info, self.preprocess_ops)
-        inputs = self.create_inputs(im, im_info)
-        return inputs
+        return im, im_info
 
-    def create_inputs(self, im, im_info):
-        """generate input for different model type
+    def create_inputs(self, ims, im_infos, predictor):
+        """generate batched input for different model type
         Args:
-            im (np.ndarray): image (np.ndarray)
-            im_info (dict): info of image
-            model_arch (str): model type
+            ims (list): preprocessed images (np.ndarray) of the same bucket
+            im_infos (list): info of every image
+            predictor (PooledPredictor): predictor owning the input buffers
         Returns:
             inputs (dict): input of model
         """
+        bucket = self.shape_buckets(ims[0].shape[1:])
         inputs = {}
-        inputs['image'] = np.array((im, )).astype('float32')
+        image = predictor.input_buffer(
+            "image", (len(ims), ims[0].shape[0]) + bucket, "float32")
+        image.fill(0)
+        for idx, im in enumerate(ims):
+            image[idx, :, :im.shape[1], :im.shape[2]] = im
+        inputs['image'] = image
         inputs['im_shape'] = np.array(
-            (im_info['im_shape'], )).astype('float32')
+            [im_info['im_shape'] for im_info in im_infos]).astype('float32')
         inputs['scale_factor'] = np.array(
-            (im_info['scale_factor'], )).astype('float32')
+            [im_info['scale_factor'] for im_info in im_infos]).astype(
+                'float32')
 
         return inputs
 
@@ -107,52 +120,101 @@ class DetPredictor(Predictor):
                             MaskRCNN's results include 'masks': np.ndarray:
                             shape: [N, im_h, im_w]
         '''
-        inputs = self.preprocess(image)
-        np_boxes = None
-        input_names = self.paddle_predictor.get_input_names()
-
-        for i in range(len(input_names)):
-            input_tensor = self.paddle_predictor.get_input_handle(input_names[
-                i])
-            input_tensor.copy_from_cpu(inputs[input_names[i]])
-
-        t1 = time.time()
-        self.paddle_predictor.run()
-        output_names = self.paddle_predictor.get_output_names()
-        boxes_tensor = self.paddle_predictor.get_output_handle(output_names[0])
-        np_boxes = boxes_tensor.copy_to_cpu()
-        t2 = time.time()
+        return self.predict_batch([image])[0]
 
-        print("Inference: {} ms per batch image".format((t2 - t1) * 1000.0))
+    def predict_batch(self, images):
+        '''
+        Args:
+            images (list): np.ndarray read by cv2, images are grouped by
+                shape bucket and every group runs in batches of batch_size
+        Returns:
+            results (list): detection results of every image, in the same
+                order as images
+        '''
+        batch_size = self.config["Global"].get("batch_size", 1)
+        with self.timer("preprocess"):
+            groups = {}
+            for idx, image in enumerate(images):
+                im, im_info = self.preprocess(image)
+                bucket = self.shape_buckets(im.shape[1:])
+                groups.setdefault(bucket, []).append((idx, im, im_info))
+
+        results = [None] * len(images)
+        for bucket in groups:
+            group = groups[bucket]
+            for start in range(0, len(group), batch_size):
+                batch = group[start:start + batch_size]
+                with self.predictor_pool.get() as predictor:
+                    with self.timer("inference"):
+                        inputs = self.create_inputs(
+                            [item[1] for item in batch],
+                            [item[2] for item in batch], predictor)
+                        outputs = predictor.run(inputs)
+                np_boxes = outputs[0]
+                if len(outputs) > 1:
+                    boxes_num = outputs[1]
+                else:
+                    assert len(batch) == 1, \
+                        "the model has no boxes_num output to split batch"
+                    boxes_num = [np_boxes.shape[0]]
+
+                with self.timer("postprocess"):
+                    offset = 0
+                    for item, num in zip(batch, boxes_num):
+                        num = int(num)
+                        results[item[0]] = self.postprocess(
+                            np_boxes[offset:offset + num])
+                        offset += num
+        return results
 
-        # do not perform postprocess in benchmark mode
-        results = []
-        if reduce(lambda x, y: x * y, np_boxes.shape) < 6:
+    def postprocess(self, np_boxes):
+        if np_boxes.ndim != 2 or reduce(lambda x, y: x * y,
+                                        np_boxes.shape) < 6:
             print('[WARNNING] No object detected.')
-            results = np.array([])
-        else:
-            results = np_boxes
-
-        results = self.parse_det_results(results,
-                                         self.config["Global"]["threshold"],
-                                         self.config["Global"]["labe_list"])
-        return results
+            return []
+        return self.parse_det_results(np_boxes,
+                                      self.config["Global"]["threshold"],
+                                      self.config["Global"]["labe_list"])
 
 
 def main(config):
     det_predictor = DetPredictor(config)
-    image_list = get_image_list(config["Global"]["infer_imgs"])
+    image_list = iter_image_list(
+        config["Global"]["infer_imgs"],
+        recursive=config["Global"].get("recursive", False))
+
+    batch_size = config["Global"]["batch_size"]
+    while True:
+        batch_files = list(itertools.islice(image_list, batch_size))
+        if len(batch_files) == 0:
+            break
+        batch_imgs = [
+            cv2.imread(image_file)[:, :, ::-1] for image_file in batch_files
+        ]
+        outputs = det_predictor.predict_batch(batch_imgs)
+        for image_file, output in zip(batch_files, outputs):
+            print(image_file, output)
+    det_predictor.timer.log_summary()
+    return
 
-    assert config["Global"]["batch_size"] == 1
-    for idx, image_file in enumerate(image_list):
-        img = cv2.imread(image_file)[:, :, ::-1]
-        output = det_predictor.predict(img)
-        print(output)
 
-    return
+def benchmark(config):
+    images = [
+        cv2.imread(image_file)[:, :, ::-1]
+        for image_file in get_image_list(config["Global"]["infer_imgs"])
+    ]
+
+    def run(predictor, batch):
+        predictor.predict_batch(batch)
+
+    return run_benchmark(DetPredictor, run, config, images, name="det")
 
 
 if __name__ == "__main__":
     args = config.parse_args()
     config = config.get_config(args.config, overrides=args.override, show=True)
-    main(config)
+    if config["Global"].get("enable_benchmark",
+                            False) and "Benchmark" in config:
+        benchmark(config)
+    else:
+        main(config)
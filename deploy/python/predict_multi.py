@@ -0,0 +1,114 @@
+# Copyright (c) 2021 PaddlePaddle Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import os
+import sys
+import json
+
+__dir__ = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.abspath(os.path.join(__dir__, '../')))
+
+import cv2
+import numpy as np
+
+from utils import logger
+from utils import config
+from utils.predictor import Predictor
+from utils.get_image_list import iter_image_list
+from python.preprocess import create_operators
+from python.postprocess import build_postprocess
+
+
+class MultiOutputPredictor(Predictor):
+    """
+    run an inference model exported with Arch.infer_output_keys, such as a
+    MultiHeadModel whose backbone is shared by the classification and the
+    retrieval branches, and return the outputs by key
+    """
+
+    def __init__(self, config):
+        super().__init__(config["Global"])
+        self.output_keys = self._load_output_keys(config["Global"])
+        self.preprocess_ops = []
+        if "PreProcess" in config:
+            self.preprocess_ops = create_operators(config["PreProcess"][
+                "transform_ops"])
+        # PostProcess of every output key
+        self.postprocess = {
+            key: build_postprocess(value)
+            for key, value in config.get("PostProcess", {}).items()
+        }
+        self.feature_normalize_keys = config["Global"].get(
+            "feature_normalize_keys", [])
+
+    def _load_output_keys(self, args):
+        keys_file = os.path.join(args.inference_model_dir,
+                                 "inference_output_keys.json")
+        if os.path.exists(keys_file):
+            with open(keys_file, "r") as f:
+                return json.load(f)
+        num_outputs = len(self.paddle_predictor.get_output_names())
+        return args.get("output_keys",
+                        ["output_{}".format(i) for i in range(num_outputs)])
+
+    def predict(self, images):
+        """
+        Returns:
+            outputs(dict): output key -> np.ndarray
+        """
+        if not isinstance(images, (list, )):
+            images = [images]
+        with self.timer("preprocess"):
+            for idx in range(len(images)):
+                for ops in self.preprocess_ops:
+                    images[idx] = ops(images[idx])
+
+        with self.predictor_pool.get() as predictor:
+            with self.timer("inference"):
+                image = predictor.stack_input(images)
+                batch_outputs = predictor.run(image)
+
+        outputs = dict(zip(self.output_keys, batch_outputs))
+        with self.timer("postprocess"):
+            for key in self.feature_normalize_keys:
+                feas_norm = np.sqrt(
+                    np.sum(np.square(outputs[key]), axis=1, keepdims=True))
+                outputs[key] = np.divide(outputs[key], feas_norm)
+        return outputs
+
+
+def main(config):
+    predictor = MultiOutputPredictor(config)
+    image_list = iter_image_list(
+        config["Global"]["infer_imgs"],
+        recursive=config["Global"].get("recursive", False))
+
+    assert config["Global"]["batch_size"] == 1
+    for idx, image_file in enumerate(image_list):
+        img = cv2.imread(image_file)[:, :, ::-1]
+        outputs = predictor.predict(img)
+        for key, output in outputs.items():
+            postprocess = predictor.postprocess.get(key, None)
+            if postprocess is not None:
+                output = postprocess(output, [image_file])
+            else:
+                output = "shape: {}".format(output.shape)
+            logger.info("{} {}: {}".format(image_file, key, output))
+    predictor.timer.log_summary()
+    return
+
+
+if __name__ == "__main__":
+    args = config.parse_args()
+    config = config.get_config(args.config, overrides=args.override, show=True)
+    main(config)
@@ -23,7 +23,8 @@ import numpy as np
 from utils import logger
 from utils import config
 from utils.predictor import Predictor
-from utils.get_image_list import get_image_list
+from utils.benchmark import run_benchmark
+from utils.get_image_list import get_image_list, iter_image_list
 from preprocess import create_operators
 from postprocess import build_postprocess
 
@@ -37,35 +38,32 @@ class RecPredictor(Predictor):
         self.postprocess = build_postprocess(config["RecPostProcess"])
 
     def predict(self, images, feature_normalize=True):
-        input_names = self.paddle_predictor.get_input_names()
-        input_tensor = self.paddle_predictor.get_input_handle(input_names[0])
-
-        output_names = self.paddle_predictor.get_output_names()
-        output_tensor = self.paddle_predictor.get_output_handle(output_names[
-            0])
-
         if not isinstance(images, (list, )):
             images = [images]
-        for idx in range(len(images)):
-            for ops in self.preprocess_ops:
-                images[idx] = ops(images[idx])
-        image = np.array(images)
-
-        input_tensor.copy_from_cpu(image)
-        self.paddle_predictor.run()
-        batch_output = output_tensor.copy_to_cpu()
-        
-        if feature_normalize:
-            feas_norm = np.sqrt(
-                np.sum(np.square(batch_output), axis=1, keepdims=True))
-            batch_output = np.divide(batch_output, feas_norm)
-            
+        with self.timer("preprocess"):
+            for idx in range(len(images)):
+                for ops in self.preprocess_ops:
+                    images[idx] = ops(images[idx])
+
+        with self.predictor_pool.get() as predictor:
+            with self.timer("inference"):
+                image = predictor.stack_input(images)
+                batch_output = predictor.run(image)[0]
+
+        with self.timer("postprocess"):
+            if feature_normalize:
+                feas_norm = np.sqrt(
+                    np.sum(np.square(batch_output), axis=1, keepdims=True))
+                batch_output = np.divide(batch_output, feas_norm)
+
         return batch_output
 
 
 def main(config):
     rec_predictor = RecPredictor(config)
-    image_list = get_image_list(config["Global"]["infer_imgs"])
+    image_list = iter_image_list(
+        config["Global"]["infer_imgs"],
+        recursive=config["Global"].get("recursive", False))
 
     assert config["Global"]["batch_size"] == 1
     for idx, image_file in enumerate(image_list):
@@ -75,10 +73,30 @@ def main(config):
         if rec_predictor.postprocess is not None:
             output = rec_predictor.postprocess(output)
         print(output)
+    rec_predictor.timer.log_summary()
     return
 
 
+def benchmark(config):
+    images = [
+        cv2.imread(image_file)[:, :, ::-1]
+        for image_file in get_image_list(config["Global"]["infer_imgs"])
+    ]
+
+    def run(predictor, batch):
+        output = predictor.predict(batch)
+        if predictor.postprocess is not None:
+            with predictor.timer("postprocess"):
+                predictor.postprocess(output)
+
+    return run_benchmark(RecPredictor, run, config, images, name="rec")
+
+
 if __name__ == "__main__":
     args = config.parse_args()
     config = config.get_config(args.config, overrides=args.override, show=True)
-    main(config)
+    if config["Global"].get("enable_benchmark",
+                            False) and "Benchmark" in config:
+        benchmark(config)
+    else:
+        main(config)
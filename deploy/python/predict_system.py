@@ -18,19 +18,37 @@ __dir__ = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(os.path.abspath(os.path.join(__dir__, '../')))
 
 import copy
+import json
+from functools import partial
+
 import cv2
 import numpy as np
 
 from python.predict_rec import RecPredictor
 from python.predict_det import DetPredictor
-from vector_search import Graph_Index
+from vector_search import Graph_Index, SharedGraphIndex
 
 from utils import logger
 from utils import config
-from utils.get_image_list import get_image_list
+from utils.get_image_list import get_image_list, iter_image_list
+from utils.benchmark import StageTimer, run_benchmark
+from utils.result_cache import build_result_cache, content_key
 from utils.draw_bbox import draw_bbox_results
 
 
+def _filter_key(search_filter):
+    if search_filter is None:
+        return None
+    if isinstance(search_filter, np.ndarray):
+        return "filter_" + content_key(search_filter)
+    return json.dumps(search_filter, sort_keys=True)
+
+
+def decode_image(data):
+    img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    return img[:, :, ::-1]
+
+
 class SystemPredictor(object):
     def __init__(self, config):
 
@@ -42,9 +60,26 @@ class SystemPredictor(object):
         self.return_k = self.config['IndexProcess']['return_k']
         self.search_budget = self.config['IndexProcess']['search_budget']
 
-        self.Searcher = Graph_Index(
-            dist_type=config['IndexProcess']['dist_type'])
-        self.Searcher.load(config['IndexProcess']['index_path'])
+        index_path = config['IndexProcess']['index_path']
+        exact_search_threshold = config['IndexProcess'].get(
+            'exact_search_threshold', 10000)
+        if os.path.isfile(index_path):
+            # a packed index is shared by the worker processes and reloaded
+            # when a new version replaces the file
+            self.Searcher = SharedGraphIndex(
+                index_path,
+                check_interval=config['IndexProcess'].get(
+                    'reload_interval', 10),
+                exact_search_threshold=exact_search_threshold)
+        else:
+            self.Searcher = Graph_Index(
+                dist_type=config['IndexProcess']['dist_type'],
+                exact_search_threshold=exact_search_threshold)
+            self.Searcher.load(index_path)
+        self.timer = StageTimer(config["Global"].get("enable_benchmark",
+                                                     False))
+        self.result_cache = build_result_cache(config.get("ResultCache",
+                                                          None))
 
     def append_self(self, results, shape):
         results.append({
@@ -83,10 +118,51 @@ class SystemPredictor(object):
 
         return filtered_results
 
-    def predict(self, img):
+    def predict(self, img, search_filter=None):
+        """
+        Args:
+            img(np.ndarray): decoded image
+            search_filter(dict): optional attribute filter of the gallery,
+                such as {"store": 3}, see Graph_Index.filter_ids
+        """
+        predict_fn = partial(self._predict, search_filter=search_filter)
+        if self.result_cache is None:
+            return predict_fn(img)
+        return self.result_cache.predict(
+            predict_fn, image=img, extra_key=self._cache_key(search_filter))
+
+    def predict_encoded(self, data, search_filter=None):
+        """
+        predict an encoded image, the image is not decoded when the result
+        is found in the result cache
+        Args:
+            data(bytes): encoded image, such as the content of a jpeg file
+            search_filter(dict): optional attribute filter of the gallery
+        """
+        predict_fn = partial(self._predict, search_filter=search_filter)
+        if self.result_cache is None:
+            return predict_fn(decode_image(data))
+        return self.result_cache.predict(
+            predict_fn,
+            data=data,
+            decode_fn=decode_image,
+            extra_key=self._cache_key(search_filter))
+
+    def _cache_key(self, search_filter):
+        key = _filter_key(search_filter)
+        if isinstance(self.Searcher, SharedGraphIndex):
+            # look for a new version of the index before the cache lookup,
+            # the results of the old version are dropped
+            if self.Searcher.maybe_reload():
+                self.result_cache.clear()
+            key = "{}@{}".format(key, self.Searcher.version)
+        return key
+
+    def _predict(self, img, search_filter=None):
         output = []
         # st1: get all detection results
-        results = self.det_predictor.predict(img)
+        with self.timer("detection"):
+            results = self.det_predictor.predict(img)
 
         # st2: add the whole image for recognition to improve recall
         results = self.append_self(results, img.shape)
@@ -96,39 +172,70 @@ class SystemPredictor(object):
             preds = {}
             xmin, ymin, xmax, ymax = result["bbox"].astype("int")
             crop_img = img[ymin:ymax, xmin:xmax, :].copy()
-            rec_results = self.rec_predictor.predict(crop_img)
+            with self.timer("recognition"):
+                rec_results = self.rec_predictor.predict(crop_img)
             preds["bbox"] = [xmin, ymin, xmax, ymax]
-            scores, docs = self.Searcher.search(
-                query=rec_results,
-                return_k=self.return_k,
-                search_budget=self.search_budget)
+            with self.timer("search"):
+                scores, docs = self.Searcher.search(
+                    query=rec_results,
+                    return_k=self.return_k,
+                    search_budget=self.search_budget,
+                    filter=search_filter)
             # just top-1 result will be returned for the final
-            if scores[0] >= self.config["IndexProcess"]["score_thres"]:
+            if len(scores) > 0 and scores[0] >= self.config["IndexProcess"][
+                    "score_thres"]:
                 preds["rec_docs"] = docs[0]
                 preds["rec_scores"] = scores[0]
                 output.append(preds)
 
         # st5: nms to the final results to avoid fetching duplicate results
-        output = self.nms_to_rec_results(
-            output, self.config["Global"]["rec_nms_thresold"])
+        with self.timer("postprocess"):
+            output = self.nms_to_rec_results(
+                output, self.config["Global"]["rec_nms_thresold"])
 
         return output
 
 
 def main(config):
     system_predictor = SystemPredictor(config)
-    image_list = get_image_list(config["Global"]["infer_imgs"])
+    image_list = iter_image_list(
+        config["Global"]["infer_imgs"],
+        recursive=config["Global"].get("recursive", False))
 
     assert config["Global"]["batch_size"] == 1
     for idx, image_file in enumerate(image_list):
         img = cv2.imread(image_file)[:, :, ::-1]
-        output = system_predictor.predict(img)
+        output = system_predictor.predict(
+            img, config["IndexProcess"].get("search_filter", None))
         draw_bbox_results(img, output, image_file)
         print(output)
+    system_predictor.timer.log_summary()
+    system_predictor.det_predictor.timer.log_summary(prefix="det ")
+    system_predictor.rec_predictor.timer.log_summary(prefix="rec ")
+    if system_predictor.result_cache is not None:
+        system_predictor.result_cache.log_summary()
     return
 
 
+def benchmark(config):
+    images = [
+        cv2.imread(image_file)[:, :, ::-1]
+        for image_file in get_image_list(config["Global"]["infer_imgs"])
+    ]
+
+    def run(predictor, batch):
+        for img in batch:
+            predictor.predict(img)
+
+    return run_benchmark(
+        SystemPredictor, run, config, images, name="system")
+
+
 if __name__ == "__main__":
     args = config.parse_args()
     config = config.get_config(args.config, overrides=args.override, show=True)
-    main(config)
+    if config["Global"].get("enable_benchmark",
+                            False) and "Benchmark" in config:
+        benchmark(config)
+    else:
+        main(config)
@@ -63,7 +63,7 @@ class Net(paddle.nn.Layer):
 def main():
     args = parse_args()
 
-    net = backbone.__dict__[args.model]
+    net = backbone.get_backbone(args.model)
     model = Net(net, args.class_dim, args.model)
 
     # get QAT model
@@ -0,0 +1,232 @@
+# copyright (c) 2021 PaddlePaddle Authors. All Rights Reserve.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import importlib.util
+import os
+import sys
+import time
+__dir__ = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.abspath(os.path.join(__dir__, '..', '..', '..')))
+sys.path.append(os.path.abspath(os.path.join(__dir__, '..', '..')))
+
+import numpy as np
+import paddle
+from paddleslim.quant import quant_post_static
+
+from ppcls.data import build_dataloader
+from ppcls.utils import logger
+from ppcls.utils.config import get_config
+from ppcls.utils.logger import init_logger
+from ppcls.utils.save_load import load_dygraph_pretrain
+
+from utils.config import AttrDict
+from utils.predictor import Predictor
+
+
+def _load_export_model():
+    # export_model.py next to this script is the QAT export script, so
+    # tools/export_model.py is loaded by its path instead of by name
+    path = os.path.abspath(
+        os.path.join(__dir__, '..', '..', '..', 'tools', 'export_model.py'))
+    spec = importlib.util.spec_from_file_location("tools_export_model", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.ExportModel
+
+
+ExportModel = _load_export_model()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        "PaddleClas post-training static quantization script")
+    parser.add_argument(
+        '-c',
+        '--config',
+        type=str,
+        default='configs/config.yaml',
+        help='config file path')
+    parser.add_argument(
+        '-o',
+        '--override',
+        action='append',
+        default=[],
+        help='config options to be overridden')
+    parser.add_argument(
+        '--calib_batch_nums',
+        type=int,
+        default=10,
+        help='number of Eval batches used to calibrate activation ranges')
+    parser.add_argument(
+        '--algo',
+        type=str,
+        default='KL',
+        choices=['KL', 'hist', 'avg', 'mse', 'abs_max'],
+        help='calibration algorithm of activation ranges')
+    parser.add_argument(
+        '--eval_batch_nums',
+        type=int,
+        default=None,
+        help='number of Eval batches used to compare accuracy and latency, '
+        'default is the whole Eval dataset')
+    parser.add_argument(
+        '--cpu_num_threads',
+        type=int,
+        default=10,
+        help='cpu threads of the MKLDNN predictors used for comparison')
+    return parser.parse_args()
+
+
+class EvalPredictor(Predictor):
+    def predict(self, images):
+        with self.predictor_pool.get() as predictor:
+            return predictor.run(images)[0]
+
+
+def export_fp32_model(config, save_dir):
+    model = ExportModel(config["Arch"])
+    if config["Global"]["pretrained_model"] is not None:
+        load_dygraph_pretrain(model.base_model,
+                              config["Global"]["pretrained_model"])
+    model.eval()
+    model = paddle.jit.to_static(
+        model,
+        input_spec=[
+            paddle.static.InputSpec(
+                shape=[None] + config["Global"]["image_shape"],
+                dtype='float32')
+        ])
+    paddle.jit.save(model, os.path.join(save_dir, "inference"))
+    logger.info("fp32 inference model is saved to {}".format(save_dir))
+
+
+def collect_calib_data(config, device, batch_nums):
+    eval_dataloader = build_dataloader(config["DataLoader"], "Eval", device)
+    calib_data = []
+    for iter_id, batch in enumerate(eval_dataloader()):
+        if iter_id >= batch_nums:
+            break
+        calib_data.append(batch[0].numpy().astype("float32"))
+    logger.info("collect {} batches for calibration".format(len(calib_data)))
+    return calib_data
+
+
+def quantize(calib_data, fp32_dir, int8_dir, algo):
+    def batch_generator():
+        for data in calib_data:
+            yield [data]
+
+    paddle.enable_static()
+    exe = paddle.static.Executor(paddle.CPUPlace())
+    quant_post_static(
+        executor=exe,
+        model_dir=fp32_dir,
+        quantize_model_path=int8_dir,
+        batch_generator=batch_generator,
+        model_filename="inference.pdmodel",
+        params_filename="inference.pdiparams",
+        save_model_filename="inference.pdmodel",
+        save_params_filename="inference.pdiparams",
+        batch_nums=len(calib_data),
+        algo=algo,
+        weight_quantize_type="channel_wise_abs_max")
+    paddle.disable_static()
+    logger.info("int8 inference model is saved to {}".format(int8_dir))
+
+
+def create_predictor(config, model_dir, cpu_num_threads):
+    args = AttrDict({
+        "inference_model_dir": model_dir,
+        "batch_size": config["DataLoader"]["Eval"]["sampler"]["batch_size"],
+        "use_gpu": False,
+        "enable_mkldnn": True,
+        "cpu_num_threads": cpu_num_threads,
+        "use_fp16": False,
+        "use_tensorrt": False,
+        "ir_optim": True,
+        "gpu_mem": 8000,
+        "enable_profile": False,
+    })
+    return EvalPredictor(args)
+
+
+def evaluate(predictors, config, device, batch_nums=None):
+    """
+    run every predictor on the same Eval batches
+    Returns:
+        results(dict): name -> (top1 accuracy, average latency per batch)
+    """
+    eval_dataloader = build_dataloader(config["DataLoader"], "Eval", device)
+    correct = {name: 0 for name in predictors}
+    costs = {name: [] for name in predictors}
+    total = 0
+    for iter_id, batch in enumerate(eval_dataloader()):
+        if batch_nums is not None and iter_id >= batch_nums:
+            break
+        images = batch[0].numpy().astype("float32")
+        labels = batch[1].numpy().reshape([-1])
+        total += labels.shape[0]
+        for name, predictor in predictors.items():
+            tic = time.perf_counter()
+            output = predictor.predict(images)
+            costs[name].append(time.perf_counter() - tic)
+            correct[name] += int((output.argmax(axis=1) == labels).sum())
+        if iter_id % config["Global"]["print_batch_step"] == 0:
+            logger.info("[Eval][Iter: {}] {}".format(iter_id, ", ".join([
+                "{} top1: {:.5f}".format(name, correct[name] / total)
+                for name in predictors
+            ])))
+    # skip the first batches which include the warmup of mkldnn
+    return {
+        name: (correct[name] / total, np.mean(costs[name][min(
+            5, len(costs[name]) - 1):]))
+        for name in predictors
+    }
+
+
+def main(args):
+    config = get_config(args.config, overrides=args.override, show=False)
+    init_logger(name='root')
+    device = paddle.set_device(config["Global"]["device"])
+    save_dir = config["Global"]["save_inference_dir"]
+    fp32_dir = os.path.join(save_dir, "fp32")
+    int8_dir = os.path.join(save_dir, "int8")
+
+    export_fp32_model(config, fp32_dir)
+    calib_data = collect_calib_data(config, device, args.calib_batch_nums)
+    quantize(calib_data, fp32_dir, int8_dir, args.algo)
+
+    predictors = {
+        "fp32": create_predictor(config, fp32_dir, args.cpu_num_threads),
+        "int8": create_predictor(config, int8_dir, args.cpu_num_threads),
+    }
+    results = evaluate(predictors, config, device, args.eval_batch_nums)
+    fp32_acc, fp32_cost = results["fp32"]
+    int8_acc, int8_cost = results["int8"]
+    logger.info("fp32 top1: {:.5f}, latency: {:.2f} ms/batch".format(
+        fp32_acc, fp32_cost * 1000))
+    logger.info("int8 top1: {:.5f}, latency: {:.2f} ms/batch".format(
+        int8_acc, int8_cost * 1000))
+    logger.info("top1 delta: {:.5f}, speedup: {:.2f}x".format(
+        int8_acc - fp32_acc, fp32_cost / int8_cost))
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    main(args)
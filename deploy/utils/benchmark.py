@@ -0,0 +1,223 @@
+# Copyright (c) 2021 PaddlePaddle Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import csv
+import json
+import time
+import random
+import itertools
+import contextlib
+from collections import OrderedDict
+
+import numpy as np
+
+from utils import logger
+
+
+class _StageCosts(object):
+    """
+    exact count and sum of the costs of a stage, and a uniform reservoir
+    sample of at most max_samples costs for the percentiles
+    """
+
+    def __init__(self, max_samples, rng):
+        self.count = 0
+        self.total = 0.
+        self.samples = []
+        self.max_samples = max_samples
+        self.rng = rng
+
+    def add(self, cost):
+        self.count += 1
+        self.total += cost
+        if len(self.samples) < self.max_samples:
+            self.samples.append(cost)
+        else:
+            i = self.rng.randrange(self.count)
+            if i < self.max_samples:
+                self.samples[i] = cost
+
+
+class StageTimer(object):
+    """
+    record the cost of every stage (preprocess, inference, postprocess, ...)
+    Args:
+        enable(bool): when False, all records are skipped
+        max_samples(int): max number of costs kept per stage to estimate the
+            percentiles, so the memory stays bounded in long running services
+    """
+
+    def __init__(self, enable=True, max_samples=10000):
+        self.enable = enable
+        self.max_samples = max_samples
+        self._rng = random.Random(0)
+        self.costs = OrderedDict()
+
+    @contextlib.contextmanager
+    def __call__(self, stage):
+        if not self.enable:
+            yield
+            return
+        tic = time.perf_counter()
+        yield
+        if stage not in self.costs:
+            self.costs[stage] = _StageCosts(self.max_samples, self._rng)
+        self.costs[stage].add(time.perf_counter() - tic)
+
+    def reset(self):
+        self.costs = OrderedDict()
+
+    def summary(self):
+        """
+        Returns:
+            summary(dict): stage name -> {count, avg, p50, p90, p99} in ms,
+                count and avg are exact, the percentiles are estimated from
+                the sampled costs
+        """
+        summary = OrderedDict()
+        for stage, costs in self.costs.items():
+            summary[stage] = latency_stats(costs.samples)
+            summary[stage]["count"] = costs.count
+            summary[stage]["avg"] = costs.total / costs.count * 1000
+        return summary
+
+    def log_summary(self, prefix=""):
+        for stage, stats in self.summary().items():
+            logger.info("{}{}: count: {}, avg: {:.3f} ms, p50: {:.3f} ms, "
+                        "p90: {:.3f} ms, p99: {:.3f} ms".format(
+                            prefix, stage, stats["count"], stats["avg"],
+                            stats["p50"], stats["p90"], stats["p99"]))
+
+
+def latency_stats(costs):
+    costs = np.array(costs) * 1000
+    return OrderedDict([
+        ("count", len(costs)),
+        ("avg", float(costs.mean())),
+        ("p50", float(np.percentile(costs, 50))),
+        ("p90", float(np.percentile(costs, 90))),
+        ("p99", float(np.percentile(costs, 99))),
+    ])
+
+
+def _as_list(value):
+    return list(value) if isinstance(value, (list, tuple)) else [value]
+
+
+def run_benchmark(build_fn, run_fn, config, images, name="predictor"):
+    """
+    sweep batch_size/cpu_num_threads/enable_mkldnn and time the predictor
+    Args:
+        build_fn(callable): build a predictor from config
+        run_fn(callable): run_fn(predictor, batch) runs one batch end to end
+        config(dict): full inference config, sweep settings are read from
+            the optional `Benchmark` section and default to `Global`
+        images(list): decoded images used to fill the batches
+        name(str): predictor name written in the report
+    Returns:
+        results(list): one report dict per setting
+    """
+    global_config = config["Global"]
+    bench_config = config.get("Benchmark", None) or {}
+    batch_sizes = _as_list(
+        bench_config.get("batch_size", global_config["batch_size"]))
+    cpu_num_threads = _as_list(
+        bench_config.get("cpu_num_threads", global_config["cpu_num_threads"]))
+    enable_mkldnn = _as_list(
+        bench_config.get("enable_mkldnn", global_config["enable_mkldnn"]))
+    warmup = bench_config.get("warmup", 10)
+    repeats = bench_config.get("repeats", 100)
+    assert len(images) > 0, "no image is found to run benchmark"
+
+    origin = {
+        key: global_config[key]
+        for key in ["batch_size", "cpu_num_threads", "enable_mkldnn"]
+    }
+    results = []
+    for batch_size, num_threads, mkldnn in itertools.product(
+            batch_sizes, cpu_num_threads, enable_mkldnn):
+        if global_config["use_gpu"] and (mkldnn or num_threads !=
+                                         cpu_num_threads[0]):
+            # cpu settings have no effect on gpu, skip the duplicates
+            continue
+        global_config["batch_size"] = batch_size
+        global_config["cpu_num_threads"] = num_threads
+        global_config["enable_mkldnn"] = mkldnn
+        global_config["enable_benchmark"] = True
+        predictor = build_fn(config)
+
+        batches = itertools.cycle([
+            images[i:i + batch_size]
+            for i in range(0, len(images), batch_size)
+        ])
+        for _ in range(warmup):
+            run_fn(predictor, [img.copy() for img in next(batches)])
+        predictor.timer.reset()
+
+        e2e_costs = []
+        num_images = 0
+        for _ in range(repeats):
+            batch = [img.copy() for img in next(batches)]
+            tic = time.perf_counter()
+            run_fn(predictor, batch)
+            e2e_costs.append(time.perf_counter() - tic)
+            num_images += len(batch)
+
+        result = OrderedDict([
+            ("predictor", name),
+            ("use_gpu", global_config["use_gpu"]),
+            ("batch_size", batch_size),
+            ("cpu_num_threads", num_threads),
+            ("enable_mkldnn", mkldnn),
+            ("throughput", num_images / sum(e2e_costs)),
+        ])
+        stages = predictor.timer.summary()
+        stages["total"] = latency_stats(e2e_costs)
+        for stage, stats in stages.items():
+            for key in ["avg", "p50", "p90", "p99"]:
+                result["{}_{}".format(stage, key)] = stats[key]
+        logger.info("[Benchmark] {}".format(", ".join([
+            "{}: {:.3f}".format(k, v) if isinstance(v, float) else
+            "{}: {}".format(k, v) for k, v in result.items()
+        ])))
+        results.append(result)
+        del predictor
+
+    global_config.update(origin)
+    save_path = bench_config.get("save_path", None)
+    if save_path is not None:
+        save_report(results, save_path)
+    return results
+
+
+def save_report(results, save_path):
+    """
+    save benchmark results as json or csv according to the file extension
+    """
+    save_dir = os.path.dirname(save_path)
+    if save_dir:
+        os.makedirs(save_dir, exist_ok=True)
+    if save_path.endswith(".csv"):
+        fields = []
+        for result in results:
+            fields += [key for key in result if key not in fields]
+        with open(save_path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=fields)
+            writer.writeheader()
+            writer.writerows(results)
+    else:
+        with open(save_path, "w") as f:
+            json.dump(results, f, indent=4)
+    logger.info("benchmark report is saved in {}".format(save_path))
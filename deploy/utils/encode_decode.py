@@ -14,6 +14,7 @@
 
 import base64
 
+import cv2
 import numpy as np
 
 
@@ -28,4 +29,24 @@ def b64_to_np(b64str, revert_params):
     dtype = getattr(np, dtype) if isinstance(str, type(dtype)) else dtype
     data = base64.b64decode(b64str.encode('utf8'))
     data = np.fromstring(data, dtype).reshape(shape)
-    return data
\ No newline at end of file
+    return data
+
+
+def bytes_to_b64(data):
+    """
+    encode the bytes of an image file, such as jpeg or png, without decoding
+    """
+    return base64.b64encode(data).decode('utf8')
+
+
+def b64_to_image(b64str):
+    """
+    decode a base64 encoded image file into a RGB HWC uint8 image, the same
+    as cv2.imread(path)[:, :, ::-1], returns None if the bytes are not an
+    image, malformed base64 raises binascii.Error
+    """
+    data = base64.b64decode(b64str.encode('utf8'))
+    img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        return None
+    return img[:, :, ::-1]
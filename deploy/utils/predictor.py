@@ -12,15 +12,19 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import os
+import queue
 import argparse
 import base64
 import shutil
+import contextlib
 import cv2
 import numpy as np
 
 from paddle.inference import Config
 from paddle.inference import create_predictor
 
+from utils.benchmark import StageTimer
+
 
 class Predictor(object):
     def __init__(self, args, inference_model_dir=None):
@@ -28,8 +32,13 @@ class Predictor(object):
         if args.use_fp16 is True:
             assert args.use_tensorrt is True
         self.args = args
-        self.paddle_predictor = self.create_paddle_predictor(
-            args, inference_model_dir)
+        self.predictor_pool = PredictorPool(
+            self.create_paddle_predictor(args, inference_model_dir),
+            args.get("predictor_pool_size", 1))
+        # kept for the callers that drive the paddle predictor directly
+        self.paddle_predictor = self.predictor_pool.main_predictor
+        # record preprocess/inference/postprocess cost when benchmarking
+        self.timer = StageTimer(args.get("enable_benchmark", False))
 
     def predict(self, image):
         raise NotImplementedError
@@ -67,3 +76,109 @@ class Predictor(object):
         predictor = create_predictor(config)
 
         return predictor
+
+
+class PooledPredictor(object):
+    """
+    a paddle predictor with cached input/output handles and reused input
+    buffers, it must be used by only one thread at a time
+    Args:
+        paddle_predictor: predictor created by create_predictor or clone()
+    """
+
+    def __init__(self, paddle_predictor):
+        self.paddle_predictor = paddle_predictor
+        self.input_names = paddle_predictor.get_input_names()
+        self.input_handles = [
+            paddle_predictor.get_input_handle(name)
+            for name in self.input_names
+        ]
+        self.output_names = paddle_predictor.get_output_names()
+        self.output_handles = [
+            paddle_predictor.get_output_handle(name)
+            for name in self.output_names
+        ]
+        self._buffers = {}
+
+    def input_buffer(self, name, shape, dtype="float32"):
+        """
+        get a preallocated array for the input, it is reused until the shape
+        or dtype of the input changes
+        """
+        shape = tuple(shape)
+        buffer = self._buffers.get(name, None)
+        if buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+            buffer = np.empty(shape, dtype=dtype)
+            self._buffers[name] = buffer
+        return buffer
+
+    def stack_input(self, images, name=None):
+        """
+        stack the preprocessed images into the reused input buffer
+        """
+        if name is None:
+            name = self.input_names[0]
+        images = [np.asarray(image) for image in images]
+        buffer = self.input_buffer(name, (len(images), ) + images[0].shape,
+                                   images[0].dtype)
+        for idx, image in enumerate(images):
+            buffer[idx] = image
+        return buffer
+
+    def run(self, inputs):
+        """
+        Args:
+            inputs(dict|list|np.ndarray): a dict from input name to data, or
+                the data of inputs in the order of input names
+        Returns:
+            outputs(list): np.ndarray of every output
+        """
+        if isinstance(inputs, np.ndarray):
+            inputs = [inputs]
+        if isinstance(inputs, dict):
+            inputs = [inputs[name] for name in self.input_names]
+        for handle, data in zip(self.input_handles, inputs):
+            handle.copy_from_cpu(data)
+        self.paddle_predictor.run()
+        return [handle.copy_to_cpu() for handle in self.output_handles]
+
+
+class PredictorPool(object):
+    """
+    a pool of predictors sharing the weights of one paddle predictor through
+    clone(), each request thread checks out one predictor, uses it and
+    returns it, checkout blocks when all predictors are busy
+    Args:
+        paddle_predictor: predictor created by create_predictor
+        pool_size(int): number of predictors in the pool
+    """
+
+    def __init__(self, paddle_predictor, pool_size=1):
+        assert pool_size >= 1, "pool_size should be larger than 0"
+        self.main_predictor = paddle_predictor
+        self.pool_size = pool_size
+        self._queue = queue.Queue(maxsize=pool_size)
+        self._queue.put(PooledPredictor(paddle_predictor))
+        for _ in range(pool_size - 1):
+            self._queue.put(PooledPredictor(paddle_predictor.clone()))
+
+    def checkout(self, timeout=None):
+        """
+        get a free predictor, wait at most timeout seconds if it is not None
+        """
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError("no free predictor in {} seconds".format(
+                timeout))
+
+    def checkin(self, predictor):
+        self._queue.put(predictor)
+
+    @contextlib.contextmanager
+    def get(self, timeout=None):
+        predictor = self.checkout(timeout)
+        try:
+            yield predictor
+        finally:
+            self.checkin(predictor)
@@ -0,0 +1,354 @@
+# Copyright (c) 2021 PaddlePaddle Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys
+import copy
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+from utils import logger
+
+HASH_TYPES = ["dhash", "phash"]
+
+
+def content_key(data, extra_key=None):
+    """
+    exact hash of the encoded bytes, or of the pixels of a decoded image
+    Args:
+        data(bytes|np.ndarray): encoded image or decoded image
+        extra_key(str): other inputs the result depends on, such as the
+            search filter
+    """
+    hasher = hashlib.blake2b(digest_size=16)
+    if extra_key is not None:
+        hasher.update(extra_key.encode())
+    if isinstance(data, np.ndarray):
+        hasher.update("{}{}".format(data.shape, data.dtype).encode())
+        data = np.ascontiguousarray(data).data
+    hasher.update(data)
+    return hasher.hexdigest()
+
+
+def _gray(img):
+    img = np.asarray(img, dtype=np.float32)
+    if img.ndim == 3:
+        img = img[:, :, :3].mean(axis=2)
+    return img
+
+
+def dhash(img, hash_size=8):
+    """
+    difference hash, every bit tells whether a pixel of the downscaled gray
+    image is brighter than its right neighbour
+    Returns:
+        hash(int): hash_size * hash_size bits
+    """
+    small = cv2.resize(
+        _gray(img), (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    return _pack_bits(small[:, 1:] > small[:, :-1])
+
+
+_dct_matrix_cache = {}
+
+
+def _dct_matrix(size):
+    if size not in _dct_matrix_cache:
+        k = np.arange(size).reshape([-1, 1])
+        n = np.arange(size).reshape([1, -1])
+        matrix = np.cos(np.pi * (2 * n + 1) * k / (2 * size)) * np.sqrt(
+            2. / size)
+        matrix[0] /= np.sqrt(2.)
+        _dct_matrix_cache[size] = matrix.astype(np.float32)
+    return _dct_matrix_cache[size]
+
+
+def phash(img, hash_size=8, highfreq_factor=4):
+    """
+    perceptual hash, every bit tells whether a low frequency DCT coefficient
+    of the downscaled gray image is above their median
+    Returns:
+        hash(int): hash_size * hash_size bits
+    """
+    size = hash_size * highfreq_factor
+    small = cv2.resize(_gray(img), (size, size), interpolation=cv2.INTER_AREA)
+    dct = _dct_matrix(size)
+    low = (dct @ small @ dct.T)[:hash_size, :hash_size]
+    # the DC coefficient only carries the mean brightness
+    return _pack_bits(low > np.median(low.reshape([-1])[1:]))
+
+
+def _pack_bits(bits):
+    value = 0
+    for bit in bits.reshape([-1]):
+        value = (value << 1) | int(bit)
+    return value
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count("1")
+
+
+def estimate_nbytes(value):
+    """
+    rough size of a cached result in bytes
+    """
+    if isinstance(value, np.ndarray):
+        return value.nbytes + sys.getsizeof(value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(
+            estimate_nbytes(k) + estimate_nbytes(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(estimate_nbytes(v) for v in value)
+    return sys.getsizeof(value)
+
+
+class _Entry(object):
+    __slots__ = ["value", "phash", "nbytes", "expire"]
+
+    def __init__(self, value, phash, nbytes, expire):
+        self.value = value
+        self.phash = phash
+        self.nbytes = nbytes
+        self.expire = expire
+
+
+class ResultCache(object):
+    """
+    LRU cache of prediction results, keyed by the exact hash of the encoded
+    bytes of an image, and optionally by a perceptual hash of the decoded
+    image to also catch near-duplicates. An exact hit skips decoding and
+    prediction, a perceptual hit skips prediction. It is thread safe.
+    Args:
+        capacity(int): max number of cached results
+        max_bytes(int): max estimated size of the cached results, 0 means
+            no limit
+        ttl(float): seconds a result stays valid, 0 means forever
+        hash_type(str): None, dhash or phash, None disables the
+            near-duplicate lookup
+        hash_size(int): the perceptual hash has hash_size ** 2 bits
+        max_distance(int): max hamming distance between the perceptual
+            hashes of near-duplicates, lookups with a distance above 0 scan
+            all the entries
+    """
+
+    def __init__(self,
+                 capacity=10000,
+                 max_bytes=0,
+                 ttl=0,
+                 hash_type=None,
+                 hash_size=8,
+                 max_distance=0):
+        assert capacity > 0, "capacity should be larger than 0"
+        assert hash_type is None or hash_type in HASH_TYPES, \
+            "hash_type should be None or one of {}, but got {}".format(
+                HASH_TYPES, hash_type)
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hash_type = hash_type
+        self.hash_size = hash_size
+        self.max_distance = max_distance
+        self._entries = OrderedDict()
+        # perceptual hash -> content key of the latest entry with it
+        self._phash_index = {}
+        self._nbytes = 0
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.stats = {
+            "exact_hits": 0,
+            "perceptual_hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0,
+        }
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def nbytes(self):
+        return self._nbytes
+
+    def perceptual_hash(self, img):
+        if self.hash_type == "dhash":
+            return dhash(img, self.hash_size)
+        return phash(img, self.hash_size)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._nbytes -= entry.nbytes
+        if entry.phash is not None and self._phash_index.get(
+                entry.phash) == key:
+            del self._phash_index[entry.phash]
+        return entry
+
+    def _get_entry(self, key, now):
+        entry = self._entries.get(key, None)
+        if entry is None:
+            return None
+        if entry.expire is not None and entry.expire <= now:
+            self._remove(key)
+            self.stats["expirations"] += 1
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def get(self, key):
+        """
+        Returns:
+            value: the cached result of the content key, None if missed
+        """
+        with self._lock:
+            entry = self._get_entry(key, time.time())
+            if entry is None:
+                return None
+            self.stats["exact_hits"] += 1
+            return copy.deepcopy(entry.value)
+
+    def get_similar(self, phash):
+        """
+        Args:
+            phash(tuple): (extra_key, perceptual hash) of the image
+        Returns:
+            value: the cached result of a near-duplicate, None if missed
+        """
+        with self._lock:
+            now = time.time()
+            key = self._phash_index.get(phash, None)
+            if key is None and self.max_distance > 0:
+                for other, other_key in self._phash_index.items():
+                    if other[0] == phash[0] and hamming_distance(
+                            phash[1], other[1]) <= self.max_distance:
+                        key = other_key
+                        break
+            entry = None if key is None else self._get_entry(key, now)
+            if entry is None:
+                return None
+            self.stats["perceptual_hits"] += 1
+            return copy.deepcopy(entry.value)
+
+    def get_decoded(self, key, image, extra_key=None):
+        """
+        look up the decoded image after the exact lookup of key missed
+        Returns:
+            value: the cached result of a near-duplicate, None if missed
+            phash(tuple|None): (extra_key, perceptual hash) of the image,
+                pass it to put
+        """
+        phash = None
+        if self.hash_type is not None:
+            phash = (extra_key, self.perceptual_hash(image))
+            value = self.get_similar(phash)
+            if value is not None:
+                self.put(key, value, phash)
+                return value, phash
+        with self._lock:
+            self.stats["misses"] += 1
+        return None, phash
+
+    def clear(self):
+        """
+        drop all the cached results, such as after the gallery is updated
+        """
+        with self._lock:
+            self._entries.clear()
+            self._phash_index.clear()
+            self._nbytes = 0
+
+    def put(self, key, value, phash=None):
+        nbytes = estimate_nbytes(value)
+        if self.max_bytes > 0 and nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            expire = time.time() + self.ttl if self.ttl > 0 else None
+            self._entries[key] = _Entry(
+                copy.deepcopy(value), phash, nbytes, expire)
+            self._nbytes += nbytes
+            if phash is not None:
+                self._phash_index[phash] = key
+            while len(self._entries) > self.capacity or (
+                    self.max_bytes > 0 and self._nbytes > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+                self.stats["evictions"] += 1
+
+    def predict(self,
+                predict_fn,
+                data=None,
+                image=None,
+                decode_fn=None,
+                extra_key=None):
+        """
+        look up the result of an image and run predict_fn when missed
+        Args:
+            predict_fn(callable): predict_fn(image) returns the result
+            data(bytes): encoded image, the image is decoded by decode_fn
+                only when the exact lookup misses
+            image(np.ndarray): decoded image, used when data is None
+            decode_fn(callable): decode_fn(data) returns the decoded image
+            extra_key(str): other inputs the result depends on
+        """
+        assert data is not None or image is not None
+        key = content_key(data if data is not None else image, extra_key)
+        value = self.get(key)
+        if value is not None:
+            return value
+        if image is None:
+            image = decode_fn(data)
+        value, phash = self.get_decoded(key, image, extra_key)
+        if value is not None:
+            return value
+        value = predict_fn(image)
+        self.put(key, value, phash)
+        return value
+
+    def summary(self):
+        stats = dict(self.stats)
+        hits = stats["exact_hits"] + stats["perceptual_hits"]
+        stats["hit_rate"] = hits / max(hits + stats["misses"], 1)
+        stats["entries"] = len(self._entries)
+        stats["nbytes"] = self._nbytes
+        return stats
+
+    def log_summary(self, prefix=""):
+        stats = self.summary()
+        logger.info("{}result cache: hit rate: {:.2%}, exact hits: {}, "
+                    "perceptual hits: {}, misses: {}, evictions: {}, "
+                    "expirations: {}, entries: {}, size: {} bytes".format(
+                        prefix, stats["hit_rate"], stats["exact_hits"],
+                        stats["perceptual_hits"], stats["misses"], stats[
+                            "evictions"], stats["expirations"], stats[
+                                "entries"], stats["nbytes"]))
+
+
+def build_result_cache(config):
+    """
+    Args:
+        config(dict|None): the ResultCache section of the inference config
+    Returns:
+        cache(ResultCache|None): None if the cache is not enabled
+    """
+    if not config or not config.get("enable", True):
+        return None
+    config = dict(config)
+    config.pop("enable", None)
+    return ResultCache(**config)
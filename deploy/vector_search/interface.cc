@@ -134,6 +134,20 @@ void load_mobius_index_prefix(int row,int dim,IndexContext* index_context,const
     index_context->data = data;
 }
 
+// search only index on the data and edges of a memory-mapped index file,
+// the buffers are shared with the other processes mapping the same file
+void load_mobius_index_mmap(int row,int dim,IndexContext* index_context,float* data_ptr,idx_t* edges_ptr){
+    ++row;
+    Data* data = new Data(row,dim,data_ptr);
+    GraphWrapper* graph = new FixedDegreeGraph<1>(data,edges_ptr);
+
+    ((FixedDegreeGraph<1>*)graph)->search_start_point = row - 1;
+    ((FixedDegreeGraph<1>*)graph)->ignore_startpoint = true;
+
+    index_context->graph = graph;
+    index_context->data = data;
+}
+
 void save_mobius_index_prefix(IndexContext* index_context,const char* prefix){
     std::string str = std::string(prefix);
     Data* data = (Data*)(index_context->data);
@@ -222,6 +236,14 @@ void load_l2_index_prefix(int row,int dim,IndexContext* index_context,const char
     index_context->data = data;
 }
 
+void load_l2_index_mmap(int row,int dim,IndexContext* index_context,float* data_ptr,idx_t* edges_ptr){
+    Data* data = new Data(row,dim,data_ptr);
+    GraphWrapper* graph = new FixedDegreeGraph<3>(data,edges_ptr);
+
+    index_context->graph = graph;
+    index_context->data = data;
+}
+
 void save_l2_index_prefix(IndexContext* index_context,const char* prefix){
     std::string str = std::string(prefix);
     Data* data = (Data*)(index_context->data);
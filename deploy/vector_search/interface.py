@@ -13,13 +13,18 @@
 # limitations under the License.
 
 import ctypes
+import shutil
 import paddle
 import numpy.ctypeslib as ctl
 import numpy as np
 import os
 import sys
 import json
+import math
+import time
 import platform
+import threading
+from collections import OrderedDict
 
 from ctypes import *
 from numpy.ctypeslib import ndpointer
@@ -112,13 +117,47 @@ release_context = lib.release_context
 release_context.restype = None
 release_context.argtypes = [POINTER(IndexContext)]
 
+# search only indexes on memory-mapped buffers, missing in the libraries
+# built before they were added
+load_mobius_index_mmap = getattr(lib, "load_mobius_index_mmap", None)
+load_l2_index_mmap = getattr(lib, "load_l2_index_mmap", None)
+for _load_mmap in [load_mobius_index_mmap, load_l2_index_mmap]:
+    if _load_mmap is not None:
+        _load_mmap.restype = None
+        _load_mmap.argtypes = [
+            ctypes.c_int, ctypes.c_int, POINTER(IndexContext),
+            ctypes.c_void_p, ctypes.c_void_p
+        ]
+
+# layout of a packed index file: magic, uint64 length of the json header,
+# the header, then the sections aligned to PACK_ALIGN bytes
+PACK_MAGIC = b"PPCLSIDX"
+PACK_ALIGN = 64
+# FIXED_DEGREE_SHIFT in src/config.h
+EDGE_SHIFT = 5
+
+
+# the ids not written by the search of the library
+_EMPTY_ID = np.iinfo(np.uint64).max
+
+
+def _sorted_contains(sorted_ids, ids):
+    """
+    whether every id is in sorted_ids, costs O(len(ids) * log(len(sorted_ids)))
+    instead of a bitmap of all the items
+    """
+    pos = np.minimum(np.searchsorted(sorted_ids, ids), len(sorted_ids) - 1)
+    return sorted_ids[pos] == ids
+
 
 class Graph_Index(object):
     """
         graph index
+        exact_search_threshold: filtered searches whose candidates are not
+            more than it are computed exactly over the candidates
     """
 
-    def __init__(self, dist_type="IP"):
+    def __init__(self, dist_type="IP", exact_search_threshold=10000):
         self.dim = 0
         self.total_num = 0
         self.dist_type = dist_type
@@ -126,6 +165,19 @@ class Graph_Index(object):
         self.index_context = IndexContext(0, 0)
         self.gallery_doc_dict = {}
         self.with_attr = False
+        # integer attributes of every item used by filtered search
+        self.attr_names = []
+        self.gallery_attrs = {}
+        self.gallery_vectors = None
+        self.exact_search_threshold = exact_search_threshold
+        self._attrs_dir = None
+        self._postings = {}
+        self._filter_cache = OrderedDict()
+        self.filter_cache_size = 128
+        # buffers of an index loaded by load_packed
+        self._mmap = None
+        self._doc_offsets = None
+        self._doc_bytes = None
         assert dist_type in ["IP", "L2"], "Only support IP and L2 distance ..."
 
     def build(self,
@@ -133,9 +185,13 @@ class Graph_Index(object):
               gallery_docs=[],
               pq_size=100,
               index_path='graph_index/',
-              append_index=False):
+              append_index=False,
+              gallery_attrs=None):
         """
         build index 
+        gallery_attrs: optional dict from attribute name to the integer
+            attribute of every vector, such as the brand or the store, the
+            attributes and the vectors are saved for filtered search
         """
         if paddle.is_tensor(gallery_vectors):
             gallery_vectors = gallery_vectors.numpy()
@@ -200,20 +256,134 @@ class Graph_Index(object):
             ori_gallery_doc_dict["total_num"] += self.gallery_doc_dict[
                 "total_num"]
             self.gallery_doc_dict = ori_gallery_doc_dict
+
+        if gallery_attrs:
+            self._save_attrs(index_path, gallery_vectors, gallery_attrs,
+                             append_index)
+        elif append_index and self.gallery_doc_dict.get("attr_names"):
+            raise ValueError("the index has attributes {}, gallery_attrs "
+                             "must be given to append to it".format(
+                                 self.gallery_doc_dict["attr_names"]))
         with open(output_path, "w") as f:
             json.dump(self.gallery_doc_dict, f)
 
         print("finished creating index ...")
 
-    def search(self, query, return_k=10, search_budget=100):
+    def _save_attrs(self, index_path, gallery_vectors, gallery_attrs,
+                    append_index):
+        attr_names = sorted(gallery_attrs.keys())
+        attrs = {
+            name: np.asarray(
+                gallery_attrs[name], dtype=np.int64).reshape([-1])
+            for name in attr_names
+        }
+        for name in attr_names:
+            assert len(attrs[name]) == gallery_vectors.shape[0], \
+                "attribute {} should have {} values, but got {}".format(
+                    name, gallery_vectors.shape[0], len(attrs[name]))
+        vectors = np.ascontiguousarray(gallery_vectors, dtype=np.float32)
+        if append_index and self.gallery_doc_dict["total_num"] > len(vectors):
+            assert self.gallery_doc_dict.get("attr_names") == attr_names, \
+                "the attributes to append should be {}".format(
+                    self.gallery_doc_dict.get("attr_names"))
+            vectors = np.concatenate(
+                [np.load(os.path.join(index_path, "vectors.npy")), vectors])
+            ori_attrs = np.load(os.path.join(index_path, "attrs.npz"))
+            attrs = {
+                name: np.concatenate([ori_attrs[name], attrs[name]])
+                for name in attr_names
+            }
+        np.save(os.path.join(index_path, "vectors.npy"), vectors)
+        np.savez(os.path.join(index_path, "attrs.npz"), **attrs)
+        self.gallery_doc_dict["attr_names"] = attr_names
+        self.attr_names = attr_names
+        self.gallery_attrs = attrs
+        self.gallery_vectors = vectors
+        self._attrs_dir = os.path.abspath(index_path)
+        self._postings = {}
+        self._filter_cache = OrderedDict()
+
+    def _load_attrs(self, index_path):
+        self.attr_names = self.gallery_doc_dict.get("attr_names", [])
+        self.gallery_attrs = {}
+        self.gallery_vectors = None
+        self._postings = {}
+        self._filter_cache = OrderedDict()
+        if len(self.attr_names) == 0:
+            return
+        attrs = np.load(os.path.join(index_path, "attrs.npz"))
+        self.gallery_attrs = {name: attrs[name] for name in self.attr_names}
+        # only the candidates of exact searches are read
+        self.gallery_vectors = np.load(
+            os.path.join(index_path, "vectors.npy"), mmap_mode="r")
+        self._attrs_dir = os.path.abspath(index_path)
+
+    def _posting(self, name):
         """
-        search
+        posting lists of an attribute, the ids of the items whose attribute
+        is values[i] are ids[starts[i]:starts[i + 1]] in ascending order
         """
-        ret_id = np.zeros(return_k, dtype=np.uint64)
+        if name not in self._postings:
+            assert name in self.gallery_attrs, \
+                "attribute {} is not found, the index has {}".format(
+                    name, self.attr_names)
+            attr = self.gallery_attrs[name]
+            ids = np.argsort(attr, kind="stable")
+            values, starts = np.unique(attr[ids], return_index=True)
+            starts = np.append(starts, len(ids))
+            self._postings[name] = (values, starts, ids)
+        return self._postings[name]
+
+    def _attr_ids(self, name, value):
+        values, starts, ids = self._posting(name)
+        i = np.searchsorted(values, value)
+        if i == len(values) or values[i] != value:
+            return ids[:0]
+        return ids[starts[i]:starts[i + 1]]
+
+    def filter_ids(self, filter):
+        """
+        ids of the items accepted by the filter
+        filter: dict from attribute name to a value or a list of values, the
+            items must match every attribute and one of its values, or a
+            precomputed bool bitmap of all the items, or an array of ids
+        returns: sorted int64 ids
+        """
+        if isinstance(filter, np.ndarray):
+            if filter.dtype == np.bool_:
+                assert len(filter) == self.total_num
+                return np.nonzero(filter)[0]
+            return np.unique(filter.astype(np.int64))
+        key = json.dumps(
+            {
+                name: sorted(int(v) for v in value) if isinstance(
+                    value, (list, tuple, np.ndarray)) else int(value)
+                for name, value in filter.items()
+            },
+            sort_keys=True)
+        if key in self._filter_cache:
+            self._filter_cache.move_to_end(key)
+            return self._filter_cache[key]
+
+        result = None
+        for name, value in json.loads(key).items():
+            if isinstance(value, list):
+                ids = np.unique(
+                    np.concatenate([self._attr_ids(name, v) for v in value]))
+            else:
+                ids = self._attr_ids(name, value)
+            result = ids if result is None else np.intersect1d(
+                result, ids, assume_unique=True)
+        if result is None:
+            result = np.arange(self.total_num, dtype=np.int64)
+        self._filter_cache[key] = result
+        if len(self._filter_cache) > self.filter_cache_size:
+            self._filter_cache.popitem(last=False)
+        return result
+
+    def _search_graph(self, query, return_k, search_budget):
+        ret_id = np.full(return_k, _EMPTY_ID, dtype=np.uint64)
         ret_score = np.zeros(return_k, dtype=np.float64)
-
-        if paddle.is_tensor(query):
-            query = query.numpy()
         if self.dist_type == "IP":
             search_mobius_index(query, self.dim, search_budget, return_k,
                                 ctypes.byref(self.index_context), ret_id,
@@ -222,17 +392,98 @@ class Graph_Index(object):
             search_l2_index(query, self.dim, search_budget, return_k,
                             ctypes.byref(self.index_context), ret_id,
                             ret_score)
+        return ret_score, ret_id
+
+    def _search_exact(self, query, ids, return_k, chunk_size=65536):
+        """
+        exact search over the given ids, the scores are the same as the
+        graph search, inner product for IP and negative squared distance
+        for L2
+        """
+        query = query.reshape([-1]).astype(np.float32)
+        scores = np.empty([len(ids)], dtype=np.float64)
+        for start in range(0, len(ids), chunk_size):
+            vectors = np.asarray(
+                self.gallery_vectors[ids[start:start + chunk_size]],
+                dtype=np.float32)
+            if self.dist_type == "IP":
+                scores[start:start + chunk_size] = vectors @ query
+            else:
+                scores[start:start + chunk_size] = -np.square(
+                    vectors - query).sum(axis=1)
+        k = min(return_k, len(ids))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return scores[top], ids[top].astype(np.uint64)
+
+    def _search_filtered(self, query, return_k, search_budget, filter):
+        ids = self.filter_ids(filter)
+        if len(ids) == 0:
+            return np.zeros([0], dtype=np.float64), np.zeros(
+                [0], dtype=np.uint64)
+        if len(ids) <= max(self.exact_search_threshold, return_k):
+            return self._search_exact(query, ids, return_k)
+
+        # over-fetch from the graph by the inverse of the selectivity and
+        # keep the accepted items, it is retried with a larger fetch before
+        # falling back to the exact search
+        fetch_k = int(math.ceil(return_k * self.total_num / len(ids) * 2))
+        for _ in range(3):
+            fetch_k = min(fetch_k, self.total_num)
+            scores, ret_ids = self._search_graph(
+                query, fetch_k, max(search_budget, fetch_k))
+            valid = ret_ids != _EMPTY_ID
+            scores, ret_ids = scores[valid], ret_ids[valid]
+            accept = _sorted_contains(ids, ret_ids.astype(np.int64))
+            if accept.sum() >= return_k:
+                return scores[accept][:return_k], ret_ids[accept][:return_k]
+            if fetch_k == self.total_num:
+                break
+            fetch_k *= 4
+        return self._search_exact(query, ids, return_k)
+
+    def search(self, query, return_k=10, search_budget=100, filter=None):
+        """
+        search
+        filter: optional filter of the items by their attributes, see
+            filter_ids, fewer than return_k results are returned when not
+            enough items are accepted
+        """
+        if paddle.is_tensor(query):
+            query = query.numpy()
+        if filter is None:
+            ret_score, ret_id = self._search_graph(query, return_k,
+                                                   search_budget)
+        else:
+            assert self.gallery_vectors is not None, \
+                "filtered search needs an index built with gallery_attrs"
+            query = np.ascontiguousarray(query, dtype=np.float32)
+            ret_score, ret_id = self._search_filtered(query, return_k,
+                                                      search_budget, filter)
+        # fewer than return_k slots are written when the gallery is smaller
+        # than return_k or search_budget is
+        valid = ret_id != _EMPTY_ID
+        ret_score, ret_id = ret_score[valid], ret_id[valid]
+        return_k = len(ret_id)
 
         ret_id = ret_id.tolist()
         ret_doc = []
         if self.with_attr:
             for i in range(return_k):
-                ret_doc.append(self.gallery_doc_dict[str(ret_id[i])])
+                ret_doc.append(self._get_doc(ret_id[i]))
             return ret_score, ret_doc
         else:
             return ret_score, ret_id
 
+    def _get_doc(self, idx):
+        if self._doc_offsets is not None:
+            start, end = self._doc_offsets[idx], self._doc_offsets[idx + 1]
+            return json.loads(bytes(self._doc_bytes[start:end]).decode("utf-8"))
+        return self.gallery_doc_dict[str(idx)]
+
     def dump(self, index_path):
+        assert self._mmap is None, \
+            "a packed index is read-only, use pack_index to copy it"
 
         if not os.path.exists(index_path):
             os.makedirs(index_path)
@@ -246,6 +497,14 @@ class Graph_Index(object):
                 ctypes.byref(self.index_context),
                 create_string_buffer((index_path + "/index").encode('utf-8')))
 
+        # the vectors of a loaded index are memory-mapped from its directory
+        if len(self.attr_names) > 0 and os.path.abspath(
+                index_path) != self._attrs_dir:
+            np.save(
+                os.path.join(index_path, "vectors.npy"), self.gallery_vectors)
+            np.savez(
+                os.path.join(index_path, "attrs.npz"), **self.gallery_attrs)
+
         with open(index_path + "/info.json", "w") as f:
             json.dump(self.gallery_doc_dict, f)
 
@@ -259,6 +518,7 @@ class Graph_Index(object):
         self.dim = self.gallery_doc_dict["dim"]
         self.dist_type = self.gallery_doc_dict["dist_type"]
         self.with_attr = self.gallery_doc_dict["with_attr"]
+        self._load_attrs(index_path)
 
         if self.dist_type == "IP":
             load_mobius_index_prefix(
@@ -270,3 +530,220 @@ class Graph_Index(object):
                 self.total_num, self.dim,
                 ctypes.byref(self.index_context),
                 create_string_buffer((index_path + "/index").encode('utf-8')))
+
+    def load_packed(self, pack_file):
+        """
+        map a file written by pack_index read-only, the graph, the vectors,
+        the docs and the attributes are read from the page cache, which is
+        shared by all the processes mapping the same file
+        """
+        mm = np.memmap(pack_file, dtype=np.uint8, mode="r")
+        assert bytes(mm[:len(PACK_MAGIC)]) == PACK_MAGIC, \
+            "{} is not a packed index".format(pack_file)
+        header_len = int(mm[8:16].view(np.uint64)[0])
+        header = json.loads(bytes(mm[16:16 + header_len]).decode("utf-8"))
+
+        def section(name):
+            spec = header["sections"][name]
+            dtype = np.dtype(spec["dtype"])
+            start = header["data_offset"] + spec["offset"]
+            end = start + int(np.prod(spec["shape"])) * dtype.itemsize
+            return mm[start:end].view(dtype).reshape(spec["shape"])
+
+        self.total_num = header["total_num"]
+        self.dim = header["dim"]
+        self.dist_type = header["dist_type"]
+        self.with_attr = header["with_attr"]
+        self.gallery_doc_dict = {}
+        load_mmap = load_mobius_index_mmap \
+            if self.dist_type == "IP" else load_l2_index_mmap
+        assert load_mmap is not None, \
+            "{} is built without packed index support, please rebuild it " \
+            "with `make portable` in {}, see README.md".format(
+                so_path, os.path.dirname(so_path))
+
+        data = section("data")
+        edges = section("edges")
+        load_mmap(self.total_num, self.dim,
+                  ctypes.byref(self.index_context), data.ctypes.data,
+                  edges.ctypes.data)
+        if self.with_attr:
+            self._doc_offsets = section("doc_offsets")
+            self._doc_bytes = section("doc_bytes")
+        self.attr_names = header["attr_names"]
+        self.gallery_attrs = {
+            name: section("attr_" + name)
+            for name in self.attr_names
+        }
+        # the data of the library is the original vectors, the IP index
+        # has one more start point at the end
+        self.gallery_vectors = data[:self.total_num]
+        self._attrs_dir = None
+        self._postings = {}
+        self._filter_cache = OrderedDict()
+        self._mmap = mm
+
+    def __del__(self):
+        # the buffers of other indexes are kept as before
+        if getattr(self, "_mmap", None) is not None:
+            release_context(ctypes.byref(self.index_context))
+            self._mmap = None
+
+
+def _align(offset):
+    return (offset + PACK_ALIGN - 1) // PACK_ALIGN * PACK_ALIGN
+
+
+def pack_index(index_path, pack_file):
+    """
+    lay the index of index_path out in one file for Graph_Index.load_packed,
+    the file is written aside and renamed, so the processes watching
+    pack_file with SharedGraphIndex switch to the complete new version
+    """
+    with open(os.path.join(index_path, "info.json"), "r") as f:
+        info = json.load(f)
+    total_num = info["total_num"]
+    dim = info["dim"]
+    rows = total_num + 1 if info["dist_type"] == "IP" else total_num
+    prefix = os.path.join(index_path, "index")
+
+    # name -> (dtype, shape, file path or array)
+    sections = OrderedDict()
+    sections["data"] = ("float32", [rows, dim], prefix + ".data")
+    sections["edges"] = ("uint64", [rows << EDGE_SHIFT], prefix + ".graph")
+    if info["with_attr"]:
+        docs = [
+            json.dumps(info[str(i)]).encode("utf-8") for i in range(total_num)
+        ]
+        offsets = np.zeros([total_num + 1], dtype=np.int64)
+        offsets[1:] = np.cumsum([len(doc) for doc in docs])
+        sections["doc_offsets"] = ("int64", [total_num + 1], offsets)
+        sections["doc_bytes"] = ("uint8", [int(offsets[-1])],
+                                 np.frombuffer(b"".join(docs), np.uint8))
+    attr_names = info.get("attr_names", [])
+    if len(attr_names) > 0:
+        attrs = np.load(os.path.join(index_path, "attrs.npz"))
+        for name in attr_names:
+            sections["attr_" + name] = ("int64", [total_num], attrs[name])
+
+    header = {
+        "total_num": total_num,
+        "dim": dim,
+        "dist_type": info["dist_type"],
+        "with_attr": info["with_attr"],
+        "attr_names": attr_names,
+        "sections": OrderedDict(),
+    }
+    offset = 0
+    for name, (dtype, shape, source) in sections.items():
+        nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        if isinstance(source, str):
+            assert os.path.getsize(source) == nbytes, \
+                "{} should have {} bytes".format(source, nbytes)
+        header["sections"][name] = {
+            "dtype": dtype,
+            "shape": shape,
+            "offset": offset
+        }
+        offset = _align(offset + nbytes)
+    header_len = len(json.dumps(header).encode("utf-8"))
+    # data_offset only changes the length of the header by a few digits
+    header["data_offset"] = _align(16 + header_len + 32)
+    header_bytes = json.dumps(header).encode("utf-8")
+    assert 16 + len(header_bytes) <= header["data_offset"]
+
+    tmp_file = "{}.tmp{}".format(pack_file, os.getpid())
+    with open(tmp_file, "wb") as f:
+        f.write(PACK_MAGIC)
+        f.write(np.array([len(header_bytes)], dtype=np.uint64).tobytes())
+        f.write(header_bytes)
+        for name, (dtype, shape, source) in sections.items():
+            f.write(b"\0" * (header["data_offset"] +
+                             header["sections"][name]["offset"] - f.tell()))
+            if isinstance(source, str):
+                with open(source, "rb") as fin:
+                    shutil.copyfileobj(fin, f, 16 << 20)
+            else:
+                f.write(np.ascontiguousarray(source, dtype=dtype).tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, pack_file)
+    print("packed index {} into {}".format(index_path, pack_file))
+
+
+class SharedGraphIndex(object):
+    """
+        a packed index mapped read-only, so the processes serving the same
+        file share one copy in the page cache. The file is checked every
+        check_interval seconds, and a new version written by pack_index is
+        loaded without restarting, the searches running on the old version
+        keep it until they return.
+    """
+
+    def __init__(self,
+                 pack_file,
+                 check_interval=10,
+                 exact_search_threshold=10000):
+        self.pack_file = pack_file
+        self.check_interval = check_interval
+        self.exact_search_threshold = exact_search_threshold
+        self._lock = threading.Lock()
+        self.index, self._file_id = self._load()
+        # incremented by every reload, part of the keys of cached results
+        self.version = 0
+        self._next_check = time.time() + check_interval
+
+    def __getattr__(self, name):
+        # only called when the attribute is not found on the wrapper
+        if name in ["index", "version"]:
+            raise AttributeError(name)
+        return getattr(self.index, name)
+
+    def _stat(self):
+        st = os.stat(self.pack_file)
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _load(self):
+        file_id = self._stat()
+        index = Graph_Index(
+            exact_search_threshold=self.exact_search_threshold)
+        index.load_packed(self.pack_file)
+        return index, file_id
+
+    def maybe_reload(self, force=False):
+        """
+        returns: True if a new version is loaded
+        """
+        now = time.time()
+        if not force and now < self._next_check:
+            return False
+        # the other threads keep searching the current version
+        if not self._lock.acquire(blocking=False):
+            return False
+        try:
+            self._next_check = now + self.check_interval
+            try:
+                if not force and self._stat() == self._file_id:
+                    return False
+                index, file_id = self._load()
+            except (OSError, ValueError, AssertionError) as ex:
+                print("failed to reload index {}: {}".format(self.pack_file,
+                                                             ex))
+                return False
+            self.index, self._file_id = index, file_id
+            self.version += 1
+            print("reloaded index {}, num: {}".format(self.pack_file,
+                                                      index.total_num))
+            return True
+        finally:
+            self._lock.release()
+
+    def search(self, query, return_k=10, search_budget=100, filter=None):
+        self.maybe_reload()
+        # keep the version alive until the search returns
+        index = self.index
+        return index.search(
+            query,
+            return_k=return_k,
+            search_budget=search_budget,
+            filter=filter)
@@ -39,6 +39,9 @@
 class Data{
 private:
     std::unique_ptr<value_t[]> data;
+    // points to data, or to an external read-only buffer such as a
+    // memory-mapped index file shared by processes
+    value_t* base = NULL;
     size_t num;
     size_t curr_num = 0;
     int dim;
@@ -51,10 +54,17 @@ public:
     Data(size_t num, int dim) : num(num),dim(dim){
         data = std::unique_ptr<value_t[]>(new value_t[num * dim]);
         memset(data.get(),0,sizeof(value_t) * num * dim);
+        base = data.get();
+    }
+
+    // use num * dim values owned by the caller without copying them
+    Data(size_t num, int dim, value_t* external) : num(num),dim(dim){
+        base = external;
+        curr_num = num;
     }
     
     value_t* get(idx_t idx) const{
-        return data.get() + idx * dim;
+        return base + idx * dim;
     }
     
 	template<class T>
@@ -236,7 +246,7 @@ public:
 
     void print(){
         for(int i = 0;i < num && i < 10;++i)
-            printf("%f ",*(data.get() + i));
+            printf("%f ",*(base + i));
         printf("\n");
     }
 
@@ -246,14 +256,14 @@ public:
 
     void dump(std::string path = "bfsg.data"){
         FILE* fp = fopen(path.c_str(),"wb");
-        fwrite(data.get(),sizeof(value_t) * num * dim,1,fp);
+        fwrite(base,sizeof(value_t) * num * dim,1,fp);
         fclose(fp);
     }
     
     void load(std::string path = "bfsg.data"){
         curr_num = num;
         FILE* fp = fopen(path.c_str(),"rb");
-        auto cnt = fread(data.get(),sizeof(value_t) * num * dim,1,fp);
+        auto cnt = fread(base,sizeof(value_t) * num * dim,1,fp);
         fclose(fp);
     }
 
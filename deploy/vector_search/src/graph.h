@@ -91,6 +91,8 @@ private:
     const int flexible_degree = FIXED_DEGREE;
     const int vertex_offset_shift = FIXED_DEGREE_SHIFT;
     std::vector<idx_t> edges;
+    // points to edges, or to external read-only edges
+    idx_t* edge_ptr = NULL;
     std::vector<dist_t> edge_dist;
     Data* data;
     std::mt19937_64 rand_gen = std::mt19937_64(1234567);//std::random_device{}());
@@ -110,26 +112,26 @@ private:
         //NOTICE: before it is full, it is unsorted
         auto curr_dist = pair_distance(v_id,u_id);
         auto offset = ((size_t)v_id) << vertex_offset_shift;
-		int degree = edges[offset];
+		int degree = edge_ptr[offset];
 		std::vector<idx_t> neighbor;
 		neighbor.reserve(degree + 1);
 		for(int i = 0;i < degree;++i)
-			neighbor.push_back(edges[offset + i + 1]);
+			neighbor.push_back(edge_ptr[offset + i + 1]);
 		neighbor.push_back(u_id);
 		neighbor = edge_selection_filter_neighbor(neighbor,v_id,flexible_degree);
-		edges[offset] = neighbor.size();
+		edge_ptr[offset] = neighbor.size();
 		for(int i = 0;i < neighbor.size();++i)
-			edges[offset + i + 1] = neighbor[i];
+			edge_ptr[offset + i + 1] = neighbor[i];
 		return;
         //We assert edges[offset] > 0 here
-        if(curr_dist >= edge_dist[offset + edges[offset]]){
+        if(curr_dist >= edge_dist[offset + edge_ptr[offset]]){
             return;
         }
-        edges[offset + edges[offset]] = u_id;
-        edge_dist[offset + edges[offset]] = curr_dist;
-        for(size_t i = offset + edges[offset] - 1;i > offset;--i){
+        edge_ptr[offset + edge_ptr[offset]] = u_id;
+        edge_dist[offset + edge_ptr[offset]] = curr_dist;
+        for(size_t i = offset + edge_ptr[offset] - 1;i > offset;--i){
             if(edge_dist[i] > edge_dist[i + 1]){
-                std::swap(edges[i],edges[i + 1]);
+                std::swap(edge_ptr[i],edge_ptr[i + 1]);
                 std::swap(edge_dist[i],edge_dist[i + 1]);
             }else{
                 break;
@@ -165,10 +167,10 @@ private:
     }
 
     void compute_distance_naive(size_t offset,std::vector<dist_t>& dists){
-        dists.resize(edges[offset]);
-        auto degree = edges[offset];
+        dists.resize(edge_ptr[offset]);
+        auto degree = edge_ptr[offset];
         for(int i = 0;i < degree;++i){
-            dists[i] = distance(offset >> vertex_offset_shift,edges[offset + i + 1]);
+            dists[i] = distance(offset >> vertex_offset_shift,edge_ptr[offset + i + 1]);
         }
     }
 
@@ -197,7 +199,7 @@ private:
             while(k < edge_dist[j]) --j;
             if(i <= j){
                 std::swap(edge_dist[i],edge_dist[j]);
-                std::swap(edges[i],edges[j]);
+                std::swap(edge_ptr[i],edge_ptr[j]);
                 ++i;
                 --j;
             }
@@ -219,9 +221,9 @@ private:
     void add_edge_lock(idx_t v_id,idx_t u_id){
 		edge_mutex[v_id].lock();
         auto offset = ((size_t)v_id) << vertex_offset_shift;
-        if(edges[offset] < flexible_degree){
-            ++edges[offset];
-            edges[offset + edges[offset]] = u_id;
+        if(edge_ptr[offset] < flexible_degree){
+            ++edge_ptr[offset];
+            edge_ptr[offset + edge_ptr[offset]] = u_id;
         }else{
             rank_and_switch(v_id,u_id);
         }
@@ -230,9 +232,9 @@ private:
 
     void add_edge(idx_t v_id,idx_t u_id){
         auto offset = ((size_t)v_id) << vertex_offset_shift;
-        if(edges[offset] < flexible_degree){
-            ++edges[offset];
-            edges[offset + edges[offset]] = u_id;
+        if(edge_ptr[offset] < flexible_degree){
+            ++edge_ptr[offset];
+            edge_ptr[offset + edge_ptr[offset]] = u_id;
         }else{
             rank_and_switch(v_id,u_id);
         }
@@ -248,10 +250,24 @@ public:
     FixedDegreeGraph(Data* data) : data(data){
         auto num_vertices = data->max_vertices();
         edges = std::vector<idx_t>(((size_t)num_vertices) << vertex_offset_shift);
+        edge_ptr = edges.data();
         edge_dist = std::vector<dist_t>(((size_t)num_vertices) << vertex_offset_shift);
 		edge_mutex = std::vector<std::mutex>(num_vertices);
+		init_visited(num_vertices,true);
+    }
+
+    // search only graph on the edges owned by the caller, the buffers used
+    // to build the graph are not allocated
+    FixedDegreeGraph(Data* data,idx_t* external_edges) : data(data){
+        edge_ptr = external_edges;
+        init_visited(data->max_vertices(),false);
+    }
+
+    void init_visited(size_t num_vertices,bool with_pool){
 		p_visited = new VisitedList(num_vertices + 5);
 		#ifdef OMP
+		if(!with_pool)
+			return;
 		int n_threads = 1;
 		#pragma omp parallel
 		#pragma omp master
@@ -308,10 +324,10 @@ public:
         // a large number - current degree
 		if(neighbor.size() >= degree)
 			neighbor = edge_selection_filter_neighbor(neighbor,vertex_id,degree);
-        edges[offset] = neighbor.size();
+        edge_ptr[offset] = neighbor.size();
 
         for(int i = 0;i < neighbor.size() && i < degree;++i){
-            edges[offset + i + 1] = neighbor[i]; 
+            edge_ptr[offset + i + 1] = neighbor[i]; 
         }
 		edge_mutex[vertex_id].unlock();
         for(int i = 0;i < neighbor.size() && i < degree;++i){
@@ -330,10 +346,10 @@ public:
 		if(neighbor.size() >= degree){
 			neighbor = edge_selection_filter_neighbor(neighbor,vertex_id,degree);
 		}
-        edges[offset] = neighbor.size();
+        edge_ptr[offset] = neighbor.size();
 
         for(int i = 0;i < neighbor.size() && i < degree;++i){
-            edges[offset + i + 1] = neighbor[i]; 
+            edge_ptr[offset + i + 1] = neighbor[i]; 
         }
         for(int i = 0;i < neighbor.size() && i < degree;++i){
             add_edge(neighbor[i],vertex_id);
@@ -378,10 +394,10 @@ public:
                 topk.pop();
 			edge_mutex[now.second].lock();
             auto offset = ((size_t)now.second) << vertex_offset_shift;
-            auto degree = edges[offset];
+            auto degree = edge_ptr[offset];
 
             for(int i = 0;i < degree;++i){
-                auto start = edges[offset + i + 1];
+                auto start = edge_ptr[offset + i + 1];
 			    if(p_visited->mass[start] == tag)
                     continue;
 				p_visited->mass[start] = tag;
@@ -415,11 +431,11 @@ public:
             	q_top = (std::make_pair(pair_distance_naive(start,converted_query),start));
 			}else{
 				auto offset = ((size_t)start) << vertex_offset_shift;
-				auto degree = edges[offset];
+				auto degree = edge_ptr[offset];
 
 				for(int i = 1;i <= degree;++i){
-					p_visited->mass[edges[offset + i]] = tag;
-					auto dis = pair_distance_naive(edges[offset + i],converted_query);
+					p_visited->mass[edge_ptr[offset + i]] = tag;
+					auto dis = pair_distance_naive(edge_ptr[offset + i],converted_query);
 					if(dis < q_top.first)
 						q_top = (std::make_pair(dis,start));
 				}
@@ -432,11 +448,11 @@ public:
         for(int iter = 0;iter < max_step;++iter){
             ++explore_cnt;
             auto offset = ((size_t)q_top.second) << vertex_offset_shift;
-            auto degree = edges[offset];
+            auto degree = edge_ptr[offset];
 
 			bool changed = false;
             for(int i = 0;i < degree;++i){
-                auto start = edges[offset + i + 1];
+                auto start = edge_ptr[offset + i + 1];
 			    if(p_visited->mass[start] == tag)
                     continue;
 				p_visited->mass[start] = tag;
@@ -487,10 +503,10 @@ public:
             if(topk.size() > k)
                 topk.pop();
             auto offset = ((size_t)now.second) << vertex_offset_shift;
-            auto degree = edges[offset];
+            auto degree = edge_ptr[offset];
 
             for(int i = 0;i < degree;++i){
-                auto start = edges[offset + i + 1];
+                auto start = edge_ptr[offset + i + 1];
 			    if(p_visited->mass[start] == tag)
                     continue;
 				p_visited->mass[start] = tag;
@@ -544,10 +560,10 @@ public:
             if(topk.size() > k)
                 topk.pop();
             auto offset = ((size_t)now.second) << vertex_offset_shift;
-            auto degree = edges[offset];
+            auto degree = edge_ptr[offset];
 
             for(int i = 0;i < degree;++i){
-                auto start = edges[offset + i + 1];
+                auto start = edge_ptr[offset + i + 1];
 			    if(p_visited->mass[start] == tag)
                     continue;
 				p_visited->mass[start] = tag;
@@ -587,11 +603,11 @@ public:
         size_t sum = 0;
         std::vector<size_t> histogram(2 * degree + 1,0);
         for(size_t i = 0;i < n;++i){
-            sum += edges[i << vertex_offset_shift];
-            int tmp = edges[i << vertex_offset_shift];
+            sum += edge_ptr[i << vertex_offset_shift];
+            int tmp = edge_ptr[i << vertex_offset_shift];
             if(tmp > 2 * degree + 1)
                 fprintf(stderr,"[ERROR] node %zu has %d degree\n",i,tmp);
-            ++histogram[edges[i << vertex_offset_shift]];
+            ++histogram[edge_ptr[i << vertex_offset_shift]];
             if(tmp != degree)
                 fprintf(stderr,"[INFO] %zu has degree %d\n",i,tmp);
         }
@@ -606,10 +622,10 @@ public:
     void print_edges(int x){
         for(size_t i = 0;i < x;++i){
             size_t offset = i << vertex_offset_shift;
-            int degree = edges[offset];
+            int degree = edge_ptr[offset];
             fprintf(stderr,"%d (%d): ",i,degree);
             for(int j = 1;j <= degree;++j)
-                fprintf(stderr,"(%zu,%f) ",edges[offset + j],edge_dist[offset + j]);
+                fprintf(stderr,"(%zu,%f) ",edge_ptr[offset + j],edge_dist[offset + j]);
             fprintf(stderr,"\n");
         }
     }
@@ -617,14 +633,14 @@ public:
     void dump(std::string path = "bfsg.graph"){
         FILE* fp = fopen(path.c_str(),"wb");
         size_t num_vertices = data->max_vertices();
-        fwrite(&edges[0],sizeof(edges[0]) * (num_vertices << vertex_offset_shift),1,fp);
+        fwrite(edge_ptr,sizeof(edge_ptr[0]) * (num_vertices << vertex_offset_shift),1,fp);
         fclose(fp);
     }
 
     void load(std::string path = "bfsg.graph"){
         FILE* fp = fopen(path.c_str(),"rb");
         size_t num_vertices = data->max_vertices();
-        auto cnt = fread(&edges[0],sizeof(edges[0]) * (num_vertices << vertex_offset_shift),1,fp);
+        auto cnt = fread(edge_ptr,sizeof(edge_ptr[0]) * (num_vertices << vertex_offset_shift),1,fp);
         fclose(fp);
     }
 
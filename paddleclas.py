@@ -33,11 +33,10 @@ from tqdm import tqdm
 from prettytable import PrettyTable
 
 from deploy.python.predict_cls import ClsPredictor
-from deploy.utils.get_image_list import get_image_list
+from deploy.utils.get_image_list import iter_image_list
+from deploy.utils.result_cache import build_result_cache, content_key
 from deploy.utils import config
 
-from ppcls.arch.backbone import *
-
 __all__ = ["PaddleClas"]
 
 BASE_DIR = os.path.expanduser("~/.paddleclas/")
@@ -188,6 +187,8 @@ def init_config(model_name,
             "use_tensorrt": kwargs["use_tensorrt"]
             if "use_tensorrt" in kwargs else False,
             "gpu_mem": kwargs["gpu_mem"] if "gpu_mem" in kwargs else 8000,
+            "recursive": kwargs["recursive"]
+            if "recursive" in kwargs else False,
             "enable_profile": False
         },
         "PreProcess": {
@@ -229,6 +230,9 @@ def init_config(model_name,
         if kwargs["class_id_map_file"] is not None:
             cfg["PostProcess"]["Topk"]["class_id_map_file"] = kwargs[
                 "class_id_map_file"]
+    if "result_cache" in kwargs:
+        if kwargs["result_cache"] is not None:
+            cfg["ResultCache"] = kwargs["result_cache"]
 
     cfg = config.AttrDict(cfg)
     config.create_attr_dict(cfg)
@@ -286,6 +290,11 @@ def args_cfg():
         help="Resize according to short size.")
     parser.add_argument(
         "--crop_size", type=int, default=224, help="Centor crop size.")
+    parser.add_argument(
+        "--recursive",
+        type=str2bool,
+        default=False,
+        help="Whether to find images in sub-directories of infer_imgs.")
 
     args = parser.parse_args()
     return vars(args)
@@ -398,8 +407,6 @@ class PaddleClas(object):
     """PaddleClas.
     """
 
-    print_info()
-
     def __init__(self,
                  model_name: str=None,
                  inference_model_dir: str=None,
@@ -415,12 +422,15 @@ class PaddleClas(object):
             use_gpu: Whether use GPU, default by None. If specified, override config.
             batch_size: The batch size to pridict, default by None. If specified, override config.
             topk: Return the top k prediction results with the highest score.
+            result_cache: The kwargs of ResultCache to reuse the results of repeated images, default by None that disables the cache.
         """
         super().__init__()
         self._config = init_config(model_name, inference_model_dir, use_gpu,
                                    batch_size, topk, **kwargs)
         self._check_input_model()
         self.cls_predictor = ClsPredictor(self._config)
+        self.result_cache = build_result_cache(
+            self._config.get("ResultCache", None))
 
     def get_config(self):
         """Get the config.
@@ -474,6 +484,17 @@ class PaddleClas(object):
             [{"class_ids": [...], "scores": [...], "label_names": [...]}, ...]
         """
         if isinstance(input_data, np.ndarray):
+            if self.result_cache is not None:
+
+                def predict_image(img):
+                    outputs = self.cls_predictor.predict(img)
+                    return self.cls_predictor.postprocess(outputs)[0]
+
+                yield [
+                    self.result_cache.predict(
+                        predict_image, image=input_data)
+                ]
+                return
             outputs = self.cls_predictor.predict(input_data)
             yield self.cls_predictor.postprocess(outputs)
         elif isinstance(input_data, str):
@@ -487,16 +508,56 @@ class PaddleClas(object):
                 warnings.warn(
                     f"Image to be predicted from Internet: {input_data}, has been saved to: {image_save_path}"
                 )
-            image_list = get_image_list(input_data)
+            # images are predicted while the directory is still being read
+            image_list = iter_image_list(
+                input_data,
+                recursive=self._config.Global.get("recursive", False))
 
             batch_size = self._config.Global.get("batch_size", 1)
             topk = self._config.PostProcess.get('topk', 1)
 
+            def predict_batch(img_list, img_path_list, cached=None):
+                if cached is None:
+                    outputs = self.cls_predictor.predict(img_list)
+                    preds = self.cls_predictor.postprocess(outputs,
+                                                           img_path_list)
+                else:
+                    preds = self._predict_cached(img_list, img_path_list,
+                                                 cached)
+                if print_pred and preds:
+                    for pred in preds:
+                        filename = pred.pop("file_name")
+                        pred_str = ", ".join(
+                            [f"{k}: {pred[k]}" for k in pred])
+                        print(f"filename: {filename}, top-{topk}, {pred_str}")
+                return preds
+
             img_list = []
             img_path_list = []
-            cnt = 0
-            for idx, img_path in enumerate(image_list):
-                img = cv2.imread(img_path)
+            # (content key, cached result) of every image when caching
+            cached = None if self.result_cache is None else []
+            for img_path in image_list:
+                if cached is not None:
+                    with open(img_path, "rb") as f:
+                        data = f.read()
+                    key = content_key(data)
+                    pred = self.result_cache.get(key)
+                    if pred is not None:
+                        # an exact hit skips decoding the image
+                        img_list.append(None)
+                        img_path_list.append(img_path)
+                        cached.append((key, pred))
+                        if len(img_list) == batch_size:
+                            yield predict_batch(img_list, img_path_list,
+                                                cached)
+                            img_list, img_path_list, cached = [], [], []
+                        continue
+                    # decode the bytes already read for the key
+                    img = cv2.imdecode(
+                        np.frombuffer(data, dtype=np.uint8),
+                        cv2.IMREAD_COLOR) if len(data) > 0 else None
+                else:
+                    img = cv2.imread(img_path)
                 if img is None:
                     warnings.warn(
                         f"Image file failed to read and has been skipped. The path: {img_path}"
@@ -504,33 +565,56 @@ class PaddleClas(object):
                     continue
                 img_list.append(img)
                 img_path_list.append(img_path)
-                cnt += 1
-
-                if cnt % batch_size == 0 or (idx + 1) == len(image_list):
-                    outputs = self.cls_predictor.predict(img_list)
-                    preds = self.cls_predictor.postprocess(outputs,
-                                                           img_path_list)
-                    if print_pred and preds:
-                        for pred in preds:
-                            filename = pred.pop("file_name")
-                            pred_str = ", ".join(
-                                [f"{k}: {pred[k]}" for k in pred])
-                            print(
-                                f"filename: {filename}, top-{topk}, {pred_str}")
+                if cached is not None:
+                    cached.append((key, None))
 
+                if len(img_list) == batch_size:
+                    yield predict_batch(img_list, img_path_list, cached)
                     img_list = []
                     img_path_list = []
-                    yield preds
+                    cached = None if cached is None else []
+            if len(img_list) > 0:
+                yield predict_batch(img_list, img_path_list, cached)
         else:
             err = "Please input legal image! The type of image supported by PaddleClas are: NumPy.ndarray and string of local path or Ineternet URL"
             raise ImageTypeError(err)
         return
 
+    def _predict_cached(self, img_list, img_path_list, cached):
+        """
+        predict the images missed by the result cache and merge them with
+        the cached results in the order of the images
+        """
+        preds = [None] * len(img_list)
+        phashes = [None] * len(img_list)
+        todo = []
+        for idx, (img, img_path, (key, pred)) in enumerate(
+                zip(img_list, img_path_list, cached)):
+            if pred is None:
+                pred, phashes[idx] = self.result_cache.get_decoded(key, img)
+            if pred is None:
+                todo.append(idx)
+            else:
+                pred["file_name"] = img_path
+                preds[idx] = pred
+        if len(todo) > 0:
+            outputs = self.cls_predictor.predict([img_list[i] for i in todo])
+            todo_preds = self.cls_predictor.postprocess(
+                outputs, [img_path_list[i] for i in todo])
+            if todo_preds is None:
+                return None
+            for idx, pred in zip(todo, todo_preds):
+                preds[idx] = pred
+                value = {k: v for k, v in pred.items() if k != "file_name"}
+                self.result_cache.put(cached[idx][0], value, phashes[idx])
+        return preds
+
 
 # for CLI
 def main():
     """Function API used for commad line.
     """
+    print_info()
     cfg = args_cfg()
     clas_engine = PaddleClas(**cfg)
     res = clas_engine.predict(cfg["infer_imgs"], print_pred=True)
@@ -15,25 +15,41 @@
 import copy
 import importlib
 
+import paddle
 import paddle.nn as nn
 from paddle.jit import to_static
 from paddle.static import InputSpec
 
 from . import backbone, gears
-from .backbone import *
 from .gears import build_gear
 from .utils import *
+from .backbone.base.theseus_layer import register_return_hooks
 from ppcls.utils import logger
 from ppcls.utils.save_load import load_dygraph_pretrain
 
-__all__ = ["build_model", "RecModel", "DistillationModel"]
+__all__ = ["build_model", "RecModel", "DistillationModel", "MultiHeadModel"]
+
+
+def get_arch(name):
+    """
+    get RecModel, DistillationModel or a backbone by name, only the module
+    of the backbone is imported
+    """
+    mod = importlib.import_module(__name__)
+    if name in mod.__dict__:
+        return mod.__dict__[name]
+    return backbone.get_backbone(name)
+
+
+def __getattr__(name):
+    # python>=3.7, keep `ppcls.arch.ResNet50` working
+    return backbone.get_backbone(name)
 
 
 def build_model(config):
     config = copy.deepcopy(config)
     model_type = config.pop("name")
-    mod = importlib.import_module(__name__)
-    arch = getattr(mod, model_type)(**config)
+    arch = get_arch(model_type)(**config)
     return arch
 
 
@@ -55,7 +71,7 @@ class RecModel(nn.Layer):
         super().__init__()
         backbone_config = config["Backbone"]
         backbone_name = backbone_config.pop("name")
-        self.backbone = eval(backbone_name)(**backbone_config)
+        self.backbone = get_arch(backbone_name)(**backbone_config)
         if "BackboneStopLayer" in config:
             backbone_stop_layer = config["BackboneStopLayer"]["name"]
             self.backbone.stop_after(backbone_stop_layer)
@@ -70,14 +86,22 @@ class RecModel(nn.Layer):
         else:
             self.head = None
 
+        # when set, the inputs of training are cached backbone features
+        # and only neck and head are run
+        self.use_cached_features = False
+
     def forward(self, x, label=None):
-        x = self.backbone(x)
+        if not (self.training and self.use_cached_features):
+            x = self.backbone(x)
         if self.neck is not None:
             x = self.neck(x)
         if self.head is not None:
             y = self.head(x, label)
         else:
             y = None
+        if isinstance(y, dict):
+            # heads such as Partial-FC return their logits with extra outputs
+            return dict(features=x, **y)
         return {"features": x, "logits": y}
 
 
@@ -91,6 +115,9 @@ class DistillationModel(nn.Layer):
         assert isinstance(models, list)
         self.model_list = []
         self.model_name_list = []
+        # models whose outputs are provided offline during training,
+        # such as teacher logits loaded from TeacherLogitsStore
+        self.skip_model_names = []
         if pretrained_list is not None:
             assert len(pretrained_list) == len(models)
 
@@ -102,7 +129,7 @@ class DistillationModel(nn.Layer):
             key = list(model_config.keys())[0]
             model_config = model_config[key]
             model_name = model_config.pop("name")
-            model = eval(model_name)(**model_config)
+            model = get_arch(model_name)(**model_config)
 
             if freeze_params_list[idx]:
                 for param in model.parameters():
@@ -119,8 +146,99 @@ class DistillationModel(nn.Layer):
     def forward(self, x, label=None):
         result_dict = dict()
         for idx, model_name in enumerate(self.model_name_list):
+            if self.training and model_name in self.skip_model_names:
+                continue
             if label is None:
                 result_dict[model_name] = self.model_list[idx](x)
             else:
                 result_dict[model_name] = self.model_list[idx](x, label)
         return result_dict
+
+
+class MultiHeadModel(nn.Layer):
+    """
+    run the backbone once and feed several branches, each with its own neck
+    and head, such as the classification and the retrieval embedding of the
+    same backbone. A branch takes the output of the backbone, or an
+    intermediate output tapped by return_patterns.
+    Args:
+        Backbone(dict): config of the backbone, its output is named "backbone"
+        return_patterns(list): patterns of the structured names of the
+            backbone sublayers to tap, such as "flatten" or "blocks.15"
+        branches(list): [{branch_name: {input, Neck, Head, pretrained}}],
+            input is "backbone" or a tapped name, pretrained is the path of
+            a RecModel checkpoint whose neck and head are loaded
+    Returns:
+        outputs(dict): branch name -> output of the branch
+    """
+
+    def __init__(self, Backbone, branches, return_patterns=None, **kargs):
+        super().__init__()
+        backbone_config = copy.deepcopy(Backbone)
+        backbone_name = backbone_config.pop("name")
+        self.backbone = get_arch(backbone_name)(**backbone_config)
+        self._taps = {}
+        tap_names = []
+        if return_patterns is not None:
+            tap_names = register_return_hooks(self.backbone, return_patterns,
+                                              self._save_tap)
+
+        self.branch_list = []
+        self.branch_name_list = []
+        self.branch_input_list = []
+        for branch_config in branches:
+            assert len(branch_config) == 1
+            key = list(branch_config.keys())[0]
+            branch_config = branch_config[key]
+            branch_input = branch_config.get("input", "backbone")
+            assert branch_input == "backbone" or branch_input in tap_names, \
+                "input {} of branch {} is not tapped by return_patterns, " \
+                "tapped: {}".format(branch_input, key, tap_names)
+            branch = _Branch(branch_config.get("Neck", None),
+                             branch_config.get("Head", None))
+            if branch_config.get("pretrained", None) is not None:
+                branch.load_rec_model(branch_config["pretrained"])
+            self.branch_list.append(self.add_sublayer(key, branch))
+            self.branch_name_list.append(key)
+            self.branch_input_list.append(branch_input)
+
+    def _save_tap(self, name, output):
+        self._taps[name] = output
+
+    def forward(self, x, label=None):
+        self._taps = {}
+        self._taps["backbone"] = self.backbone(x)
+        result_dict = dict()
+        for idx, branch_name in enumerate(self.branch_name_list):
+            result_dict[branch_name] = self.branch_list[idx](
+                self._taps[self.branch_input_list[idx]], label)
+        self._taps = {}
+        return result_dict
+
+
+class _Branch(nn.Layer):
+    def __init__(self, neck_config=None, head_config=None):
+        super().__init__()
+        self.neck = None if neck_config is None else build_gear(
+            copy.deepcopy(neck_config))
+        self.head = None if head_config is None else build_gear(
+            copy.deepcopy(head_config))
+
+    def load_rec_model(self, path):
+        """
+        load the neck and the head of a RecModel checkpoint
+        """
+        state_dict = paddle.load(path + ".pdparams")
+        self.set_dict({
+            key: value
+            for key, value in state_dict.items()
+            if key.startswith("neck.") or key.startswith("head.")
+        })
+        logger.info("load neck and head of branch from {}".format(path))
+
+    def forward(self, x, label=None):
+        if self.neck is not None:
+            x = self.neck(x)
+        if self.head is not None:
+            x = self.head(x, label)
+        return x
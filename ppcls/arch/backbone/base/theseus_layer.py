@@ -11,10 +11,37 @@ class Identity(nn.Layer):
         return inputs
 
 
+def register_return_hooks(layer, return_patterns, save_fn):
+    """
+    register hooks on the sublayers whose structured name, such as
+    "blocks.3" or "avg_pool", or full name matches one of return_patterns,
+    the output of every matched sublayer is passed to save_fn(name, output)
+    Returns:
+        names(list): structured names of the matched sublayers
+    """
+    names = []
+    for name, sublayer in layer.named_sublayers():
+        for return_pattern in return_patterns:
+            if re.fullmatch(return_pattern, name) or re.match(
+                    return_pattern, sublayer.full_name()):
+                sublayer.register_forward_post_hook(
+                    _make_save_hook(name, save_fn))
+                names.append(name)
+                break
+    return names
+
+
+def _make_save_hook(name, save_fn):
+    def hook(layer, inputs, output):
+        save_fn(name, output)
+
+    return hook
+
+
 class TheseusLayer(nn.Layer):
     def __init__(self, *args, return_patterns=None, **kwargs):
         super(TheseusLayer, self).__init__()
-        self.res_dict = None
+        self.res_dict = {}
         if return_patterns is not None:
             self._update_res(return_patterns)
 
@@ -39,13 +66,12 @@ class TheseusLayer(nn.Layer):
         return after_stop
 
     def _update_res(self, return_layers):
-        for layer_i in self._sub_layers:
-            layer_name = self._sub_layers[layer_i].full_name()
-            for return_pattern in return_layers:
-                if return_layers is not None and re.match(return_pattern,
-                                                          layer_name):
-                    self._sub_layers[layer_i].register_forward_post_hook(
-                        self._save_sub_res_hook)
+        return register_return_hooks(self, return_layers,
+                                     self._save_sub_res)
+
+    def _save_sub_res(self, name, output):
+        if self.res_dict is not None:
+            self.res_dict[name] = output
 
     def replace_sub(self, layer_name_pattern, replace_function,
                     recursive=True):
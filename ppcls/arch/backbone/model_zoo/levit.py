@@ -43,15 +43,32 @@ __all__ = list(MODEL_URLS.keys())
 
 
 def cal_attention_biases(attention_biases, attention_bias_idxs):
-    gather_list = []
-    attention_bias_t = paddle.transpose(attention_biases, (1, 0))
-    nums = attention_bias_idxs.shape[0]
-    for idx in range(nums):
-        gather = paddle.gather(attention_bias_t, attention_bias_idxs[idx])
-        gather_list.append(gather)
+    """
+    expand the bias of every relative offset to [num_heads, N_, N] with a
+    single gather
+    """
     shape0, shape1 = attention_bias_idxs.shape
-    gather = paddle.concat(gather_list)
-    return paddle.transpose(gather, (1, 0)).reshape((0, shape0, shape1))
+    gather = paddle.gather(
+        attention_biases, attention_bias_idxs.reshape([-1]), axis=1)
+    return gather.reshape((0, shape0, shape1))
+
+
+def get_attention_biases(layer):
+    """
+    attention biases of Attention or AttentionSubsample. In eval mode the
+    expanded biases are cached until the next training forward, mode change
+    or weight loading (LeViT.set_state_dict), they are not cached when the
+    layer is converted to static graph.
+    """
+    if layer.training or not paddle.in_dynamic_mode():
+        layer.ab = None
+        return cal_attention_biases(layer.attention_biases,
+                                    layer.attention_bias_idxs)
+    if layer.ab is None:
+        with paddle.no_grad():
+            layer.ab = cal_attention_biases(layer.attention_biases,
+                                            layer.attention_bias_idxs)
+    return layer.ab
 
 
 class Conv2d_BN(nn.Sequential):
@@ -174,6 +191,7 @@ class Attention(nn.Layer):
         tensor_idxs = paddle.to_tensor(idxs, dtype='int64')
         self.register_buffer('attention_bias_idxs',
                              paddle.reshape(tensor_idxs, [N, N]))
+        self.ab = None
 
     @paddle.no_grad()
     def train(self, mode=True):
@@ -181,14 +199,10 @@ class Attention(nn.Layer):
             super().train()
         else:
             super().eval()
-        if mode and hasattr(self, 'ab'):
-            del self.ab
-        else:
-            self.ab = cal_attention_biases(self.attention_biases,
-                                           self.attention_bias_idxs)
+        # rebuilt by the next forward in eval mode
+        self.ab = None
 
     def forward(self, x):
-        self.training = True
         B, N, C = x.shape
         qkv = self.qkv(x)
         qkv = paddle.reshape(qkv,
@@ -200,11 +214,7 @@ class Attention(nn.Layer):
         v = paddle.transpose(v, perm=[0, 2, 1, 3])
         k_transpose = paddle.transpose(k, perm=[0, 1, 3, 2])
 
-        if self.training:
-            attention_biases = cal_attention_biases(self.attention_biases,
-                                                    self.attention_bias_idxs)
-        else:
-            attention_biases = self.ab
+        attention_biases = get_attention_biases(self)
         attn = (paddle.matmul(q, k_transpose) * self.scale + attention_biases)
         attn = F.softmax(attn)
         x = paddle.transpose(paddle.matmul(attn, v), perm=[0, 2, 1, 3])
@@ -287,6 +297,7 @@ class AttentionSubsample(nn.Layer):
         tensor_idxs_ = paddle.to_tensor(idxs, dtype='int64')
         self.register_buffer('attention_bias_idxs',
                              paddle.reshape(tensor_idxs_, [N_, N]))
+        self.ab = None
 
     @paddle.no_grad()
     def train(self, mode=True):
@@ -294,14 +305,10 @@ class AttentionSubsample(nn.Layer):
             super().train()
         else:
             super().eval()
-        if mode and hasattr(self, 'ab'):
-            del self.ab
-        else:
-            self.ab = cal_attention_biases(self.attention_biases,
-                                           self.attention_bias_idxs)
+        # rebuilt by the next forward in eval mode
+        self.ab = None
 
     def forward(self, x):
-        self.training = True
         B, N, C = x.shape
         kv = self.kv(x)
         kv = paddle.reshape(kv, [B, N, self.num_heads, -1])
@@ -312,11 +319,7 @@ class AttentionSubsample(nn.Layer):
             self.q(x), [B, self.resolution_2, self.num_heads, self.key_dim])
         q = paddle.transpose(q, perm=[0, 2, 1, 3])
 
-        if self.training:
-            attention_biases = cal_attention_biases(self.attention_biases,
-                                                    self.attention_bias_idxs)
-        else:
-            attention_biases = self.ab
+        attention_biases = get_attention_biases(self)
 
         attn = (paddle.matmul(
             q, paddle.transpose(
@@ -420,6 +423,17 @@ class LeViT(nn.Layer):
             self.head_dist = BN_Linear(
                 embed_dim[-1], class_num) if class_num > 0 else Identity()
 
+    def set_state_dict(self, state_dict, use_structured_name=True):
+        # the cached attention biases are computed from the old weights
+        for layer in self.sublayers():
+            if isinstance(layer, (Attention, AttentionSubsample)):
+                layer.ab = None
+        return super().set_state_dict(
+            state_dict, use_structured_name=use_structured_name)
+
+    set_dict = set_state_dict
+    load_dict = set_state_dict
+
     def forward(self, x):
         x = self.patch_embed(x)
         x = x.flatten(2)
@@ -13,6 +13,8 @@
 # limitations under the License.
 # Reference: https://github.com/microsoft/Swin-Transformer
 
+from collections import OrderedDict
+
 import numpy as np
 import paddle
 import paddle.nn as nn
@@ -99,6 +101,50 @@ def window_reverse(windows, window_size, H, W, C):
     return x
 
 
+# shifted window masks of the recent input sizes, shared by all the blocks
+ATTN_MASK_CACHE_SIZE = 16
+_attn_mask_cache = OrderedDict()
+
+
+def get_attn_mask(H, W, window_size, shift_size):
+    """
+    attention mask of the shifted windows of a padded feature map, masks of
+    the recent sizes are kept in a LRU cache
+    Args:
+        H, W (int): height and width of the feature map, multiples of
+            window_size
+    Returns:
+        attn_mask: (nW, window_size*window_size, window_size*window_size)
+    """
+    key = (H, W, window_size, shift_size, paddle.get_device())
+    if paddle.in_dynamic_mode() and key in _attn_mask_cache:
+        _attn_mask_cache.move_to_end(key)
+        return _attn_mask_cache[key]
+
+    img_mask = np.zeros((1, H, W, 1), dtype="float32")  # 1 H W 1
+    h_slices = (slice(0, -window_size), slice(-window_size, -shift_size),
+                slice(-shift_size, None))
+    w_slices = (slice(0, -window_size), slice(-window_size, -shift_size),
+                slice(-shift_size, None))
+    cnt = 0
+    for h in h_slices:
+        for w in w_slices:
+            img_mask[:, h, w, :] = cnt
+            cnt += 1
+    mask_windows = img_mask.reshape([
+        H // window_size, window_size, W // window_size, window_size
+    ]).transpose([0, 2, 1, 3]).reshape([-1, window_size * window_size])
+    attn_mask = mask_windows[:, None, :] - mask_windows[:, :, None]
+    attn_mask = paddle.to_tensor(-100.0 * (attn_mask != 0).astype("float32"))
+
+    # tensors built when converting to static graph are not kept
+    if paddle.in_dynamic_mode():
+        _attn_mask_cache[key] = attn_mask
+        if len(_attn_mask_cache) > ATTN_MASK_CACHE_SIZE:
+            _attn_mask_cache.popitem(last=False)
+    return attn_mask
+
+
 class WindowAttention(nn.Layer):
     r""" Window based multi-head self attention (W-MSA) module with relative position bias.
     It supports both of shifted and non-shifted window.
@@ -165,6 +211,36 @@ class WindowAttention(nn.Layer):
 
         trunc_normal_(self.relative_position_bias_table)
         self.softmax = nn.Softmax(axis=-1)
+        # relative position bias cached in eval mode
+        self.relative_position_bias = None
+
+    def get_relative_position_bias(self):
+        """
+        Returns:
+            relative_position_bias: (nH, Wh*Ww, Wh*Ww)
+        In eval mode the bias is gathered once and kept until the next
+        training forward or weight loading (SwinTransformer.set_state_dict).
+        """
+        if not self.training and paddle.in_dynamic_mode() and \
+                self.relative_position_bias is not None:
+            return self.relative_position_bias
+
+        index = self.relative_position_index.reshape([-1])
+
+        relative_position_bias = paddle.index_select(
+            self.relative_position_bias_table, index)
+        relative_position_bias = relative_position_bias.reshape([
+            self.window_size[0] * self.window_size[1],
+            self.window_size[0] * self.window_size[1], -1
+        ])  # Wh*Ww,Wh*Ww,nH
+
+        relative_position_bias = relative_position_bias.transpose(
+            [2, 0, 1])  # nH, Wh*Ww, Wh*Ww
+        if self.training or not paddle.in_dynamic_mode():
+            self.relative_position_bias = None
+        else:
+            self.relative_position_bias = relative_position_bias.detach()
+        return relative_position_bias
 
     def forward(self, x, mask=None):
         """
@@ -181,17 +257,7 @@ class WindowAttention(nn.Layer):
         q = q * self.scale
         attn = paddle.mm(q, k.transpose([0, 1, 3, 2]))
 
-        index = self.relative_position_index.reshape([-1])
-
-        relative_position_bias = paddle.index_select(
-            self.relative_position_bias_table, index)
-        relative_position_bias = relative_position_bias.reshape([
-            self.window_size[0] * self.window_size[1],
-            self.window_size[0] * self.window_size[1], -1
-        ])  # Wh*Ww,Wh*Ww,nH
-
-        relative_position_bias = relative_position_bias.transpose(
-            [2, 0, 1])  # nH, Wh*Ww, Wh*Ww
+        relative_position_bias = self.get_relative_position_bias()
         attn = attn + relative_position_bias.unsqueeze(0)
 
         if mask is not None:
@@ -234,7 +300,9 @@ class SwinTransformerBlock(nn.Layer):
 
     Args:
         dim (int): Number of input channels.
-        input_resolution (tuple[int]): Input resulotion.
+        input_resolution (tuple[int]): Input resulotion at construction, it
+            decides the window size and shift of the block, inputs of other
+            sizes are padded to multiples of the window size.
         num_heads (int): Number of attention heads.
         window_size (int): Window size.
         shift_size (int): Shift size for SW-MSA.
@@ -293,37 +361,7 @@ class SwinTransformerBlock(nn.Layer):
                        act_layer=act_layer,
                        drop=drop)
 
-        if self.shift_size > 0:
-            # calculate attention mask for SW-MSA
-            H, W = self.input_resolution
-            img_mask = paddle.zeros((1, H, W, 1))  # 1 H W 1
-            h_slices = (slice(0, -self.window_size),
-                        slice(-self.window_size, -self.shift_size),
-                        slice(-self.shift_size, None))
-            w_slices = (slice(0, -self.window_size),
-                        slice(-self.window_size, -self.shift_size),
-                        slice(-self.shift_size, None))
-            cnt = 0
-            for h in h_slices:
-                for w in w_slices:
-                    img_mask[:, h, w, :] = cnt
-                    cnt += 1
-
-            mask_windows = window_partition(
-                img_mask, self.window_size)  # nW, window_size, window_size, 1
-            mask_windows = mask_windows.reshape(
-                [-1, self.window_size * self.window_size])
-            attn_mask = mask_windows.unsqueeze(1) - mask_windows.unsqueeze(2)
-
-            huns = -100.0 * paddle.ones_like(attn_mask)
-            attn_mask = huns * (attn_mask != 0).astype("float32")
-        else:
-            attn_mask = None
-
-        self.register_buffer("attn_mask", attn_mask)
-
-    def forward(self, x):
-        H, W = self.input_resolution
+    def forward(self, x, H, W):
         B, L, C = x.shape
         assert L == H * W, "input feature has wrong size"
 
@@ -331,12 +369,23 @@ class SwinTransformerBlock(nn.Layer):
         x = self.norm1(x)
         x = x.reshape([B, H, W, C])
 
+        # pad the feature map to multiples of the window size
+        pad_r = (self.window_size - W % self.window_size) % self.window_size
+        pad_b = (self.window_size - H % self.window_size) % self.window_size
+        if pad_r > 0 or pad_b > 0:
+            x = F.pad(x, [0, pad_r, 0, pad_b], data_format="NHWC")
+        Hp, Wp = H + pad_b, W + pad_r
+
         # cyclic shift
         if self.shift_size > 0:
             shifted_x = paddle.roll(
                 x, shifts=(-self.shift_size, -self.shift_size), axis=(1, 2))
+            # calculate attention mask for SW-MSA
+            attn_mask = get_attn_mask(Hp, Wp, self.window_size,
+                                      self.shift_size)
         else:
             shifted_x = x
+            attn_mask = None
 
         # partition windows
         x_windows = window_partition(
@@ -347,12 +396,12 @@ class SwinTransformerBlock(nn.Layer):
 
         # W-MSA/SW-MSA
         attn_windows = self.attn(
-            x_windows, mask=self.attn_mask)  # nW*B, window_size*window_size, C
+            x_windows, mask=attn_mask)  # nW*B, window_size*window_size, C
 
         # merge windows
         attn_windows = attn_windows.reshape(
             [-1, self.window_size, self.window_size, C])
-        shifted_x = window_reverse(attn_windows, self.window_size, H, W,
+        shifted_x = window_reverse(attn_windows, self.window_size, Hp, Wp,
                                    C)  # B H' W' C
 
         # reverse cyclic shift
@@ -363,6 +412,8 @@ class SwinTransformerBlock(nn.Layer):
                 axis=(1, 2))
         else:
             x = shifted_x
+        if pad_r > 0 or pad_b > 0:
+            x = x[:, :H, :W, :]
         x = x.reshape([B, H * W, C])
 
         # FFN
@@ -407,17 +458,18 @@ class PatchMerging(nn.Layer):
         self.reduction = nn.Linear(4 * dim, 2 * dim, bias_attr=False)
         self.norm = norm_layer(4 * dim)
 
-    def forward(self, x):
+    def forward(self, x, H, W):
         """
         x: B, H*W, C
         """
-        H, W = self.input_resolution
         B, L, C = x.shape
         assert L == H * W, "input feature has wrong size"
-        assert H % 2 == 0 and W % 2 == 0, "x size ({}*{}) are not even.".format(
-            H, W)
 
         x = x.reshape([B, H, W, C])
+        # pad odd sizes
+        if H % 2 == 1 or W % 2 == 1:
+            x = F.pad(x, [0, W % 2, 0, H % 2], data_format="NHWC")
+            H, W = H + H % 2, W + W % 2
 
         x0 = x[:, 0::2, 0::2, :]  # B H/2 W/2 C
         x1 = x[:, 1::2, 0::2, :]  # B H/2 W/2 C
@@ -429,7 +481,7 @@ class PatchMerging(nn.Layer):
         x = self.norm(x)
         x = self.reduction(x)
 
-        return x
+        return x, H // 2, W // 2
 
     def extra_repr(self):
         return "input_resolution={}, dim={}".format(self.input_resolution,
@@ -509,12 +561,12 @@ class BasicLayer(nn.Layer):
         else:
             self.downsample = None
 
-    def forward(self, x):
+    def forward(self, x, H, W):
         for blk in self.blocks:
-            x = blk(x)
+            x = blk(x, H, W)
         if self.downsample is not None:
-            x = self.downsample(x)
-        return x
+            x, H, W = self.downsample(x, H, W)
+        return x, H, W
 
     def extra_repr(self):
         return "dim={}, input_resolution={}, depth={}".format(
@@ -569,14 +621,20 @@ class PatchEmbed(nn.Layer):
 
     def forward(self, x):
         B, C, H, W = x.shape
-        # TODO (littletomatodonkey), uncomment the line will cause failure of jit.save
-        # assert [H, W] == self.img_size[:2], "Input image size ({H}*{W}) doesn't match model ({}*{}).".format(H, W, self.img_size[0], self.img_size[1])
+        # pad the image to multiples of the patch size
+        pad_r = (
+            self.patch_size[1] - W % self.patch_size[1]) % self.patch_size[1]
+        pad_b = (
+            self.patch_size[0] - H % self.patch_size[0]) % self.patch_size[0]
+        if pad_r > 0 or pad_b > 0:
+            x = F.pad(x, [0, pad_r, 0, pad_b])
         x = self.proj(x)
+        Ph, Pw = x.shape[2], x.shape[3]
 
         x = x.flatten(2).transpose([0, 2, 1])  # B Ph*Pw C
         if self.norm is not None:
             x = self.norm(x)
-        return x
+        return x, Ph, Pw
 
     def flops(self):
         Ho, Wo = self.patches_resolution
@@ -706,14 +764,25 @@ class SwinTransformer(nn.Layer):
             zeros_(m.bias)
             ones_(m.weight)
 
+    def set_state_dict(self, state_dict, use_structured_name=True):
+        # the cached relative position biases are gathered from old weights
+        for layer in self.sublayers():
+            if isinstance(layer, WindowAttention):
+                layer.relative_position_bias = None
+        return super().set_state_dict(
+            state_dict, use_structured_name=use_structured_name)
+
+    set_dict = set_state_dict
+    load_dict = set_state_dict
+
     def forward_features(self, x):
-        x = self.patch_embed(x)
+        x, H, W = self.patch_embed(x)
         if self.ape:
             x = x + self.absolute_pos_embed
         x = self.pos_drop(x)
 
         for layer in self.layers:
-            x = layer(x)
+            x, H, W = layer(x, H, W)
 
         x = self.norm(x)  # B L C
         x = self.avgpool(x.transpose([0, 2, 1]))  # B C 1
@@ -0,0 +1,193 @@
+# copyright (c) 2021 PaddlePaddle Authors. All Rights Reserve.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import copy
+
+import numpy as np
+import paddle
+import paddle.nn as nn
+
+from ppcls.arch.backbone.base.theseus_layer import Identity
+from ppcls.utils import logger
+
+__all__ = ["fuse_model"]
+
+CONV_TYPES = (nn.Conv1D, nn.Conv2D, nn.Conv3D)
+BN_TYPES = (nn.BatchNorm, nn.BatchNorm1D, nn.BatchNorm2D, nn.BatchNorm3D)
+DROPOUT_TYPES = (nn.Dropout, nn.Dropout2D, nn.Dropout3D, nn.AlphaDropout)
+
+
+def _get_parent(model, name):
+    names = name.split(".")
+    parent = model
+    for sub_name in names[:-1]:
+        parent = parent._sub_layers[sub_name]
+    return parent, names[-1]
+
+
+def _set_sublayer(model, name, layer):
+    parent, key = _get_parent(model, name)
+    parent._sub_layers[key] = layer
+
+
+def _trace_leaf_layers(model, x):
+    """
+    run the model once and record the input and output tensors of every
+    leaf layer in execution order
+    """
+    records = []
+    hooks = []
+
+    def hook(layer, inputs, output):
+        records.append((layer, inputs, output))
+
+    for name, layer in model.named_sublayers():
+        if len(layer.sublayers()) == 0:
+            hooks.append(layer.register_forward_post_hook(hook))
+    model(x)
+    for h in hooks:
+        h.remove()
+    return records
+
+
+def _find_fusible_pairs(model, records):
+    """
+    find (conv or linear, bn) pairs where the bn consumes the output of the
+    layer directly and nothing else consumes that output
+    """
+    layer_names = {id(layer): name for name, layer in model.named_sublayers()}
+    calls = {}
+    consumers = {}
+    producers = {}
+    for layer, inputs, output in records:
+        calls[id(layer)] = calls.get(id(layer), 0) + 1
+        for tensor in inputs:
+            consumers.setdefault(id(tensor), []).append(layer)
+        producers[id(output)] = layer
+
+    pairs = []
+    for layer, inputs, output in records:
+        if not isinstance(layer, BN_TYPES) or len(inputs) != 1:
+            continue
+        if getattr(layer, "_act", None) is not None:
+            continue
+        prev = producers.get(id(inputs[0]), None)
+        if not isinstance(prev, CONV_TYPES + (nn.Linear, )):
+            continue
+        if len(consumers[id(inputs[0])]) != 1:
+            continue
+        if calls[id(layer)] != 1 or calls[id(prev)] != 1:
+            continue
+        if isinstance(prev, CONV_TYPES) and getattr(
+                prev, "_data_format", "NCHW")[1] != "C":
+            continue
+        pairs.append((layer_names[id(prev)], layer_names[id(layer)]))
+    return pairs
+
+
+def _fold_bn(layer, bn):
+    """
+    fold bn into the weight and bias of the preceding conv or linear layer
+    """
+    mean = bn._mean.numpy()
+    std = np.sqrt(bn._variance.numpy() + bn._epsilon)
+    gamma = np.ones_like(mean) if bn.weight is None else bn.weight.numpy()
+    beta = np.zeros_like(mean) if bn.bias is None else bn.bias.numpy()
+    scale = gamma / std
+
+    weight = layer.weight.numpy()
+    if isinstance(layer, nn.Linear):
+        # weight of linear is [in_features, out_features]
+        weight = weight * scale.reshape([1, -1])
+    else:
+        weight = weight * scale.reshape([-1] + [1] * (weight.ndim - 1))
+    layer.weight.set_value(weight.astype(layer.weight.dtype))
+
+    bias = np.zeros_like(mean) if layer.bias is None else layer.bias.numpy()
+    bias = (bias - mean) * scale + beta
+    if layer.bias is None:
+        layer.bias = layer.create_parameter(
+            shape=[bias.shape[0]], dtype=layer.weight.dtype, is_bias=True)
+    layer.bias.set_value(bias.astype(layer.weight.dtype))
+
+
+def _flatten_outputs(out):
+    if isinstance(out, dict):
+        return sum([_flatten_outputs(out[k]) for k in sorted(out)], [])
+    if isinstance(out, (list, tuple)):
+        return sum([_flatten_outputs(o) for o in out], [])
+    if isinstance(out, paddle.Tensor):
+        return [out.numpy()]
+    return []
+
+
+def fuse_model(model, input_shape, check=True, rtol=1e-3, atol=1e-4):
+    """
+    fuse the model in eval mode for inference:
+        1. fold BN into the preceding conv or linear layer
+        2. merge parallel branches of the layers which provide an equivalent
+           kernel (get_equivalent_kernel_bias, such as RepVGG), this is done
+           by their eval()
+        3. replace folded BN and dropout layers by Identity, which adds no
+           op to the exported program
+    Args:
+        model(nn.Layer): model in eval mode
+        input_shape(list): input shape without batch size, such as [3, 224, 224]
+        check(bool): whether to check the fused model against the origin
+        rtol(float): relative tolerance of the check
+        atol(float): absolute tolerance of the check
+    Returns:
+        model(nn.Layer): the fused model, or the origin model if the check
+            fails
+    """
+    origin_model = model
+    model = copy.deepcopy(model)
+    model.eval()
+    paddle.seed(0)
+    x = paddle.rand([2] + list(input_shape), dtype="float32")
+
+    with paddle.no_grad():
+        ref_outputs = _flatten_outputs(model(x))
+
+        records = _trace_leaf_layers(model, x)
+        pairs = _find_fusible_pairs(model, records)
+        del records
+        sublayers = dict(model.named_sublayers())
+        for layer_name, bn_name in pairs:
+            _fold_bn(sublayers[layer_name], sublayers[bn_name])
+            _set_sublayer(model, bn_name, Identity())
+
+        num_dropout = 0
+        for name, layer in list(model.named_sublayers()):
+            if isinstance(layer, DROPOUT_TYPES):
+                _set_sublayer(model, name, Identity())
+                num_dropout += 1
+
+        logger.info("fuse model: {} bn folded, {} dropout removed".format(
+            len(pairs), num_dropout))
+        if not check:
+            return model
+
+        outputs = _flatten_outputs(model(x))
+    for ref, out in zip(ref_outputs, outputs):
+        if ref.shape != out.shape or not np.allclose(
+                ref, out, rtol=rtol, atol=atol):
+            max_diff = np.abs(ref - out).max() if ref.shape == out.shape \
+                else "shape mismatch"
+            logger.warning(
+                "the fused model is not equivalent to the origin model "
+                "(max diff: {}), the origin model is used".format(max_diff))
+            return origin_model
+    logger.info("the fused model is equivalent to the origin model")
+    return model
@@ -15,6 +15,8 @@
 from .arcmargin import ArcMargin
 from .cosmargin import CosMargin
 from .circlemargin import CircleMargin
+from .partial_fc import PartialFCArcMargin, PartialFCCosMargin
+from .partial_fc import PartialFCCircleMargin
 from .fc import FC
 from .vehicle_neck import VehicleNeck
 
@@ -23,7 +25,8 @@ __all__ = ['build_gear']
 
 def build_gear(config):
     support_dict = [
-        'ArcMargin', 'CosMargin', 'CircleMargin', 'FC', 'VehicleNeck'
+        'ArcMargin', 'CosMargin', 'CircleMargin', 'PartialFCArcMargin',
+        'PartialFCCosMargin', 'PartialFCCircleMargin', 'FC', 'VehicleNeck'
     ]
     module_name = config.pop('name')
     assert module_name in support_dict, Exception(
@@ -0,0 +1,324 @@
+# copyright (c) 2021 PaddlePaddle Authors. All Rights Reserve.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import math
+
+import paddle
+import paddle.nn as nn
+import paddle.distributed as dist
+from paddle.autograd import PyLayer
+
+__all__ = [
+    'PartialFCArcMargin', 'PartialFCCosMargin', 'PartialFCCircleMargin'
+]
+
+
+def shard_range(class_num, rank=None, world_size=None):
+    """
+    Returns:
+        start(int), end(int): classes [start, end) kept by the rank
+    """
+    rank = dist.get_rank() if rank is None else rank
+    world_size = dist.get_world_size() if world_size is None else world_size
+    base, rest = divmod(class_num, world_size)
+    start = rank * base + min(rank, rest)
+    return start, start + base + (1 if rank < rest else 0)
+
+
+def has_sharded_params(layer):
+    """
+    whether the layer has parameters sharded over ranks, such as the class
+    centers of the Partial-FC heads
+    """
+    return any(
+        getattr(param, "is_distributed", False)
+        for param in layer.parameters())
+
+
+def sync_params_buffers(layer):
+    """
+    broadcast the parameters and buffers of rank 0 to the other ranks, the
+    sharded parameters keep the values of their own rank. Used instead of
+    paddle.DataParallel for models with sharded parameters.
+    """
+    for param in layer.parameters():
+        if not getattr(param, "is_distributed", False):
+            dist.broadcast(param, src=0)
+    for buffer in layer.buffers():
+        dist.broadcast(buffer, src=0)
+
+
+@paddle.no_grad()
+def allreduce_grads(layer):
+    """
+    average the gradients of the parameters over ranks after backward, the
+    gradients of the sharded parameters are only of their own rank and are
+    kept as they are
+    """
+    world_size = dist.get_world_size()
+    for param in layer.parameters():
+        if param.stop_gradient or getattr(param, "is_distributed", False):
+            continue
+        grad = param._grad_ivar()
+        if grad is None:
+            continue
+        dist.all_reduce(grad)
+        grad.scale_(1.0 / world_size)
+
+
+def _all_gather_padded(x):
+    """
+    all_gather tensors whose first dimension may differ between ranks
+    Returns:
+        gathered(paddle.Tensor): concatenated tensors of all ranks
+        sizes(list): first dimension of every rank
+    """
+    size_list = []
+    dist.all_gather(size_list,
+                    paddle.to_tensor(
+                        [x.shape[0]], dtype="int64"))
+    sizes = [int(size.numpy()[0]) for size in size_list]
+    max_size = max(sizes)
+    if x.shape[0] < max_size:
+        x = paddle.concat([
+            x, paddle.zeros(
+                [max_size - x.shape[0]] + x.shape[1:], dtype=x.dtype)
+        ])
+    x_list = []
+    dist.all_gather(x_list, x)
+    return paddle.concat([t[:size] for t, size in zip(x_list, sizes)]), sizes
+
+
+class _AllGather(PyLayer):
+    """
+    gather the embeddings of all ranks, the gradients of every rank are summed
+    and sent back to the rank of the embedding
+    """
+
+    @staticmethod
+    def forward(ctx, x):
+        gathered, sizes = _all_gather_padded(x)
+        rank = dist.get_rank()
+        ctx.start = sum(sizes[:rank])
+        ctx.end = ctx.start + sizes[rank]
+        return gathered
+
+    @staticmethod
+    def backward(ctx, grad):
+        grad = grad.clone()
+        dist.all_reduce(grad)
+        # the loss is the mean over the global batch while allreduce_grads
+        # averages the gradients of the backbone over ranks again
+        return grad[ctx.start:ctx.end] * dist.get_world_size()
+
+
+class PartialFCHead(nn.Layer):
+    """
+    Base of the Partial-FC margin heads. The class centers are sharded over
+    ranks, and every step a rank only uses the centers of the positive
+    classes in the global batch plus randomly sampled negative centers, so
+    that the cost of a step does not grow with the number of classes.
+
+    The embeddings and labels of all ranks are gathered, and the output of a
+    rank is the logits of the global batch against its sampled centers. The
+    loss must be computed with PartialFCLoss, which normalizes the softmax
+    over the sampled centers of all ranks.
+
+    Args:
+        embedding_size(int): size of the embeddings
+        class_num(int): number of classes of all ranks
+        scale(float): scale of the logits
+        sample_ratio(float): ratio of the local centers used every step, all
+            the positive centers are used even when they are more
+    """
+
+    def __init__(self, embedding_size, class_num, scale, sample_ratio=1.0):
+        super(PartialFCHead, self).__init__()
+        assert 0. < sample_ratio <= 1., \
+            "sample_ratio should be in (0, 1], but got {}".format(sample_ratio)
+        self.embedding_size = embedding_size
+        self.class_num = class_num
+        self.scale = scale
+        self.sample_ratio = sample_ratio
+        self.world_size = dist.get_world_size()
+        self.class_start, self.class_end = shard_range(class_num)
+        self.local_class_num = self.class_end - self.class_start
+
+        # the same initialization as the dense weight of the margin heads
+        self.weight = self.create_parameter(
+            shape=[embedding_size, self.local_class_num],
+            attr=paddle.ParamAttr(initializer=paddle.nn.initializer.
+                                  XavierNormal(
+                                      fan_in=embedding_size,
+                                      fan_out=class_num)))
+        # every rank owns different centers, allreduce_grads must not
+        # average their gradients (tests/test_partial_fc.py), and checkpoints
+        # keep one shard per rank
+        self.weight.is_distributed = True
+
+    def _margin_target(self, cos):
+        """
+        logits of the label class, computed for the label column only
+        """
+        raise NotImplementedError
+
+    def _margin_other(self, cos):
+        """
+        logits of the other classes
+        """
+        return cos
+
+    def _sample(self, label):
+        """
+        Args:
+            label(paddle.Tensor): [batch] global labels
+        Returns:
+            index(paddle.Tensor|None): local index of the sampled centers,
+                None means all the local centers
+            local_label(paddle.Tensor): [batch] column of the label in the
+                sampled centers, -1 if the label is on another rank
+        """
+        local_label = label - self.class_start
+        in_shard = paddle.logical_and(local_label >= 0,
+                                      local_label < self.local_class_num)
+        local_label = paddle.where(in_shard, local_label,
+                                   paddle.full_like(local_label, -1))
+        num_sample = int(math.ceil(self.sample_ratio * self.local_class_num))
+        if num_sample >= self.local_class_num:
+            return None, local_label
+
+        # positives get a score above every random score of the negatives
+        score = paddle.rand([self.local_class_num])
+        positive = paddle.masked_select(local_label, in_shard)
+        if positive.shape[0] > 0:
+            score = paddle.scatter(
+                score, positive, paddle.full(
+                    positive.shape, 2.0, dtype=score.dtype))
+            num_positive = int((score > 1.5).astype("int64").sum().numpy()[0])
+            num_sample = max(num_sample, num_positive)
+        _, index = paddle.topk(score, k=num_sample)
+        index = paddle.sort(index)
+
+        remap = paddle.scatter(
+            paddle.full(
+                [self.local_class_num], -1, dtype="int64"),
+            index,
+            paddle.arange(
+                num_sample, dtype="int64"))
+        local_label = paddle.where(
+            in_shard,
+            paddle.gather(remap,
+                          paddle.where(in_shard, local_label,
+                                       paddle.zeros_like(local_label))),
+            local_label)
+        return index, local_label
+
+    def forward(self, input, label=None):
+        input_norm = paddle.sqrt(
+            paddle.sum(paddle.square(input), axis=1, keepdim=True))
+        input = paddle.divide(input, input_norm)
+
+        if not self.training or label is None:
+            weight_norm = paddle.sqrt(
+                paddle.sum(paddle.square(self.weight), axis=0, keepdim=True))
+            return paddle.matmul(input, paddle.divide(self.weight,
+                                                      weight_norm))
+
+        label = label.reshape([-1]).astype("int64")
+        label.stop_gradient = True
+        if self.world_size > 1:
+            input = _AllGather.apply(input)
+            label, _ = _all_gather_padded(label)
+
+        index, local_label = self._sample(label)
+        weight = self.weight if index is None else paddle.gather(
+            self.weight, index, axis=1)
+        weight_norm = paddle.sqrt(
+            paddle.sum(paddle.square(weight), axis=0, keepdim=True))
+        weight = paddle.divide(weight, weight_norm)
+        cos = paddle.matmul(input, weight)
+
+        # apply the margin on the label column only, instead of mixing two
+        # dense logits with a one-hot mask
+        logits = self._margin_other(cos)
+        rows = paddle.nonzero(local_label >= 0).reshape([-1])
+        if rows.shape[0] > 0:
+            target = paddle.stack(
+                [rows, paddle.gather(local_label, rows)], axis=1)
+            logits = paddle.scatter_nd_add(
+                logits, target,
+                self._margin_target(paddle.gather_nd(cos, target)) -
+                paddle.gather_nd(logits, target))
+        return {
+            "logits": logits * self.scale,
+            "partial_fc_label": local_label
+        }
+
+
+class PartialFCArcMargin(PartialFCHead):
+    def __init__(self,
+                 embedding_size,
+                 class_num,
+                 margin=0.5,
+                 scale=80.0,
+                 easy_margin=False,
+                 sample_ratio=1.0):
+        super(PartialFCArcMargin, self).__init__(embedding_size, class_num,
+                                                 scale, sample_ratio)
+        self.margin = margin
+        self.easy_margin = easy_margin
+
+    def _margin_target(self, cos):
+        sin = paddle.sqrt(1.0 - paddle.square(cos) + 1e-6)
+        phi = cos * math.cos(self.margin) - sin * math.sin(self.margin)
+        if self.easy_margin:
+            return paddle.where(cos > 0, phi, cos)
+        th = math.cos(self.margin) * (-1)
+        mm = math.sin(self.margin) * self.margin
+        return paddle.where(cos > th, phi, cos - mm)
+
+
+class PartialFCCosMargin(PartialFCHead):
+    def __init__(self,
+                 embedding_size,
+                 class_num,
+                 margin=0.35,
+                 scale=64.0,
+                 sample_ratio=1.0):
+        super(PartialFCCosMargin, self).__init__(embedding_size, class_num,
+                                                 scale, sample_ratio)
+        self.margin = margin
+
+    def _margin_target(self, cos):
+        return cos - self.margin
+
+
+class PartialFCCircleMargin(PartialFCHead):
+    def __init__(self,
+                 embedding_size,
+                 class_num,
+                 margin,
+                 scale,
+                 sample_ratio=1.0):
+        super(PartialFCCircleMargin, self).__init__(embedding_size, class_num,
+                                                    scale, sample_ratio)
+        self.margin = margin
+
+    def _margin_target(self, cos):
+        alpha_p = paddle.clip(-cos.detach() + 1 + self.margin, min=0.)
+        return alpha_p * (cos - (1 - self.margin))
+
+    def _margin_other(self, cos):
+        alpha_n = paddle.clip(cos.detach() + self.margin, min=0.)
+        return alpha_n * (cos - self.margin)
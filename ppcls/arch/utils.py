@@ -12,8 +12,6 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import six
-import types
 from difflib import SequenceMatcher
 
 from . import backbone
@@ -23,11 +21,7 @@ def get_architectures():
     """
     get all of model architectures
     """
-    names = []
-    for k, v in backbone.__dict__.items():
-        if isinstance(v, (types.FunctionType, six.class_types)):
-            names.append(k)
-    return names
+    return backbone.get_apis()
 
 
 def get_blacklist_model_in_static_mode():
@@ -26,9 +26,13 @@ from ppcls.data.dataloader.common_dataset import create_operators
 from ppcls.data.dataloader.vehicle_dataset import CompCars, VeriWild
 from ppcls.data.dataloader.logo_dataset import LogoDataset
 from ppcls.data.dataloader.icartoon_dataset import ICartoonDataset
+from ppcls.data.dataloader.seeded_dataset import SeededAugDataset
+from ppcls.data.dataloader.cached_feature_dataset import CachedFeatureDataset
+from ppcls.data.dataloader.infer_dataset import InferDataset, infer_collate_fn
 
 # sampler
 from ppcls.data.dataloader.DistributedRandomIdentitySampler import DistributedRandomIdentitySampler
+from ppcls.data.dataloader.resumable_sampler import ResumableBatchSampler
 from ppcls.data import preprocess
 from ppcls.data.preprocess import transform
 
@@ -53,7 +57,7 @@ def create_operators(params):
     return ops
 
 
-def build_dataloader(config, mode, device, seed=None):
+def build_dataloader(config, mode, device, seed=None, resumable=False):
     assert mode in ['Train', 'Eval', 'Test', 'Gallery', 'Query'
                     ], "Mode should be Train, Eval, Test, Gallery, Query"
     # build dataset
@@ -64,8 +68,14 @@ def build_dataloader(config, mode, device, seed=None):
         batch_transform = config_dataset.pop('batch_transform_ops')
     else:
         batch_transform = None
+    seeded_aug = config_dataset.pop('seeded_aug', None)
 
     dataset = eval(dataset_name)(**config_dataset)
+    if seeded_aug is not None:
+        # batch ops mix samples, which breaks the per-sample lookup
+        assert batch_transform is None, \
+            "seeded_aug can not be used together with batch_transform_ops"
+        dataset = SeededAugDataset(dataset, **seeded_aug)
 
     logger.debug("build dataset({}) success...".format(dataset))
 
@@ -80,6 +90,17 @@ def build_dataloader(config, mode, device, seed=None):
         sampler_name = config_sampler.pop("name")
         batch_sampler = eval(sampler_name)(dataset, **config_sampler)
 
+    if mode == "Train" and resumable:
+        # the train order is decided by (seed, epoch) to resume mid-epoch
+        if batch_sampler is None:
+            batch_sampler = BatchSampler(
+                dataset=dataset,
+                shuffle=shuffle,
+                batch_size=batch_size,
+                drop_last=drop_last)
+        batch_sampler = ResumableBatchSampler(
+            batch_sampler, seed=0 if seed is None else seed)
+
     logger.debug("build batch_sampler({}) success...".format(batch_sampler))
 
     # build batch operator
@@ -0,0 +1,43 @@
+#copyright (c) 2021 PaddlePaddle Authors. All Rights Reserve.
+#
+#Licensed under the Apache License, Version 2.0 (the "License");
+#you may not use this file except in compliance with the License.
+#You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#Unless required by applicable law or agreed to in writing, software
+#distributed under the License is distributed on an "AS IS" BASIS,
+#WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#See the License for the specific language governing permissions and
+#limitations under the License.
+
+from __future__ import print_function
+
+import numpy as np
+from paddle.io import Dataset
+
+from ppcls.utils.feature_store import FeatureStore
+
+
+class CachedFeatureDataset(Dataset):
+    """
+    read backbone features written by Trainer.build_feature_cache
+    Args:
+        cache_dir(str): directory of the FeatureStore
+    """
+
+    def __init__(self, cache_dir):
+        self.store = FeatureStore(cache_dir)
+        self.labels = self.store.labels
+
+    def __getitem__(self, idx):
+        return (np.asarray(self.store.features[idx], dtype="float32"),
+                self.store.labels[idx])
+
+    def __len__(self):
+        return len(self.store)
+
+    @property
+    def class_num(self):
+        return len(set(self.labels))
@@ -0,0 +1,65 @@
+#copyright (c) 2021 PaddlePaddle Authors. All Rights Reserve.
+#
+#Licensed under the Apache License, Version 2.0 (the "License");
+#you may not use this file except in compliance with the License.
+#You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#Unless required by applicable law or agreed to in writing, software
+#distributed under the License is distributed on an "AS IS" BASIS,
+#WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#See the License for the specific language governing permissions and
+#limitations under the License.
+
+from __future__ import print_function
+
+import numpy as np
+from paddle.io import Dataset
+
+from ppcls.data.preprocess import transform
+from ppcls.utils import logger
+from .common_dataset import create_operators
+
+
+class InferDataset(Dataset):
+    """
+    read and preprocess images for inference in dataloader workers
+    Args:
+        image_list(list): image file paths
+        transform_ops(list): config of Infer.transforms, the output of the
+            ops is used as the model input directly
+    """
+
+    def __init__(self, image_list, transform_ops):
+        self.images = image_list
+        self._transform_ops = create_operators(transform_ops)
+
+    def __getitem__(self, idx):
+        try:
+            with open(self.images[idx], 'rb') as f:
+                img = f.read()
+            img = transform(img, self._transform_ops)
+            return (img, idx)
+        except Exception as ex:
+            # the failed image is dropped by infer_collate_fn
+            logger.error("Exception occured when parse image: {} with msg: {}".
+                         format(self.images[idx], ex))
+            return None
+
+    def __len__(self):
+        return len(self.images)
+
+
+def infer_collate_fn(batch):
+    batch = [sample for sample in batch if sample is not None]
+    if len(batch) == 0:
+        return [
+            np.zeros(
+                [0], dtype="float32"), np.zeros(
+                    [0], dtype="int64")
+        ]
+    return [
+        np.stack([sample[0] for sample in batch]).astype("float32"),
+        np.array([sample[1] for sample in batch], dtype="int64")
+    ]
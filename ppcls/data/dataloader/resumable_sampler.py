@@ -0,0 +1,70 @@
+#copyright (c) 2021 PaddlePaddle Authors. All Rights Reserve.
+#
+#Licensed under the Apache License, Version 2.0 (the "License");
+#you may not use this file except in compliance with the License.
+#You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#Unless required by applicable law or agreed to in writing, software
+#distributed under the License is distributed on an "AS IS" BASIS,
+#WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#See the License for the specific language governing permissions and
+#limitations under the License.
+
+from __future__ import absolute_import
+from __future__ import division
+import random
+
+import numpy as np
+import paddle
+from paddle.io import Sampler
+
+
+class ResumableBatchSampler(Sampler):
+    """
+    Make the batch order of every epoch a function of (seed, epoch), so that
+    training can be resumed in the middle of an epoch. The skipped batches
+    are dropped as indices, the samples in them are never loaded.
+    Args:
+        batch_sampler(Sampler): the batch sampler to wrap
+        seed(int): shuffle seed, it should be the same on all ranks
+    """
+
+    def __init__(self, batch_sampler, seed=0):
+        self.batch_sampler = batch_sampler
+        self.seed = seed
+        self.epoch = 0
+        self.skip = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def skip_batches(self, num):
+        """
+        skip the first num batches of the next epoch
+        """
+        self.skip = num
+
+    def __iter__(self):
+        if hasattr(self.batch_sampler, "set_epoch"):
+            self.batch_sampler.set_epoch(self.seed + self.epoch)
+        # samplers shuffling with the global random state are seeded as well,
+        # different ranks keep different streams as before
+        py_state = random.getstate()
+        np_state = np.random.get_state()
+        rank_seed = (self.seed + self.epoch) * paddle.distributed.get_world_size(
+        ) + paddle.distributed.get_rank()
+        random.seed(rank_seed)
+        np.random.seed(rank_seed % (2**32))
+        batches = list(self.batch_sampler)
+        random.setstate(py_state)
+        np.random.set_state(np_state)
+
+        skip, self.skip = self.skip, 0
+        self.epoch += 1
+        for batch in batches[skip:]:
+            yield batch
+
+    def __len__(self):
+        return len(self.batch_sampler)
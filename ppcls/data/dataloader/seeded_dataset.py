@@ -0,0 +1,83 @@
+#copyright (c) 2021 PaddlePaddle Authors. All Rights Reserve.
+#
+#Licensed under the Apache License, Version 2.0 (the "License");
+#you may not use this file except in compliance with the License.
+#You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#Unless required by applicable law or agreed to in writing, software
+#distributed under the License is distributed on an "AS IS" BASIS,
+#WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#See the License for the specific language governing permissions and
+#limitations under the License.
+
+from __future__ import print_function
+
+import os
+import random
+
+import numpy as np
+from paddle.io import Dataset
+
+
+class SeededAugDataset(Dataset):
+    """
+    Make the random augmentation of a sample reproducible. Every sample is
+    augmented with one of `aug_num` seeds, and the python and numpy random
+    states are reset from (seed, index, aug_seed) before the transform ops
+    run and restored after them. The sample index and the aug seed are
+    appended to the output, so that outputs computed offline, such as
+    teacher logits, can be looked up for exactly the same augmented view.
+    Args:
+        dataset(Dataset): dataset whose items are (img, label)
+        aug_num(int): number of augmented views per sample
+        seed(int): global seed of the views
+        fixed_aug_seed(int): always use this aug seed when it is not None,
+            used to build the offline outputs one view at a time
+    """
+
+    def __init__(self, dataset, aug_num=1, seed=0, fixed_aug_seed=None):
+        self.dataset = dataset
+        self.aug_num = aug_num
+        self.seed = seed
+        self.fixed_aug_seed = fixed_aug_seed
+        self._pid = None
+        self._rng = None
+
+    def __getattr__(self, name):
+        # only called when the attribute is not found on the wrapper
+        if name == "dataset":
+            raise AttributeError(name)
+        return getattr(self.dataset, name)
+
+    def _choose_aug_seed(self):
+        if self.fixed_aug_seed is not None:
+            return self.fixed_aug_seed
+        # every dataloader worker has its own pid, reseed once per worker
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._rng = np.random.RandomState(
+                (self.seed + self._pid + random.getrandbits(31)) % (2**31))
+        return int(self._rng.randint(self.aug_num))
+
+    def __getitem__(self, idx):
+        aug_seed = self._choose_aug_seed()
+        state = (self.seed * 1000003 + int(idx) * self.aug_num + aug_seed) % (
+            2**32)
+        # the global states are restored afterwards, with num_workers=0 they
+        # are the states of the main process
+        py_state = random.getstate()
+        np_state = np.random.get_state()
+        random.seed(state)
+        np.random.seed(state)
+        try:
+            img, label = self.dataset[idx][:2]
+        finally:
+            random.setstate(py_state)
+            np.random.set_state(np_state)
+        return (img, label, np.array(idx, dtype="int64"),
+                np.array(aug_seed, dtype="int64"))
+
+    def __len__(self):
+        return len(self.dataset)
@@ -13,27 +13,125 @@
 # limitations under the License.
 
 import os
+import heapq
 import argparse
 import base64
+import tempfile
+import itertools
 import numpy as np
 
+IMG_EXTS = ('.jpg', '.jpeg', '.png', '.bmp')
+LIST_EXTS = ('.txt', '.list')
 
-def get_image_list(img_file):
-    imgs_lists = []
+
+def _is_image(file_name):
+    return file_name.lower().endswith(IMG_EXTS)
+
+
+def _scan_dir(img_dir, recursive=False):
+    """
+    walk the directory with os.scandir, the paths are yielded while the
+    directory is being read
+    """
+    dirs = [img_dir]
+    while dirs:
+        cur_dir = dirs.pop()
+        with os.scandir(cur_dir) as it:
+            for entry in it:
+                if entry.is_dir():
+                    if recursive:
+                        dirs.append(entry.path)
+                elif _is_image(entry.name):
+                    yield entry.path
+
+
+def _read_list_file(list_file):
+    """
+    every line of the list file is an image path, optionally followed by
+    other fields such as the label, relative paths are relative to the
+    directory of the list file
+    """
+    root = os.path.dirname(list_file)
+    with open(list_file, "r") as fin:
+        for line in fin:
+            line = line.strip()
+            if not line:
+                continue
+            path = line.split()[0]
+            if not os.path.isabs(path) and not os.path.exists(path):
+                path = os.path.join(root, path)
+            yield path
+
+
+def _external_sort(paths, chunk_size=100000):
+    """
+    sort the paths with at most chunk_size paths in memory, sorted chunks
+    are spilled to temporary files and merged
+    """
+    chunk_files = []
+    try:
+        while True:
+            chunk = sorted(itertools.islice(paths, chunk_size))
+            if len(chunk_files) == 0 and len(chunk) < chunk_size:
+                # small enough to be sorted in memory
+                for path in chunk:
+                    yield path
+                return
+            if len(chunk) == 0:
+                break
+            f = tempfile.TemporaryFile(mode="w+")
+            f.writelines(path + "\n" for path in chunk)
+            f.seek(0)
+            chunk_files.append(f)
+        for path in heapq.merge(*[(line.rstrip("\n") for line in f)
+                                  for f in chunk_files]):
+            yield path
+    finally:
+        for f in chunk_files:
+            f.close()
+
+
+def iter_image_list(img_file,
+                    recursive=False,
+                    sort=False,
+                    sort_chunk_size=100000):
+    """
+    yield image paths lazily
+    Args:
+        img_file(str): an image, a directory of images, or a list file
+            (.txt or .list) whose lines start with image paths
+        recursive(bool): whether to find images in sub-directories
+        sort(bool): yield paths in order, at most sort_chunk_size paths are
+            kept in memory
+        sort_chunk_size(int): chunk size of sorting
+    """
     if img_file is None or not os.path.exists(img_file):
         raise Exception("not found any img file in {}".format(img_file))
 
-    img_end = ['jpg', 'png', 'jpeg', 'JPEG', 'JPG', 'bmp']
-    if os.path.isfile(img_file) and img_file.split('.')[-1] in img_end:
-        imgs_lists.append(img_file)
-    elif os.path.isdir(img_file):
-        for single_file in os.listdir(img_file):
-            if single_file.split('.')[-1] in img_end:
-                imgs_lists.append(os.path.join(img_file, single_file))
-    if len(imgs_lists) == 0:
+    if os.path.isdir(img_file):
+        paths = _scan_dir(img_file, recursive)
+    elif _is_image(img_file):
+        paths = iter([img_file])
+    elif img_file.lower().endswith(LIST_EXTS):
+        paths = _read_list_file(img_file)
+    else:
+        raise Exception(
+            "unsupported image file {}, the supported suffixes are {}, and "
+            "list files should end with {}".format(img_file, IMG_EXTS,
+                                                   LIST_EXTS))
+    if sort:
+        paths = _external_sort(paths, sort_chunk_size)
+
+    found = False
+    for path in paths:
+        found = True
+        yield path
+    if not found:
         raise Exception("not found any img file in {}".format(img_file))
-    imgs_lists = sorted(imgs_lists)
-    return imgs_lists
+
+
+def get_image_list(img_file, recursive=False):
+    return list(iter_image_list(img_file, recursive=recursive, sort=True))
 
 
 def get_image_list_from_label_file(image_path, label_file_path):
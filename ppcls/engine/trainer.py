@@ -16,6 +16,10 @@ from __future__ import division
 from __future__ import print_function
 import os
 import sys
+import copy
+import json
+import random
+import itertools
 import numpy as np
 __dir__ = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(os.path.abspath(os.path.join(__dir__, '../../')))
@@ -34,16 +38,23 @@ from ppcls.utils import logger
 from ppcls.utils.logger import init_logger
 from ppcls.utils.config import print_config
 from ppcls.data import build_dataloader
-from ppcls.arch import build_model
+from ppcls.data import ResumableBatchSampler
+from ppcls.data import InferDataset, infer_collate_fn
+from ppcls.arch import build_model, RecModel
 from ppcls.arch import apply_to_static
+from ppcls.arch.gears.partial_fc import has_sharded_params
+from ppcls.arch.gears.partial_fc import sync_params_buffers, allreduce_grads
 from ppcls.loss import build_loss
 from ppcls.metric import build_metrics
 from ppcls.optimizer import build_optimizer
 from ppcls.utils.save_load import load_dygraph_pretrain
 from ppcls.utils.save_load import init_model
 from ppcls.utils import save_load
+from ppcls.utils.logits_store import TeacherLogitsStore, TeacherLogitsWriter
+from ppcls.utils.feature_store import FeatureStore
+from ppcls.utils.feature_quant import QuantizedFeatures, FEATURE_DTYPES
 
-from ppcls.data.utils.get_image_list import get_image_list
+from ppcls.data.utils.get_image_list import iter_image_list
 from ppcls.data.postprocess import build_postprocess
 from ppcls.data import create_operators
 
@@ -80,8 +91,16 @@ class Trainer(object):
             load_dygraph_pretrain(self.model,
                                   self.config["Global"]["pretrained_model"])
 
+        # DataParallel allreduces the gradients of every parameter, the
+        # sharded parameters, such as the class centers of Partial-FC heads,
+        # are kept out of it and the other ones are synced by hand
+        self.sync_grads = False
         if self.config["Global"]["distributed"]:
-            self.model = paddle.DataParallel(self.model)
+            if has_sharded_params(self.model):
+                sync_params_buffers(self.model)
+                self.sync_grads = True
+            else:
+                self.model = paddle.DataParallel(self.model)
 
         self.vdl_writer = None
         if self.config['Global']['use_visualdl'] and mode == "train":
@@ -102,6 +121,281 @@ class Trainer(object):
         self.eval_loss_func = None
         self.train_metric_func = None
         self.eval_metric_func = None
+        self.teacher_logits = None
+
+    def _unwrap_model(self):
+        if isinstance(self.model, paddle.DataParallel):
+            return self.model._layers
+        return self.model
+
+    def _build_cached_feature_dataloader(self):
+        """
+        train neck and head on the features saved by build_feature_cache,
+        the backbone is frozen and not run during training
+        """
+        cache_config = self.config["FeatureCache"]
+        model = self._unwrap_model()
+        assert isinstance(model, RecModel), \
+            "FeatureCache is only supported by RecModel"
+        model.use_cached_features = True
+        for param in model.backbone.parameters():
+            param.trainable = False
+        config_loader = {
+            "Train": {
+                "dataset": {
+                    "name": "CachedFeatureDataset",
+                    "cache_dir": cache_config["cache_dir"],
+                },
+                "sampler": {
+                    "name": "DistributedBatchSampler",
+                    "batch_size": cache_config.get("batch_size", 1024),
+                    "shuffle": True,
+                    "drop_last": False,
+                },
+                "loader": {
+                    "num_workers": cache_config.get("num_workers", 0),
+                    "use_shared_memory": True,
+                },
+            }
+        }
+        logger.info("train neck and head on cached features in {}".format(
+            cache_config["cache_dir"]))
+        return build_dataloader(
+            config_loader, "Train", self.device, resumable=self._resumable())
+
+    def _eval_transform_ops(self):
+        """
+        transform_ops of DataLoader.Eval, of its Gallery in retrieval
+        """
+        eval_config = self.config["DataLoader"].get("Eval", None) or {}
+        for section in [eval_config, eval_config.get("Gallery", None) or {}]:
+            transform_ops = section.get("dataset", {}).get("transform_ops",
+                                                           None)
+            if transform_ops is not None:
+                return copy.deepcopy(transform_ops)
+        return None
+
+    @paddle.no_grad()
+    def build_feature_cache(self):
+        """
+        run the backbone once over the train set with the Eval transforms, or
+        FeatureCache.transform_ops, and save the features, which is used by
+        train() with FeatureCache
+        """
+        cache_config = self.config["FeatureCache"]
+        cache_dir = cache_config["cache_dir"]
+        dtype = cache_config.get("dtype", "float32")
+        print_batch_step = self.config["Global"]["print_batch_step"]
+        model = self._unwrap_model()
+        assert isinstance(model, RecModel), \
+            "FeatureCache is only supported by RecModel"
+        model.eval()
+
+        config_loader = copy.deepcopy(self.config["DataLoader"])
+        config_dataset = config_loader["Train"]["dataset"]
+        # the random Train transforms would freeze one random view of every
+        # image in the cache, so the deterministic Eval transforms are used
+        # unless FeatureCache.transform_ops is given
+        transform_ops = cache_config.get("transform_ops", None)
+        if transform_ops is None:
+            transform_ops = self._eval_transform_ops()
+        assert transform_ops is not None, \
+            "DataLoader.Eval has no transform_ops, please set " \
+            "FeatureCache.transform_ops"
+        config_dataset["transform_ops"] = transform_ops
+        config_dataset.pop("batch_transform_ops", None)
+        # only used to return the sample index, the transforms are not random
+        config_dataset["seeded_aug"] = {"aug_num": 1, "fixed_aug_seed": 0}
+        config_loader["Train"]["sampler"] = {
+            "name": "DistributedBatchSampler",
+            "batch_size": config_loader["Train"]["sampler"]["batch_size"],
+            "shuffle": False,
+            "drop_last": False,
+        }
+        dataloader = build_dataloader(config_loader, "Train", self.device)
+
+        meta = None
+        features = None
+        num_images = 0
+        tic = time.time()
+        for iter_id, batch in enumerate(dataloader()):
+            batch_feas = model.backbone(batch[0]).numpy()
+            if features is None:
+                meta = FeatureStore.build_meta(
+                    len(dataloader.dataset), batch_feas.shape[1:], dtype)
+                if paddle.distributed.get_rank() == 0:
+                    FeatureStore.create(cache_dir, meta)
+                if self.config["Global"]["distributed"]:
+                    dist.barrier()
+                features, labels = FeatureStore.open_writer(cache_dir)
+            sample_idx = batch[2].numpy().reshape([-1])
+            features[sample_idx] = batch_feas.astype(dtype)
+            labels[sample_idx] = batch[1].numpy().reshape([-1])
+            num_images += batch[0].shape[0]
+            if iter_id % print_batch_step == 0:
+                logger.info(
+                    "[FeatureCache][Iter: {}/{}] ips: {:.5f} images/sec".
+                    format(iter_id,
+                           len(dataloader), num_images / (time.time() - tic)))
+        features.flush()
+        labels.flush()
+        if self.config["Global"]["distributed"]:
+            dist.barrier()
+        if paddle.distributed.get_rank() == 0:
+            FeatureStore.finish(cache_dir, meta)
+            logger.info("backbone features are saved in {}".format(
+                cache_dir))
+
+    def _resolution_schedule(self):
+        schedule = self.config.get("ResolutionSchedule", None)
+        if not schedule:
+            return None
+        return sorted(schedule, key=lambda phase: phase["epoch"])
+
+    @staticmethod
+    def _resolution_phase(schedule, epoch_id):
+        phase_id = 0
+        for idx, phase in enumerate(schedule):
+            if epoch_id >= phase["epoch"]:
+                phase_id = idx
+        return phase_id
+
+    def _resumable(self):
+        """
+        the batch order is made a function of (seed, epoch) only when it is
+        needed, to save step checkpoints or to resume from one
+        """
+        global_config = self.config["Global"]
+        return global_config.get("save_step_interval", None) is not None or \
+            global_config.get("checkpoints", None) is not None
+
+    def _build_train_dataloader(self, schedule=None, phase_id=None):
+        if self.teacher_logits is not None:
+            config_loader = self._teacher_logits_dataloader_config()
+        else:
+            config_loader = self.config["DataLoader"]
+        if schedule is None:
+            return build_dataloader(
+                config_loader,
+                "Train",
+                self.device,
+                resumable=self._resumable())
+
+        # set the crop size and batch size of the phase on a copy
+        phase = schedule[phase_id]
+        config_loader = copy.deepcopy(config_loader)
+        resized = False
+        for op in config_loader["Train"]["dataset"].get("transform_ops", []):
+            if "RandCropImage" in op:
+                op["RandCropImage"]["size"] = phase["size"]
+                resized = True
+        assert resized, \
+            "ResolutionSchedule needs RandCropImage in DataLoader.Train"
+        if "batch_size" in phase:
+            config_loader["Train"]["sampler"]["batch_size"] = phase[
+                "batch_size"]
+        logger.info("[Train][Phase {}] size: {}, batch_size: {}".format(
+            phase_id, phase["size"], config_loader["Train"]["sampler"][
+                "batch_size"]))
+        return build_dataloader(
+            config_loader, "Train", self.device, resumable=self._resumable())
+
+    def _teacher_logits_dataloader_config(self, fixed_aug_seed=None):
+        """
+        train dataloader config whose samples carry (index, aug seed), so
+        that the stored teacher logits of the same view can be found
+        """
+        store_config = self.config["TeacherLogits"]
+        config_loader = copy.deepcopy(self.config["DataLoader"])
+        config_loader["Train"]["dataset"]["seeded_aug"] = {
+            "aug_num": store_config.get("aug_num", 1),
+            "seed": store_config.get("seed", 0),
+            "fixed_aug_seed": fixed_aug_seed,
+        }
+        return config_loader
+
+    def _init_teacher_logits(self):
+        store_config = self.config["TeacherLogits"]
+        self.teacher_logits = TeacherLogitsStore(store_config["store_dir"])
+        meta = self.teacher_logits.meta
+        assert meta["aug_num"] == store_config.get("aug_num", 1) and meta.get(
+            "seed", 0) == store_config.get("seed", 0), \
+            "aug_num and seed should be the same as those used to build {}".format(
+                store_config["store_dir"])
+        model = self._unwrap_model()
+        model.skip_model_names = [store_config.get("model_name", "Teacher")]
+
+    def _add_teacher_logits(self, out, batch):
+        store_config = self.config["TeacherLogits"]
+        logits = self.teacher_logits.lookup(batch[2], batch[3])
+        key = store_config.get("key", None)
+        out[store_config.get("model_name", "Teacher")] = logits \
+            if key is None else {key: logits}
+        return out
+
+    @paddle.no_grad()
+    def build_teacher_logits(self):
+        """
+        run the teacher once over every augmented view of the train set and
+        save its top-k outputs, so that distillation only runs the student
+        """
+        store_config = self.config["TeacherLogits"]
+        store_dir = store_config["store_dir"]
+        model_name = store_config.get("model_name", "Teacher")
+        key = store_config.get("key", None)
+        aug_num = store_config.get("aug_num", 1)
+        print_batch_step = self.config["Global"]["print_batch_step"]
+        model = self._unwrap_model()
+        teacher = model._sub_layers[model_name]
+        teacher.eval()
+
+        meta = None
+        writer = None
+        for aug_seed in range(aug_num):
+            config_loader = self._teacher_logits_dataloader_config(aug_seed)
+            config_sampler = config_loader["Train"]["sampler"]
+            config_loader["Train"]["sampler"] = {
+                "name": "DistributedBatchSampler",
+                "batch_size": config_sampler["batch_size"],
+                "shuffle": False,
+                "drop_last": False,
+            }
+            dataloader = build_dataloader(config_loader, "Train", self.device)
+            num_images = 0
+            tic = time.time()
+            for iter_id, batch in enumerate(dataloader()):
+                out = teacher(batch[0])
+                if key is not None:
+                    out = out[key]
+                if writer is None:
+                    # the class number is known after the first forward
+                    meta = TeacherLogitsStore.build_meta(
+                        num_samples=len(dataloader.dataset),
+                        aug_num=aug_num,
+                        topk=store_config.get("topk", 10),
+                        class_num=out.shape[-1],
+                        shard_size=store_config.get("shard_size", 100000))
+                    if paddle.distributed.get_rank() == 0:
+                        TeacherLogitsStore.create(store_dir, meta)
+                    if self.config["Global"]["distributed"]:
+                        dist.barrier()
+                    writer = TeacherLogitsWriter(store_dir, meta)
+                writer.write(batch[2].numpy(),
+                             batch[3].numpy(), out.numpy())
+                num_images += batch[0].shape[0]
+                if iter_id % print_batch_step == 0:
+                    logger.info(
+                        "[TeacherLogits][Aug {}/{}][Iter: {}/{}] ips: {:.5f} "
+                        "images/sec".format(aug_seed + 1, aug_num, iter_id,
+                                            len(dataloader), num_images / (
+                                                time.time() - tic)))
+            writer.flush()
+        if self.config["Global"]["distributed"]:
+            dist.barrier()
+        if paddle.distributed.get_rank() == 0:
+            meta["seed"] = store_config.get("seed", 0)
+            TeacherLogitsStore.finish(store_dir, meta)
+            logger.info("teacher logits are saved in {}".format(store_dir))
 
     def train(self):
         # build train loss and metric info
@@ -115,9 +409,26 @@ class Trainer(object):
                 if metric_config is not None:
                     self.train_metric_func = build_metrics(metric_config)
 
+        if "TeacherLogits" in self.config and self.teacher_logits is None:
+            self._init_teacher_logits()
+
+        if "FeatureCache" in self.config and self.train_dataloader is None:
+            self.train_dataloader = self._build_cached_feature_dataloader()
+
+        schedule = self._resolution_schedule()
+        phase_id = None
+        if schedule is not None:
+            if "FeatureCache" in self.config:
+                logger.warning(
+                    "ResolutionSchedule is ignored when FeatureCache is used")
+                schedule = None
+            else:
+                # steps of the first phase define the unit of lr schedule
+                phase_id = self._resolution_phase(schedule, 1)
+
         if self.train_dataloader is None:
-            self.train_dataloader = build_dataloader(self.config["DataLoader"],
-                                                     "Train", self.device)
+            self.train_dataloader = self._build_train_dataloader(schedule,
+                                                                 phase_id)
 
         step_each_epoch = len(self.train_dataloader)
 
@@ -144,18 +455,44 @@ class Trainer(object):
         }
         # global iter counter
         global_step = 0
+        save_step_interval = self.config["Global"].get("save_step_interval",
+                                                       None)
+        # number of batches already trained in the first epoch
+        resume_iter = 0
 
         if self.config["Global"]["checkpoints"] is not None:
-            metric_info = init_model(self.config["Global"], self.model,
-                                     optimizer)
+            metric_info = init_model(
+                self.config["Global"],
+                self.model,
+                optimizer,
+                loss=self.train_loss_func)
             if metric_info is not None:
+                step_state = metric_info.pop("step_state", None)
                 best_metric.update(metric_info)
+                if step_state is not None:
+                    global_step, resume_iter = self._load_step_state(
+                        step_state, lr_sch)
 
+        phase_info = {"epochs": 0, "images": 0, "cost": 0.}
         tic = time.time()
         for epoch_id in range(best_metric["epoch"] + 1,
                               self.config["Global"]["epochs"] + 1):
             acc = 0.0
-            for iter_id, batch in enumerate(self.train_dataloader()):
+            if schedule is not None:
+                cur_phase_id = self._resolution_phase(schedule, epoch_id)
+                if cur_phase_id != phase_id:
+                    self._log_phase_throughput(phase_id, phase_info)
+                    phase_id = cur_phase_id
+                    self.train_dataloader = self._build_train_dataloader(
+                        schedule, phase_id)
+                    tic = time.time()
+                phase_info["epochs"] += 1
+            batch_sampler = self.train_dataloader.batch_sampler
+            if isinstance(batch_sampler, ResumableBatchSampler):
+                batch_sampler.set_epoch(epoch_id)
+                batch_sampler.skip_batches(resume_iter)
+            for iter_id, batch in enumerate(
+                    self.train_dataloader(), start=resume_iter):
                 if iter_id == 5:
                     for key in time_info:
                         time_info[key].reset()
@@ -169,6 +506,8 @@ class Trainer(object):
                     out = self.model(batch[0])
                 else:
                     out = self.model(batch[0], batch[1])
+                if self.teacher_logits is not None:
+                    out = self._add_teacher_logits(out, batch)
 
                 # calc loss
                 loss_dict = self.train_loss_func(out, batch[1])
@@ -180,7 +519,7 @@ class Trainer(object):
                                             batch_size)
                 # calc metric
                 if self.train_metric_func is not None:
-                    metric_dict = self.train_metric_func(out, batch[-1])
+                    metric_dict = self.train_metric_func(out, batch[1])
                     for key in metric_dict:
                         if not key in output_info:
                             output_info[key] = AverageMeter(key, '7.5f')
@@ -189,11 +528,27 @@ class Trainer(object):
 
                 # step opt and lr
                 loss_dict["loss"].backward()
+                if self.sync_grads:
+                    allreduce_grads(self.model)
                 optimizer.step()
                 optimizer.clear_grad()
-                lr_sch.step()
+                if schedule is None:
+                    lr_sch.step()
+                else:
+                    # steps per epoch change with the batch size, keep the
+                    # lr schedule aligned with the progress of epochs
+                    lr_sch.step(
+                        int((epoch_id - 1 + (iter_id + 1) / len(
+                            self.train_dataloader)) * step_each_epoch))
 
                 time_info["batch_cost"].update(time.time() - tic)
+                phase_info["images"] += batch_size
+                phase_info["cost"] += time.time() - tic
+
+                if save_step_interval and global_step % save_step_interval == 0:
+                    self._save_step_checkpoint(optimizer, lr_sch,
+                                               best_metric["metric"], epoch_id,
+                                               iter_id + 1, global_step)
 
                 if iter_id % print_batch_step == 0:
                     lr_msg = "lr: {:.5f}".format(lr_sch.get_lr())
@@ -233,6 +588,7 @@ class Trainer(object):
                             writer=self.vdl_writer)
                 tic = time.time()
 
+            resume_iter = 0
             metric_msg = ", ".join([
                 "{}: {:.5f}".format(key, output_info[key].avg)
                 for key in output_info
@@ -255,7 +611,8 @@ class Trainer(object):
                         best_metric,
                         self.output_dir,
                         model_name=self.config["Arch"]["name"],
-                        prefix="best_model")
+                        prefix="best_model",
+                        loss=self.train_loss_func)
                 logger.info("[Eval][Epoch {}][best metric: {}]".format(
                     epoch_id, best_metric["metric"]))
                 logger.scaler(
@@ -274,7 +631,8 @@ class Trainer(object):
                                 "epoch": epoch_id},
                     self.output_dir,
                     model_name=self.config["Arch"]["name"],
-                    prefix="epoch_{}".format(epoch_id))
+                    prefix="epoch_{}".format(epoch_id),
+                    loss=self.train_loss_func)
                 # save the latest model
                 save_load.save_model(
                     self.model,
@@ -282,11 +640,71 @@ class Trainer(object):
                                 "epoch": epoch_id},
                     self.output_dir,
                     model_name=self.config["Arch"]["name"],
-                    prefix="latest")
+                    prefix="latest",
+                    loss=self.train_loss_func)
 
+        if schedule is not None:
+            self._log_phase_throughput(phase_id, phase_info)
         if self.vdl_writer is not None:
             self.vdl_writer.close()
 
+    def _save_step_checkpoint(self, optimizer, lr_sch, metric, epoch_id,
+                              iter_num, global_step):
+        """
+        save a checkpoint in the middle of an epoch, which is overwritten
+        every save_step_interval steps
+        """
+        if iter_num == len(self.train_dataloader):
+            epoch_id, iter_num = epoch_id + 1, 0
+        # paddle generators can not be saved, a seed is saved instead and
+        # they are reseeded only on resume, so the random stream of a run
+        # does not depend on save_step_interval
+        paddle_seed = int(np.random.RandomState(global_step).randint(2**31 -
+                                                                     1))
+        step_state = {
+            "iter_id": iter_num,
+            "global_step": global_step,
+            "shuffle_seed": getattr(self.train_dataloader.batch_sampler,
+                                    "seed", 0),
+            "lr_scheduler": lr_sch.state_dict(),
+            "python_rng": random.getstate(),
+            "numpy_rng": np.random.get_state(),
+            "paddle_seed": paddle_seed,
+        }
+        save_load.save_model(
+            self.model,
+            optimizer, {
+                "metric": metric,
+                "epoch": epoch_id - 1,
+                "step_state": step_state
+            },
+            self.output_dir,
+            model_name=self.config["Arch"]["name"],
+            prefix="latest_step",
+            loss=self.train_loss_func)
+
+    def _load_step_state(self, step_state, lr_sch):
+        lr_sch.set_state_dict(step_state["lr_scheduler"])
+        random.setstate(step_state["python_rng"])
+        np.random.set_state(step_state["numpy_rng"])
+        paddle.seed(step_state["paddle_seed"])
+        batch_sampler = self.train_dataloader.batch_sampler
+        if isinstance(batch_sampler, ResumableBatchSampler):
+            batch_sampler.seed = step_state["shuffle_seed"]
+        logger.info("resume from global step {}, skip {} batches".format(
+            step_state["global_step"], step_state["iter_id"]))
+        return step_state["global_step"], step_state["iter_id"]
+
+    def _log_phase_throughput(self, phase_id, phase_info):
+        if phase_info["epochs"] > 0 and phase_info["cost"] > 0:
+            logger.info(
+                "[Train][Phase {}] epochs: {}, images: {}, cost: {:.2f} s, "
+                "ips: {:.5f} images/sec".format(
+                    phase_id, phase_info["epochs"], phase_info["images"],
+                    phase_info["cost"],
+                    phase_info["images"] / phase_info["cost"]))
+        phase_info.update({"epochs": 0, "images": 0, "cost": 0.})
+
     def build_avg_metrics(self, info_dict):
         return {key: AverageMeter(key, '7.5f') for key in info_dict}
 
@@ -299,6 +717,8 @@ class Trainer(object):
                 loss_config = loss_config.get("Eval")
                 if loss_config is not None:
                     self.eval_loss_func = build_loss(loss_config)
+                    # the eval loss must not update states such as centers
+                    self.eval_loss_func.eval()
         if self.eval_mode == "classification":
             if self.eval_dataloader is None:
                 self.eval_dataloader = build_dataloader(
@@ -314,28 +734,34 @@ class Trainer(object):
             eval_result = self.eval_cls(epoch_id)
 
         elif self.eval_mode == "retrieval":
-            if self.gallery_dataloader is None:
-                self.gallery_dataloader = build_dataloader(
-                    self.config["DataLoader"]["Eval"], "Gallery", self.device)
-
-            if self.query_dataloader is None:
-                self.query_dataloader = build_dataloader(
-                    self.config["DataLoader"]["Eval"], "Query", self.device)
-            # build metric info
-            if self.eval_metric_func is None:
-                metric_config = self.config.get("Metric", None)
-                if metric_config is None:
-                    metric_config = [{"name": "Recallk", "topk": (1, 5)}]
-                else:
-                    metric_config = metric_config["Eval"]
-                self.eval_metric_func = build_metrics(metric_config)
-            eval_result = self.eval_retrieval(epoch_id)
+            self._init_retrieval_eval()
+            if self.config["Global"].get("retrieval_shard", False):
+                eval_result = self.eval_retrieval_sharded(epoch_id)
+            else:
+                eval_result = self.eval_retrieval(epoch_id)
         else:
             logger.warning("Invalid eval mode: {}".format(self.eval_mode))
             eval_result = None
         self.model.train()
         return eval_result
 
+    def _init_retrieval_eval(self):
+        if self.gallery_dataloader is None:
+            self.gallery_dataloader = build_dataloader(
+                self.config["DataLoader"]["Eval"], "Gallery", self.device)
+
+        if self.query_dataloader is None:
+            self.query_dataloader = build_dataloader(
+                self.config["DataLoader"]["Eval"], "Query", self.device)
+        # build metric info
+        if self.eval_metric_func is None:
+            metric_config = self.config.get("Metric", None)
+            if metric_config is None:
+                metric_config = [{"name": "Recallk", "topk": (1, 5)}]
+            else:
+                metric_config = metric_config["Eval"]
+            self.eval_metric_func = build_metrics(metric_config)
+
     @paddle.no_grad()
     def eval_cls(self, epoch_id=0):
         output_info = dict()
@@ -425,71 +851,214 @@ class Trainer(object):
 
     def eval_retrieval(self, epoch_id=0):
         self.model.eval()
-        cum_similarity_matrix = None
         # step1. build gallery
-        gallery_feas, gallery_img_id, gallery_unique_id = self._cal_feature(
-            name='gallery')
-        query_feas, query_img_id, query_query_id = self._cal_feature(
-            name='query')
+        gallery = self._cal_feature(name='gallery')
+        query = self._cal_feature(name='query')
 
         # step2. do evaluation
-        sim_block_size = self.config["Global"].get("sim_block_size", 64)
-        sections = [sim_block_size] * (len(query_feas) // sim_block_size)
-        if len(query_feas) % sim_block_size:
-            sections.append(len(query_feas) % sim_block_size)
-        fea_blocks = paddle.split(query_feas, num_or_sections=sections)
-        if query_query_id is not None:
-            query_id_blocks = paddle.split(
-                query_query_id, num_or_sections=sections)
-        image_id_blocks = paddle.split(query_img_id, num_or_sections=sections)
-        metric_key = None
+        metric_dict = self._retrieval_metrics(query, gallery)
+        metric_key = list(metric_dict.keys())[0]
+        metric_msg = ", ".join([
+            "{}: {:.5f}".format(key, metric_dict[key]) for key in metric_dict
+        ])
+        logger.info("[Eval][Epoch {}][Avg]{}".format(epoch_id, metric_msg))
+
+        return metric_dict[metric_key]
 
+    def _retrieval_metrics(self, query, gallery):
+        """
+        Args:
+            query(tuple): (features, image ids, unique ids) of the queries,
+                as returned by _cal_feature
+            gallery(tuple): (features, image ids, unique ids) of the gallery
+        Returns:
+            metric_dict(dict): metric name -> value averaged over the queries
+        """
+        query_feas, query_img_id, query_query_id = query
+        gallery_feas, gallery_img_id, gallery_unique_id = gallery
         if self.eval_metric_func is None:
-            metric_dict = {metric_key: 0.}
-        else:
-            metric_dict = dict()
-            for block_idx, block_fea in enumerate(fea_blocks):
-                similarity_matrix = paddle.matmul(
-                    block_fea, gallery_feas, transpose_y=True)
-                if query_query_id is not None:
-                    query_id_block = query_id_blocks[block_idx]
-                    query_id_mask = (query_id_block != gallery_unique_id.t())
-
-                    image_id_block = image_id_blocks[block_idx]
-                    image_id_mask = (image_id_block != gallery_img_id.t())
-
-                    keep_mask = paddle.logical_or(query_id_mask, image_id_mask)
-                    similarity_matrix = similarity_matrix * keep_mask.astype(
-                        "float32")
-                else:
-                    keep_mask = None
+            return {None: 0.}
 
-                metric_tmp = self.eval_metric_func(similarity_matrix,
-                                                   image_id_blocks[block_idx],
-                                                   gallery_img_id, keep_mask)
+        sim_block_size = self.config["Global"].get("sim_block_size", 64)
+        metric_dict = dict()
+        for start in range(0, len(query_feas), sim_block_size):
+            end = min(start + sim_block_size, len(query_feas))
+            similarity_matrix = gallery_feas.matmul(
+                query_feas.dequantize(start, end))
+            if query_query_id is not None:
+                query_id_mask = (
+                    query_query_id[start:end] != gallery_unique_id.t())
+                image_id_mask = (
+                    query_img_id[start:end] != gallery_img_id.t())
+                keep_mask = paddle.logical_or(query_id_mask, image_id_mask)
+                similarity_matrix = similarity_matrix * keep_mask.astype(
+                    "float32")
+            else:
+                keep_mask = None
+
+            metric_tmp = self.eval_metric_func(similarity_matrix,
+                                               query_img_id[start:end],
+                                               gallery_img_id, keep_mask)
+            for key in metric_tmp:
+                metric_dict[key] = metric_dict.get(key, 0.) + metric_tmp[
+                    key] * (end - start) / len(query_feas)
+        return metric_dict
+
+    def eval_retrieval_sharded(self, epoch_id=0):
+        """
+        every rank keeps its own gallery shard, only the query features are
+        gathered. The global rank of every relevant gallery sample is counted
+        across shards, so the metrics are exact without gathering the gallery.
+        """
+        self.model.eval()
+        gallery_feas, gallery_img_id, gallery_unique_id = self._cal_feature(
+            name='gallery', gather=False)
+        query_feas, query_img_id, query_query_id = self._cal_feature(
+            name='query')
 
-                for key in metric_tmp:
-                    if key not in metric_dict:
-                        metric_dict[key] = metric_tmp[key] * block_fea.shape[
-                            0] / len(query_feas)
-                    else:
-                        metric_dict[key] += metric_tmp[key] * block_fea.shape[
-                            0] / len(query_feas)
-
-        metric_info_list = []
-        for key in metric_dict:
-            if metric_key is None:
-                metric_key = key
-            metric_info_list.append("{}: {:.5f}".format(key, metric_dict[key]))
-        metric_msg = ", ".join(metric_info_list)
+        sim_block_size = self.config["Global"].get("sim_block_size", 64)
+        metric_dict = dict()
+        for start in range(0, len(query_feas), sim_block_size):
+            end = min(start + sim_block_size, len(query_feas))
+            similarity_matrix = gallery_feas.matmul(
+                query_feas.dequantize(start, end))
+            rel_mask = (query_img_id[start:end] == gallery_img_id.t())
+            if query_query_id is not None:
+                query_id_mask = (
+                    query_query_id[start:end] != gallery_unique_id.t())
+                image_id_mask = (
+                    query_img_id[start:end] != gallery_img_id.t())
+                keep_mask = paddle.logical_or(query_id_mask, image_id_mask)
+                similarity_matrix = similarity_matrix * keep_mask.astype(
+                    "float32")
+                rel_mask = paddle.logical_and(rel_mask, keep_mask)
+
+            ranks, num_rel = self._global_relevant_ranks(
+                similarity_matrix.numpy(), rel_mask.numpy())
+            metric_tmp = self.eval_metric_func.from_ranks(ranks, num_rel)
+            for key in metric_tmp:
+                metric_dict[key] = metric_dict.get(key, 0.) + metric_tmp[
+                    key] * (end - start) / len(query_feas)
+
+        metric_key = list(metric_dict.keys())[0]
+        metric_msg = ", ".join([
+            "{}: {:.5f}".format(key, metric_dict[key]) for key in metric_dict
+        ])
         logger.info("[Eval][Epoch {}][Avg]{}".format(epoch_id, metric_msg))
-
         return metric_dict[metric_key]
 
-    def _cal_feature(self, name='gallery'):
-        all_feas = None
-        all_image_id = None
-        all_unique_id = None
+    @paddle.no_grad()
+    def benchmark_feature_dtype(self):
+        """
+        evaluate retrieval with the features stored in every supported dtype,
+        and report the memory, the time and the metric deltas against float32
+        """
+        self.model.eval()
+        self._init_retrieval_eval()
+        gallery = self._cal_feature(name='gallery', dtype="float32")
+        query = self._cal_feature(name='query', dtype="float32")
+
+        results = dict()
+        for dtype in FEATURE_DTYPES:
+            gallery_feas = QuantizedFeatures.quantize(gallery[0].data, dtype)
+            query_feas = QuantizedFeatures.quantize(query[0].data, dtype)
+            tic = time.time()
+            metric_dict = self._retrieval_metrics(
+                (query_feas, ) + query[1:], (gallery_feas, ) + gallery[1:])
+            results[dtype] = (gallery_feas.nbytes, time.time() - tic,
+                              metric_dict)
+
+        base_nbytes, base_cost, base_metric = results["float32"]
+        for dtype in FEATURE_DTYPES:
+            nbytes, cost, metric_dict = results[dtype]
+            metric_msg = ", ".join([
+                "{}: {:.5f} ({:+.5f})".format(key, metric_dict[key],
+                                              metric_dict[key] -
+                                              base_metric[key])
+                for key in metric_dict
+            ])
+            logger.info(
+                "[FeatureDtype][{}] gallery memory: {:.2f} MB ({:.2f}x), "
+                "eval time: {:.3f}s ({:.2f}x), {}".format(
+                    dtype, nbytes / 1024. / 1024., base_nbytes / nbytes, cost,
+                    base_cost / max(cost, 1e-12), metric_msg))
+        return results
+
+    @staticmethod
+    def _global_relevant_ranks(similarity, rel_mask):
+        """
+        Args:
+            similarity(np.ndarray): [query_num, local_gallery_num]
+            rel_mask(np.ndarray): [query_num, local_gallery_num] whether the
+                local gallery sample is relevant to the query
+        Returns:
+            ranks(np.ndarray): [query_num, n] 1-based ranks in the whole
+                gallery of the relevant samples, strictly increasing and
+                padded with inf
+            num_rel(np.ndarray): [query_num] number of relevant samples
+        """
+        world_size = paddle.distributed.get_world_size()
+        query_num = similarity.shape[0]
+        local_num_rel = rel_mask.sum(axis=1)
+        max_num_rel = paddle.to_tensor(
+            np.array(
+                [max(int(local_num_rel.max()), 1)], dtype="int64"))
+        if world_size > 1:
+            paddle.distributed.all_reduce(
+                max_num_rel, op=paddle.distributed.ReduceOp.MAX)
+        max_num_rel = int(max_num_rel.numpy()[0])
+
+        # scores of the local relevant samples, padded with -inf
+        rel_scores = np.full(
+            [query_num, max_num_rel], -np.inf, dtype="float32")
+        for i in range(query_num):
+            scores = similarity[i][rel_mask[i]]
+            rel_scores[i, :len(scores)] = scores
+        if world_size > 1:
+            score_list = []
+            paddle.distributed.all_gather(score_list,
+                                          paddle.to_tensor(rel_scores))
+            rel_scores = np.concatenate(
+                [scores.numpy() for scores in score_list], axis=1)
+        valid = np.isfinite(rel_scores)
+
+        # number of samples in the local shard ranked before every relevant
+        # sample, summed over all shards
+        sorted_similarity = np.sort(similarity, axis=1)
+        num_greater = np.stack([
+            sorted_similarity.shape[1] - np.searchsorted(
+                sorted_similarity[i], rel_scores[i], side="right")
+            for i in range(query_num)
+        ]).astype("int64")
+        num_greater = paddle.to_tensor(num_greater)
+        if world_size > 1:
+            paddle.distributed.all_reduce(num_greater)
+        ranks = num_greater.numpy().astype("float32") + 1
+        ranks[~valid] = np.inf
+        ranks.sort(axis=1)
+        # relevant samples with tied scores get the same count above, place
+        # them one after another as a sort of the whole gallery would do
+        for j in range(1, ranks.shape[1]):
+            ranks[:, j] = np.maximum(ranks[:, j], ranks[:, j - 1] + 1)
+        return ranks, valid.sum(axis=1)
+
+    def _cal_feature(self, name='gallery', gather=True, dtype=None):
+        """
+        Args:
+            name(str): gallery or query
+            gather(bool): whether to gather the features of all ranks
+            dtype(str): storage dtype of the features, float32, float16 or
+                int8, default is Global.feature_dtype
+        Returns:
+            all_feas(QuantizedFeatures): features
+            all_image_id(paddle.Tensor): [num, 1] labels
+            all_unique_id(paddle.Tensor): [num, 1] unique ids or None
+        """
+        if dtype is None:
+            dtype = self.config["Global"].get("feature_dtype", "float32")
+        feas_list = []
+        image_id_list = []
+        unique_id_list = []
         if name == 'gallery':
             dataloader = self.gallery_dataloader
         elif name == 'query':
@@ -519,40 +1088,56 @@ class Trainer(object):
                                keepdim=True))
                 batch_feas = paddle.divide(batch_feas, feas_norm)
 
-            if all_feas is None:
-                all_feas = batch_feas
-                if has_unique_id:
-                    all_unique_id = batch[2]
-                all_image_id = batch[1]
-            else:
-                all_feas = paddle.concat([all_feas, batch_feas])
-                all_image_id = paddle.concat([all_image_id, batch[1]])
-                if has_unique_id:
-                    all_unique_id = paddle.concat([all_unique_id, batch[2]])
+            # quantize every batch, so that the float32 features of the whole
+            # dataset are never kept
+            feas_list.append(QuantizedFeatures.quantize(batch_feas, dtype))
+            image_id_list.append(batch[1])
+            if has_unique_id:
+                unique_id_list.append(batch[2])
+
+        all_feas = QuantizedFeatures.concat(feas_list)
+        all_image_id = paddle.concat(image_id_list)
+        all_unique_id = paddle.concat(
+            unique_id_list) if has_unique_id else None
 
-        if paddle.distributed.get_world_size() > 1:
-            feat_list = []
+        if gather and paddle.distributed.get_world_size() > 1:
+            data_list = []
+            scale_list = []
             img_id_list = []
             unique_id_list = []
-            paddle.distributed.all_gather(feat_list, all_feas)
+            paddle.distributed.all_gather(data_list, all_feas.data)
+            if all_feas.scale is not None:
+                paddle.distributed.all_gather(scale_list, all_feas.scale)
+            all_feas = QuantizedFeatures(
+                paddle.concat(
+                    data_list, axis=0),
+                paddle.concat(
+                    scale_list, axis=0) if scale_list else None)
             paddle.distributed.all_gather(img_id_list, all_image_id)
-            all_feas = paddle.concat(feat_list, axis=0)
             all_image_id = paddle.concat(img_id_list, axis=0)
             if has_unique_id:
                 paddle.distributed.all_gather(unique_id_list, all_unique_id)
                 all_unique_id = paddle.concat(unique_id_list, axis=0)
 
-        logger.info("Build {} done, all feat shape: {}, begin to eval..".
-                    format(name, all_feas.shape))
+        logger.info(
+            "Build {} done, all feat shape: {}, dtype: {}, size: {:.2f} MB, "
+            "begin to eval..".format(name, all_feas.shape, all_feas.dtype,
+                                     all_feas.nbytes / 1024. / 1024.))
         return all_feas, all_image_id, all_unique_id
 
     @paddle.no_grad()
     def infer(self, ):
+        if self.config["Infer"].get("save_dir", None) is not None:
+            return self.infer_offline()
         total_trainer = paddle.distributed.get_world_size()
         local_rank = paddle.distributed.get_rank()
-        image_list = get_image_list(self.config["Infer"]["infer_imgs"])
+        image_list = iter_image_list(
+            self.config["Infer"]["infer_imgs"],
+            recursive=self.config["Infer"].get("recursive", False),
+            sort=self.config["Infer"].get("sort", False))
         # data split
-        image_list = image_list[local_rank::total_trainer]
+        image_list = itertools.islice(image_list, local_rank, None,
+                                      total_trainer)
 
         preprocess_func = create_operators(self.config["Infer"]["transforms"])
         postprocess_func = build_postprocess(self.config["Infer"][
@@ -562,21 +1147,134 @@ class Trainer(object):
 
         self.model.eval()
 
+        def run_batch(batch_data, image_file_list):
+            batch_tensor = paddle.to_tensor(batch_data)
+            out = self.model(batch_tensor)
+            if isinstance(out, list):
+                out = out[0]
+            result = postprocess_func(out, image_file_list)
+            print(result)
+
         batch_data = []
         image_file_list = []
-        for idx, image_file in enumerate(image_list):
+        for image_file in image_list:
             with open(image_file, 'rb') as f:
                 x = f.read()
             for process in preprocess_func:
                 x = process(x)
             batch_data.append(x)
             image_file_list.append(image_file)
-            if len(batch_data) >= batch_size or idx == len(image_list) - 1:
-                batch_tensor = paddle.to_tensor(batch_data)
-                out = self.model(batch_tensor)
-                if isinstance(out, list):
-                    out = out[0]
-                result = postprocess_func(out, image_file_list)
-                print(result)
+            if len(batch_data) >= batch_size:
+                run_batch(batch_data, image_file_list)
                 batch_data.clear()
                 image_file_list.clear()
+        if len(batch_data) > 0:
+            run_batch(batch_data, image_file_list)
+
+    @paddle.no_grad()
+    def infer_offline(self):
+        """
+        bulk inference, images are read and preprocessed by dataloader
+        workers and the results are saved in shards of Infer.save_dir:
+            jsonl: part-{shard_id:05d}.jsonl, results of Infer.PostProcess
+            npy: part-{shard_id:05d}.npy, raw outputs of the model, and
+                part-{shard_id:05d}.txt, the image files of the outputs
+        Shards are assigned to ranks in turn, and a shard is written to a
+        temporary file first, so existing shards are skipped when the job is
+        restarted.
+        """
+        infer_config = self.config["Infer"]
+        save_dir = infer_config["save_dir"]
+        save_format = infer_config.get("save_format", "jsonl")
+        assert save_format in ["jsonl", "npy"], \
+            "save_format should be jsonl or npy, but got {}".format(
+                save_format)
+        shard_size = infer_config.get("shard_size", 100000)
+        batch_size = infer_config["batch_size"]
+        num_workers = infer_config.get("num_workers", 4)
+        output_key = infer_config.get("output_key", None)
+        total_trainer = paddle.distributed.get_world_size()
+        local_rank = paddle.distributed.get_rank()
+        os.makedirs(save_dir, exist_ok=True)
+
+        postprocess_func = None
+        if save_format == "jsonl":
+            postprocess_func = build_postprocess(infer_config["PostProcess"])
+        self.model.eval()
+
+        def iter_shards(image_iter):
+            for shard_id in itertools.count():
+                files = list(itertools.islice(image_iter, shard_size))
+                if len(files) == 0:
+                    return
+                yield shard_id, files
+
+        num_images = 0
+        tic = time.time()
+        # shards are cut from the sorted list, so that they are the same
+        # when the job is restarted
+        image_iter = iter_image_list(
+            infer_config["infer_imgs"],
+            recursive=infer_config.get("recursive", False),
+            sort=True)
+        for shard_id, files in iter_shards(image_iter):
+            if shard_id % total_trainer != local_rank:
+                continue
+            save_path = os.path.join(save_dir, "part-{:05d}.{}".format(
+                shard_id, save_format))
+            if os.path.exists(save_path):
+                logger.info("skip finished shard {}".format(save_path))
+                continue
+
+            dataset = InferDataset(files, infer_config["transforms"])
+            dataloader = paddle.io.DataLoader(
+                dataset,
+                places=self.device,
+                batch_size=batch_size,
+                shuffle=False,
+                drop_last=False,
+                num_workers=num_workers,
+                return_list=True,
+                collate_fn=infer_collate_fn)
+
+            tmp_path = save_path + ".tmp"
+            shard_outputs = []
+            shard_files = []
+            with open(tmp_path, "w") as fout:
+                for batch in dataloader():
+                    if batch[1].shape[0] == 0:
+                        continue
+                    batch_files = [files[i] for i in batch[1].numpy()]
+                    out = self.model(batch[0])
+                    if isinstance(out, list):
+                        out = out[0]
+                    if save_format == "jsonl":
+                        for result in postprocess_func(out, batch_files):
+                            fout.write(json.dumps(result) + "\n")
+                    else:
+                        if isinstance(out, dict):
+                            key = output_key or ("features" if "features" in
+                                                 out else "logits")
+                            out = out[key]
+                        shard_outputs.append(out.numpy())
+                        shard_files.extend(batch_files)
+                    num_images += len(batch_files)
+            if save_format == "npy":
+                with open(tmp_path, "wb") as fout:
+                    np.save(fout, np.concatenate(shard_outputs)
+                            if shard_outputs else np.zeros([0]))
+                with open(os.path.join(save_dir, "part-{:05d}.txt".format(
+                        shard_id)), "w") as fout:
+                    fout.write("\n".join(shard_files) + "\n")
+            os.replace(tmp_path, save_path)
+
+            cost = time.time() - tic
+            logger.info(
+                "[Infer][Rank {}] shard {} is saved in {}, {} images done, "
+                "ips: {:.5f} images/sec".format(local_rank, shard_id,
+                                                save_path, num_images,
+                                                num_images / cost))
+        logger.info("[Infer][Rank {}] {} images in {:.2f} s, ips: {:.5f} "
+                    "images/sec".format(local_rank, num_images,
+                                        time.time() - tic, num_images / max(
+                                            time.time() - tic, 1e-6)))
@@ -5,6 +5,7 @@ import paddle.nn as nn
 from ppcls.utils import logger
 
 from .celoss import CELoss
+from .partialfcloss import PartialFCLoss
 from .googlenetloss import GoogLeNetLoss
 from .centerloss import CenterLoss
 from .emlloss import EmlLoss
@@ -25,7 +26,9 @@ from .distillationloss import DistillationDMLLoss
 class CombinedLoss(nn.Layer):
     def __init__(self, config_list):
         super().__init__()
-        self.loss_func = []
+        # a LayerList, so that the states of the losses, such as the centers
+        # of CenterLoss, are in state_dict and follow train() and eval()
+        self.loss_func = nn.LayerList()
         self.loss_weight = []
         assert isinstance(config_list, list), (
             'operator config should be a list')
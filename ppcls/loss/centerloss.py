@@ -4,16 +4,35 @@ from __future__ import print_function
 import paddle
 import paddle.nn as nn
 import paddle.nn.functional as F
+import paddle.distributed as dist
 
 
 class CenterLoss(nn.Layer):
-    def __init__(self, num_classes=5013, feat_dim=2048):
+    """
+    squared distance between every feature and the center of its class
+    Args:
+        num_classes(int): number of classes
+        feat_dim(int): dimension of the features
+        alpha(float): if not None, the centers are updated after every
+            training step by the rule of the paper "A Discriminative Feature
+            Learning Approach for Deep Face Recognition":
+                c_j -= alpha * sum_{y_i = j}(c_j - f_i) / (1 + n_j)
+            otherwise the centers are fixed. The update is done by the
+            training loss only, the centers are saved with the checkpoints,
+            and in multi-card training every card applies the same update
+            from the features of all the cards
+    """
+
+    def __init__(self, num_classes=5013, feat_dim=2048, alpha=None):
         super(CenterLoss, self).__init__()
         self.num_classes = num_classes
         self.feat_dim = feat_dim
-        self.centers = paddle.randn(
-            shape=[self.num_classes, self.feat_dim]).astype(
-                "float64")  #random center
+        self.alpha = alpha
+        self.register_buffer(
+            "centers",
+            paddle.randn(shape=[self.num_classes, self.feat_dim]),
+            persistable=True)  #random center
+        self._centers_synced = False
 
     def __call__(self, input, target):
         """
@@ -21,34 +40,56 @@ class CenterLoss(nn.Layer):
         target: image label
         """
         feats = input["features"]
-        labels = target
+        labels = target.reshape([-1]).astype("int64")
         batch_size = feats.shape[0]
+        update = self.alpha is not None and self.training
+        if update and not self._centers_synced:
+            self._sync_centers()
 
-        #calc feat * feat   
-        dist1 = paddle.sum(paddle.square(feats), axis=1, keepdim=True)
-        dist1 = paddle.expand(dist1, [batch_size, self.num_classes])
-
-        #dist2 of centers
-        dist2 = paddle.sum(paddle.square(self.centers), axis=1,
-                           keepdim=True)  #num_classes
-        dist2 = paddle.expand(dist2,
-                              [self.num_classes, batch_size]).astype("float64")
-        dist2 = paddle.transpose(dist2, [1, 0])
-
-        #first x * x + y * y
-        distmat = paddle.add(dist1, dist2)
-        tmp = paddle.matmul(feats, paddle.transpose(self.centers, [1, 0]))
-        distmat = distmat - 2.0 * tmp
-
-        #generate the mask
-        classes = paddle.arange(self.num_classes).astype("int64")
-        labels = paddle.expand(
-            paddle.unsqueeze(labels, 1), (batch_size, self.num_classes))
-        mask = paddle.equal(
-            paddle.expand(classes, [batch_size, self.num_classes]),
-            labels).astype("float64")  #get mask
-
-        dist = paddle.multiply(distmat, mask)
-        loss = paddle.sum(paddle.clip(dist, min=1e-12, max=1e+12)) / batch_size
+        # only the center of its own class is needed for every feature
+        centers = paddle.gather(self.centers, labels).astype(feats.dtype)
+        distance = paddle.sum(paddle.square(feats - centers), axis=1)
+        loss = paddle.sum(paddle.clip(
+            distance, min=1e-12, max=1e+12)) / batch_size
 
+        if update:
+            self._update_centers(feats.detach(), labels)
         return {'CenterLoss': loss}
+
+    @paddle.no_grad()
+    def _sync_centers(self):
+        # the random centers differ between cards, unless loaded from a
+        # checkpoint saved by the first card
+        if dist.get_world_size() > 1:
+            dist.broadcast(self.centers, src=0)
+        self._centers_synced = True
+
+    @paddle.no_grad()
+    def _update_centers(self, feats, labels):
+        if dist.get_world_size() > 1:
+            # DistributedBatchSampler gives every card the same batch size
+            feats_list, labels_list = [], []
+            dist.all_gather(feats_list, feats)
+            dist.all_gather(labels_list, labels)
+            feats = paddle.concat(feats_list)
+            labels = paddle.concat(labels_list)
+        centers = paddle.gather(self.centers, labels).astype(feats.dtype)
+        classes, index = paddle.unique(labels, return_inverse=True)
+        num = classes.shape[0]
+        # scatter without overwrite sums the rows of the same class
+        diff = paddle.scatter(
+            paddle.zeros(
+                [num, self.feat_dim], dtype=feats.dtype),
+            index,
+            centers - feats,
+            overwrite=False)
+        count = paddle.scatter(
+            paddle.zeros(
+                [num], dtype=feats.dtype),
+            index,
+            paddle.ones(
+                [labels.shape[0]], dtype=feats.dtype),
+            overwrite=False)
+        new_centers = paddle.gather(self.centers, classes) - self.alpha * (
+            diff / (1. + count.unsqueeze(1))).astype(self.centers.dtype)
+        paddle.scatter_(self.centers, classes, new_centers)
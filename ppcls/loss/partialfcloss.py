@@ -0,0 +1,65 @@
+# copyright (c) 2021 PaddlePaddle Authors. All Rights Reserve.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import paddle
+import paddle.nn as nn
+import paddle.distributed as dist
+
+
+class PartialFCLoss(nn.Layer):
+    """
+    softmax cross entropy over the class centers sampled by the Partial-FC
+    heads of all ranks. Every rank holds the logits of the global batch
+    against its own centers, the max, the sum of exp and the label logit are
+    reduced over ranks, so the loss is the same as a softmax over all the
+    sampled centers, and it is the same on every rank.
+    """
+
+    def __init__(self):
+        super().__init__()
+
+    def forward(self, x, label=None):
+        # the labels of the batch are replaced by their sampled columns
+        logits = x["logits"]
+        label = x["partial_fc_label"]
+        world_size = dist.get_world_size()
+
+        logits_max = paddle.max(logits.detach(), axis=1, keepdim=True)
+        if world_size > 1:
+            dist.all_reduce(logits_max, op=dist.ReduceOp.MAX)
+        logits = logits - logits_max
+
+        # the reduced values carry no gradient, the local terms are added
+        # back with their gradient so that the gradient of every rank is the
+        # one of the global softmax over its own logits
+        local_sum = paddle.sum(paddle.exp(logits), axis=1)
+        global_sum = local_sum.detach()
+        is_local = (label >= 0).astype(logits.dtype)
+        local_target = paddle.take_along_axis(
+            logits,
+            paddle.where(label >= 0, label, paddle.zeros_like(label))
+            .unsqueeze(1),
+            axis=1).squeeze(1) * is_local
+        global_target = local_target.detach()
+        if world_size > 1:
+            global_sum = global_sum.clone()
+            global_target = global_target.clone()
+            dist.all_reduce(global_sum)
+            dist.all_reduce(global_target)
+
+        log_sum = paddle.log(global_sum) + (
+            local_sum - local_sum.detach()) / global_sum
+        target = global_target + (local_target - local_target.detach())
+        loss = paddle.mean(log_sum - target)
+        return {"PartialFCLoss": loss}
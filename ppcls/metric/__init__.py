@@ -42,6 +42,19 @@ class CombinedMetrics(nn.Layer):
             metric_dict.update(metric_func(*args, **kwargs))
         return metric_dict
 
+    def from_ranks(self, ranks, num_rel):
+        """
+        compute retrieval metrics from the global ranks of relevant samples,
+        used when the gallery is sharded across ranks
+        """
+        metric_dict = OrderedDict()
+        for metric_func in self.metric_func_list:
+            assert hasattr(metric_func, "from_ranks"), \
+                "{} does not support sharded retrieval eval".format(
+                    metric_func.__class__.__name__)
+            metric_dict.update(metric_func.from_ranks(ranks, num_rel))
+        return metric_dict
+
 def build_metrics(config):
     metrics_list = CombinedMetrics(copy.deepcopy(config))
     return metrics_list
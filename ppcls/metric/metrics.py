@@ -79,6 +79,20 @@ class mAP(nn.Layer):
         metric_dict["mAP"] = paddle.mean(ap).numpy()[0]
         return metric_dict
 
+    def from_ranks(self, ranks, num_rel):
+        """
+        Args:
+            ranks(np.ndarray): [query_num, n] 1-based ranks of the relevant
+                gallery samples in ascending order, padded with inf
+            num_rel(np.ndarray): [query_num] number of relevant samples
+        """
+        has_rel = num_rel > 0
+        ranks = ranks[has_rel]
+        order = np.arange(1, ranks.shape[1] + 1, dtype="float32")
+        precision = np.where(np.isfinite(ranks), order / ranks, 0.)
+        ap = precision.sum(axis=1) / num_rel[has_rel]
+        return {"mAP": np.float32(ap.mean() if len(ap) > 0 else 0.)}
+
 
 class mINP(nn.Layer):
     def __init__(self):
@@ -116,12 +130,28 @@ class mINP(nn.Layer):
         div = paddle.arange(equal_flag.shape[1]).astype("float32") + 2
         minus = paddle.divide(equal_flag, div)
         auxilary = paddle.subtract(equal_flag, minus)
-        hard_index = paddle.argmax(auxilary, axis=1).astype("float32")
+        # 1-based rank of the hardest relevant sample, as in from_ranks
+        hard_index = paddle.argmax(auxilary, axis=1).astype("float32") + 1
         all_INP = paddle.divide(paddle.sum(equal_flag, axis=1), hard_index)
         mINP = paddle.mean(all_INP)
         metric_dict["mINP"] = mINP.numpy()[0]
         return metric_dict
 
+    def from_ranks(self, ranks, num_rel):
+        """
+        Args:
+            ranks(np.ndarray): [query_num, n] 1-based ranks of the relevant
+                gallery samples in ascending order, padded with inf
+            num_rel(np.ndarray): [query_num] number of relevant samples
+        """
+        has_rel = num_rel > 0
+        ranks = ranks[has_rel]
+        hardest = np.where(np.isfinite(ranks), ranks, 0.).max(axis=1)
+        all_INP = num_rel[has_rel] / hardest
+        return {
+            "mINP": np.float32(all_INP.mean() if len(all_INP) > 0 else 0.)
+        }
+
 
 class Recallk(nn.Layer):
     def __init__(self, topk=(1, 5)):
@@ -167,6 +197,15 @@ class Recallk(nn.Layer):
             metric_dict["recall{}".format(k)] = all_cmc[k - 1]
         return metric_dict
 
+    def from_ranks(self, ranks, num_rel):
+        real_query_num = max(int((num_rel > 0).sum()), 1)
+        first_rank = ranks[:, 0]
+        metric_dict = dict()
+        for k in self.topk:
+            metric_dict["recall{}".format(k)] = np.float32(
+                (first_rank <= k).sum() / real_query_num)
+        return metric_dict
+
 
 class DistillationTopkAcc(TopkAcc):
     def __init__(self, model_key, feature_key=None, topk=(1, 5)):
@@ -0,0 +1,126 @@
+# copyright (c) 2021 PaddlePaddle Authors. All Rights Reserve.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import paddle
+
+__all__ = ['QuantizedFeatures', 'FEATURE_DTYPES']
+
+FEATURE_DTYPES = ["float32", "float16", "int8"]
+
+
+class QuantizedFeatures(object):
+    """
+    Features stored in reduced precision. float16 keeps the features as they
+    are, int8 uses symmetric quantization with one scale per vector. The
+    similarity is computed block by block in float32, so only one block of
+    the features is dequantized at a time.
+    Args:
+        data(paddle.Tensor): [num, dim] features in float32, float16 or int8
+        scale(paddle.Tensor): [num, 1] float32 scale of every vector, only
+            used by int8
+    """
+
+    def __init__(self, data, scale=None):
+        self.data = data
+        self.scale = scale
+        self.dtype = _dtype_name(data.dtype)
+        assert self.dtype in FEATURE_DTYPES, \
+            "unsupported feature dtype: {}".format(data.dtype)
+        assert (self.dtype == "int8") == (scale is not None), \
+            "scale is required by int8 features only"
+
+    def __len__(self):
+        return self.data.shape[0]
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+    @property
+    def nbytes(self):
+        """
+        size of the stored features in bytes
+        """
+        item_size = {"float32": 4, "float16": 2, "int8": 1}[self.dtype]
+        nbytes = self.data.shape[0] * self.data.shape[1] * item_size
+        if self.scale is not None:
+            nbytes += self.scale.shape[0] * 4
+        return nbytes
+
+    @classmethod
+    def quantize(cls, feas, dtype="float32"):
+        """
+        Args:
+            feas(paddle.Tensor): [num, dim] float32 features
+            dtype(str): float32, float16 or int8
+        """
+        assert dtype in FEATURE_DTYPES, \
+            "feature_dtype should be one of {}, but got {}".format(
+                FEATURE_DTYPES, dtype)
+        if dtype == "int8":
+            scale = paddle.max(paddle.abs(feas), axis=1, keepdim=True) / 127.
+            scale = paddle.clip(scale, min=1e-12)
+            data = paddle.clip(paddle.round(feas / scale), -127., 127.)
+            return cls(data.astype("int8"), scale)
+        return cls(feas.astype(dtype))
+
+    @classmethod
+    def concat(cls, feas_list):
+        if len(feas_list) == 1:
+            return feas_list[0]
+        data = paddle.concat([feas.data for feas in feas_list])
+        scale = None
+        if feas_list[0].scale is not None:
+            scale = paddle.concat([feas.scale for feas in feas_list])
+        return cls(data, scale)
+
+    def dequantize(self, start=0, end=None):
+        """
+        Returns:
+            feas(paddle.Tensor): [end - start, dim] float32 features
+        """
+        end = len(self) if end is None else end
+        data = self.data[start:end]
+        if self.dtype == "float32":
+            return data
+        data = data.astype("float32")
+        if self.scale is not None:
+            data = data * self.scale[start:end]
+        return data
+
+    def matmul(self, query, block_size=65536):
+        """
+        inner product between the query and all the features
+        Args:
+            query(paddle.Tensor): [query_num, dim] float32 features
+            block_size(int): number of features dequantized at a time
+        Returns:
+            similarity(paddle.Tensor): [query_num, num] float32
+        """
+        if self.dtype == "float32":
+            return paddle.matmul(query, self.data, transpose_y=True)
+        similarity = [
+            paddle.matmul(
+                query,
+                self.dequantize(start, start + block_size),
+                transpose_y=True)
+            for start in range(0, len(self), block_size)
+        ]
+        return paddle.concat(similarity, axis=1)
+
+
+def _dtype_name(dtype):
+    # paddle dtypes are printed as "paddle.float32" or "VarType.FP32"
+    name = str(dtype).split(".")[-1].lower()
+    return {"fp32": "float32", "fp16": "float16"}.get(name, name)
@@ -0,0 +1,98 @@
+# copyright (c) 2021 PaddlePaddle Authors. All Rights Reserve.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import json
+
+import numpy as np
+
+from ppcls.utils import logger
+
+__all__ = ['FeatureStore']
+
+
+class FeatureStore(object):
+    """
+    Memory-mapped store of backbone features and labels of a dataset.
+
+    Layout of store_dir:
+        meta.json       sizes of the store, written last
+        features.npy    [num_samples] + feature_shape
+        labels.npy      int64 [num_samples]
+    """
+
+    def __init__(self, store_dir):
+        meta_path = os.path.join(store_dir, "meta.json")
+        assert os.path.exists(meta_path), (
+            "feature cache is not found or incomplete in {}".format(store_dir))
+        with open(meta_path, "r") as f:
+            self.meta = json.load(f)
+        self.store_dir = store_dir
+        self.features = np.load(
+            os.path.join(store_dir, "features.npy"), mmap_mode="r")
+        self.labels = np.load(
+            os.path.join(store_dir, "labels.npy"), mmap_mode="r")
+        logger.info("load feature cache from {}: {}".format(store_dir,
+                                                            self.meta))
+
+    def __len__(self):
+        return self.meta["num_samples"]
+
+    @staticmethod
+    def build_meta(num_samples, feature_shape, dtype="float32"):
+        assert dtype in ["float32", "float16"]
+        return {
+            "num_samples": num_samples,
+            "feature_shape": list(feature_shape),
+            "dtype": dtype,
+        }
+
+    @staticmethod
+    def create(store_dir, meta):
+        """
+        allocate an empty store, call it on one process only
+        """
+        os.makedirs(store_dir, exist_ok=True)
+        meta_path = os.path.join(store_dir, "meta.json")
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+        np.lib.format.open_memmap(
+            os.path.join(store_dir, "features.npy"),
+            mode="w+",
+            dtype=meta["dtype"],
+            shape=tuple([meta["num_samples"]] + meta["feature_shape"])).flush()
+        np.lib.format.open_memmap(
+            os.path.join(store_dir, "labels.npy"),
+            mode="w+",
+            dtype=np.int64,
+            shape=(meta["num_samples"], )).flush()
+
+    @staticmethod
+    def open_writer(store_dir):
+        """
+        Returns:
+            features(np.memmap), labels(np.memmap): writable arrays, different
+                processes can write disjoint samples at the same time
+        """
+        return (np.load(
+            os.path.join(store_dir, "features.npy"), mmap_mode="r+"), np.load(
+                os.path.join(store_dir, "labels.npy"), mmap_mode="r+"))
+
+    @staticmethod
+    def finish(store_dir, meta):
+        """
+        mark the store as complete after all writers are done
+        """
+        with open(os.path.join(store_dir, "meta.json"), "w") as f:
+            json.dump(meta, f)
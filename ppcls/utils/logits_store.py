@@ -0,0 +1,181 @@
+# copyright (c) 2021 PaddlePaddle Authors. All Rights Reserve.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import json
+
+import numpy as np
+import paddle
+
+from ppcls.utils import logger
+
+__all__ = ['TeacherLogitsStore', 'TeacherLogitsWriter']
+
+
+class TeacherLogitsStore(object):
+    """
+    Sharded and memory-mapped store of teacher outputs. For every sample index
+    and augmentation seed, the top-k log-probabilities of the teacher are kept
+    in float16 together with their class ids.
+
+    Layout of store_dir:
+        meta.json                       sizes of the store, written last
+        shard_{i:05d}_values.npy        float16 [n, aug_num, topk]
+        shard_{i:05d}_indices.npy       int32 [n, aug_num, topk]
+    """
+
+    def __init__(self, store_dir):
+        meta_path = os.path.join(store_dir, "meta.json")
+        assert os.path.exists(meta_path), (
+            "teacher logits store is not found or incomplete in {}".format(
+                store_dir))
+        with open(meta_path, "r") as f:
+            self.meta = json.load(f)
+        self.store_dir = store_dir
+        self.num_samples = self.meta["num_samples"]
+        self.aug_num = self.meta["aug_num"]
+        self.topk = self.meta["topk"]
+        self.class_num = self.meta["class_num"]
+        self.shard_size = self.meta["shard_size"]
+        self.values = []
+        self.indices = []
+        for shard_id in range(self.meta["shard_num"]):
+            values_path, indices_path = _shard_paths(store_dir, shard_id)
+            self.values.append(np.load(values_path, mmap_mode="r"))
+            self.indices.append(np.load(indices_path, mmap_mode="r"))
+        logger.info("load teacher logits store from {}: {}".format(
+            store_dir, self.meta))
+
+    def lookup(self, sample_idx, aug_seed):
+        """
+        rebuild dense log-probabilities of the teacher, the probability mass
+        left out of the top-k is spread evenly over the other classes so that
+        softmax of the result gives back the stored probabilities
+        Args:
+            sample_idx(paddle.Tensor|np.ndarray): [batch] index of samples
+            aug_seed(paddle.Tensor|np.ndarray): [batch] augmentation seeds
+        Returns:
+            log_probs(paddle.Tensor): [batch, class_num] float32
+        """
+        if isinstance(sample_idx, paddle.Tensor):
+            sample_idx = sample_idx.numpy()
+        if isinstance(aug_seed, paddle.Tensor):
+            aug_seed = aug_seed.numpy()
+        sample_idx = np.asarray(sample_idx).reshape([-1])
+        aug_seed = np.asarray(aug_seed).reshape([-1])
+        values = np.empty([len(sample_idx), self.topk], dtype=np.float32)
+        indices = np.empty([len(sample_idx), self.topk], dtype=np.int64)
+        for i, (idx, seed) in enumerate(zip(sample_idx, aug_seed)):
+            shard_id, offset = divmod(int(idx), self.shard_size)
+            values[i] = self.values[shard_id][offset, int(seed) % self.aug_num]
+            indices[i] = self.indices[shard_id][offset,
+                                                int(seed) % self.aug_num]
+
+        rest_num = max(self.class_num - self.topk, 1)
+        rest_mass = np.clip(1.0 - np.exp(values).sum(axis=1, keepdims=True),
+                            1e-12, 1.0)
+        dense = np.repeat(
+            np.log(rest_mass / rest_num), self.class_num,
+            axis=1).astype(np.float32)
+        np.put_along_axis(dense, indices, values, axis=1)
+        return paddle.to_tensor(dense)
+
+    @staticmethod
+    def build_meta(num_samples, aug_num, topk, class_num, shard_size=100000):
+        assert 0 < topk <= class_num, \
+            "topk({}) should be in (0, class_num({})]".format(topk, class_num)
+        return {
+            "num_samples": num_samples,
+            "aug_num": aug_num,
+            "topk": topk,
+            "class_num": class_num,
+            "shard_size": shard_size,
+            "shard_num": (num_samples + shard_size - 1) // shard_size,
+        }
+
+    @staticmethod
+    def create(store_dir, meta):
+        """
+        allocate an empty store, call it on one process only
+        """
+        os.makedirs(store_dir, exist_ok=True)
+        meta_path = os.path.join(store_dir, "meta.json")
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+        for shard_id in range(meta["shard_num"]):
+            n = min(meta["shard_size"],
+                    meta["num_samples"] - shard_id * meta["shard_size"])
+            shape = (n, meta["aug_num"], meta["topk"])
+            values_path, indices_path = _shard_paths(store_dir, shard_id)
+            np.lib.format.open_memmap(
+                values_path, mode="w+", dtype=np.float16,
+                shape=shape).flush()
+            np.lib.format.open_memmap(
+                indices_path, mode="w+", dtype=np.int32, shape=shape).flush()
+
+    @staticmethod
+    def finish(store_dir, meta):
+        """
+        mark the store as complete after all writers are done
+        """
+        with open(os.path.join(store_dir, "meta.json"), "w") as f:
+            json.dump(meta, f)
+
+
+class TeacherLogitsWriter(object):
+    """
+    write teacher outputs into the shards allocated by
+    TeacherLogitsStore.create, different processes can write
+    disjoint samples at the same time
+    """
+
+    def __init__(self, store_dir, meta):
+        self.meta = meta
+        self.values = []
+        self.indices = []
+        for shard_id in range(meta["shard_num"]):
+            values_path, indices_path = _shard_paths(store_dir, shard_id)
+            self.values.append(np.load(values_path, mmap_mode="r+"))
+            self.indices.append(np.load(indices_path, mmap_mode="r+"))
+
+    def write(self, sample_idx, aug_seed, logits):
+        """
+        Args:
+            sample_idx(np.ndarray): [batch] index of samples in dataset
+            aug_seed(np.ndarray): [batch] augmentation seed of samples
+            logits(np.ndarray): [batch, class_num] teacher logits
+        """
+        topk = self.meta["topk"]
+        logits = logits.astype(np.float32)
+        logits = logits - logits.max(axis=1, keepdims=True)
+        log_probs = logits - np.log(
+            np.exp(logits).sum(axis=1, keepdims=True))
+        top_indices = np.argpartition(-log_probs, topk - 1, axis=1)[:, :topk]
+        top_values = np.take_along_axis(log_probs, top_indices, axis=1)
+        shard_size = self.meta["shard_size"]
+        for i, (idx, seed) in enumerate(zip(sample_idx, aug_seed)):
+            shard_id, offset = divmod(int(idx), shard_size)
+            self.values[shard_id][offset, int(seed)] = top_values[i]
+            self.indices[shard_id][offset, int(seed)] = top_indices[i]
+
+    def flush(self):
+        for values, indices in zip(self.values, self.indices):
+            values.flush()
+            indices.flush()
+
+
+def _shard_paths(store_dir, shard_id):
+    return (os.path.join(store_dir, "shard_{:05d}_values.npy".format(shard_id)),
+            os.path.join(store_dir,
+                         "shard_{:05d}_indices.npy".format(shard_id)))
@@ -85,9 +85,10 @@ def load_distillation_model(model, pretrained_model):
             pretrained_model))
 
 
-def init_model(config, net, optimizer=None):
+def init_model(config, net, optimizer=None, loss=None):
     """
-    load model from checkpoint or pretrained_model
+    load model from checkpoint or pretrained_model, the states of the loss,
+    such as the centers of CenterLoss, are loaded from the checkpoint too
     """
     checkpoints = config.get('checkpoints')
     if checkpoints and optimizer is not None:
@@ -99,7 +100,15 @@ def init_model(config, net, optimizer=None):
         opti_dict = paddle.load(checkpoints + ".pdopt")
         metric_dict = paddle.load(checkpoints + ".pdstates")
         net.set_dict(para_dict)
+        rank_prefix = "{}.rank{}".format(checkpoints,
+                                         paddle.distributed.get_rank())
+        if os.path.exists(rank_prefix + ".pdparams"):
+            # the shard of the sharded parameters kept by this rank
+            net.set_dict(paddle.load(rank_prefix + ".pdparams"))
+            opti_dict = paddle.load(rank_prefix + ".pdopt")
         optimizer.set_state_dict(opti_dict)
+        if loss is not None and os.path.exists(checkpoints + ".pdloss"):
+            loss.set_state_dict(paddle.load(checkpoints + ".pdloss"))
         logger.info("Finish load checkpoints from {}".format(checkpoints))
         return metric_dict
 
@@ -120,17 +129,35 @@ def save_model(net,
                metric_info,
                model_path,
                model_name="",
-               prefix='ppcls'):
+               prefix='ppcls',
+               loss=None):
     """
-    save model to the target path
+    save model to the target path, the parameters sharded over ranks, such
+    as the class centers of Partial-FC heads, are saved by every rank to
+    {prefix}.rank{rank}.pdparams together with its optimizer states. The
+    states of the loss, such as the centers of CenterLoss, are saved to
+    {prefix}.pdloss
     """
-    if paddle.distributed.get_rank() != 0:
+    rank = paddle.distributed.get_rank()
+    sharded_state_dict = {
+        key: value
+        for key, value in net.state_dict().items()
+        if getattr(value, "is_distributed", False)
+    }
+    if rank != 0 and len(sharded_state_dict) == 0:
         return
     model_path = os.path.join(model_path, model_name)
     _mkdir_if_not_exist(model_path)
     model_path = os.path.join(model_path, prefix)
 
+    if rank != 0:
+        rank_path = "{}.rank{}".format(model_path, rank)
+        paddle.save(sharded_state_dict, rank_path + ".pdparams")
+        paddle.save(optimizer.state_dict(), rank_path + ".pdopt")
+        return
     paddle.save(net.state_dict(), model_path + ".pdparams")
     paddle.save(optimizer.state_dict(), model_path + ".pdopt")
     paddle.save(metric_info, model_path + ".pdstates")
+    if loss is not None and len(loss.state_dict()) > 0:
+        paddle.save(loss.state_dict(), model_path + ".pdloss")
     logger.info("Already save model in {}".format(model_path))
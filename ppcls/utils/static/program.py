@@ -94,7 +94,7 @@ def create_model(architecture, image, classes_num, config, is_train):
         params["input_image_channel"] = input_image_channel
     if "is_test" in params:
         params['is_test'] = not is_train
-    model = backbone.__dict__[name](class_dim=classes_num, **params)
+    model = backbone.get_backbone(name)(class_dim=classes_num, **params)
 
     out = model(image)
     return out
@@ -0,0 +1,127 @@
+# Copyright (c) 2021 PaddlePaddle Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import os
+import sys
+import unittest
+
+import numpy as np
+
+# a module level __dir__ would replace dir() of the module, which unittest
+# uses to collect the tests
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+
+import paddle
+import paddle.nn as nn
+import paddle.distributed as dist
+
+from ppcls.arch.gears import PartialFCArcMargin
+from ppcls.arch.gears.partial_fc import has_sharded_params
+from ppcls.arch.gears.partial_fc import sync_params_buffers, allreduce_grads
+from ppcls.loss import PartialFCLoss
+
+NPROCS = 2
+BATCH_SIZE = 4
+EMBEDDING_SIZE = 8
+CLASS_NUM = 20
+
+
+class _Model(nn.Layer):
+    def __init__(self):
+        super().__init__()
+        self.backbone = nn.Linear(EMBEDDING_SIZE, EMBEDDING_SIZE)
+        self.head = PartialFCArcMargin(EMBEDDING_SIZE, CLASS_NUM)
+
+    def forward(self, x, label):
+        return self.head(self.backbone(x), label)
+
+
+def _build_model(rank):
+    # the backbone starts different on every rank and is synced from rank 0,
+    # the head shards are not
+    rng = np.random.RandomState(0)
+    model = _Model()
+    model.backbone.weight.set_value(
+        rng.randn(EMBEDDING_SIZE, EMBEDDING_SIZE).astype("float32") + rank)
+    model.backbone.bias.set_value(
+        rng.randn(EMBEDDING_SIZE).astype("float32") + rank)
+    weight = rng.randn(EMBEDDING_SIZE, CLASS_NUM).astype("float32")
+    start, end = model.head.class_start, model.head.class_end
+    model.head.weight.set_value(weight[:, start:end])
+    return model
+
+
+def _backward(model, rank):
+    rng = np.random.RandomState(1)
+    feats = rng.randn(BATCH_SIZE * NPROCS, EMBEDDING_SIZE).astype("float32")
+    labels = rng.randint(
+        0, CLASS_NUM, size=[BATCH_SIZE * NPROCS, 1]).astype("int64")
+    local = slice(rank * BATCH_SIZE, (rank + 1) * BATCH_SIZE)
+    out = model(
+        paddle.to_tensor(feats[local]), paddle.to_tensor(labels[local]))
+    PartialFCLoss()(out)["PartialFCLoss"].backward()
+
+
+def _worker():
+    paddle.set_device("cpu")
+    dist.init_parallel_env()
+    rank = dist.get_rank()
+
+    # the gradients of every rank without any gradient synchronization
+    plain = _build_model(rank)
+    sync_params_buffers(plain)
+    _backward(plain, rank)
+
+    model = _build_model(rank)
+    assert has_sharded_params(model)
+    sync_params_buffers(model)
+    # the backbone is the one of rank 0, the shard of the rank is kept
+    np.testing.assert_allclose(model.backbone.weight.numpy(),
+                               _build_model(0).backbone.weight.numpy())
+    np.testing.assert_allclose(model.head.weight.numpy(),
+                               _build_model(rank).head.weight.numpy())
+    _backward(model, rank)
+    allreduce_grads(model)
+
+    # the shard of the rank keeps its own gradient
+    np.testing.assert_allclose(
+        model.head.weight.grad.numpy(),
+        plain.head.weight.grad.numpy(),
+        rtol=1e-5,
+        atol=1e-7)
+    shard_grads = []
+    dist.all_gather(shard_grads, paddle.to_tensor(plain.head.weight.grad))
+    assert not np.allclose(shard_grads[0].numpy(), shard_grads[1].numpy())
+
+    # the gradients of the backbone are still averaged over ranks
+    backbone_grad = paddle.to_tensor(plain.backbone.weight.grad)
+    dist.all_reduce(backbone_grad)
+    np.testing.assert_allclose(
+        model.backbone.weight.grad.numpy(),
+        backbone_grad.numpy() / NPROCS,
+        rtol=1e-5,
+        atol=1e-7)
+
+
+class TestPartialFC(unittest.TestCase):
+    def test_sync_keeps_shard_gradients(self):
+        """
+        the gradients of the is_distributed class centers must not be
+        allreduced, every rank owns different centers
+        """
+        dist.spawn(_worker, nprocs=NPROCS, backend="gloo")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,107 @@
+# Copyright (c) 2021 PaddlePaddle Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import os
+import sys
+import unittest
+
+import numpy as np
+
+# a module level __dir__ would replace dir() of the module, which unittest
+# uses to collect the tests
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+
+import paddle
+import paddle.nn as nn
+
+from ppcls.engine.trainer import Trainer
+from ppcls.metric import build_metrics
+from ppcls.utils import logger
+from ppcls.utils.feature_quant import QuantizedFeatures
+
+GALLERY_NUM = 40
+QUERY_NUM = 12
+EMBEDDING_SIZE = 8
+CLASS_NUM = 5
+METRICS = [{
+    "Recallk": {
+        "topk": [1]
+    }
+}, {
+    "Recallk": {
+        "topk": [5]
+    }
+}, {
+    "mAP": {}
+}, {
+    "mINP": {}
+}]
+
+
+def _build_features():
+    rng = np.random.RandomState(0)
+    gallery_feas = rng.randn(GALLERY_NUM, EMBEDDING_SIZE).astype("float32")
+    gallery_labels = np.arange(GALLERY_NUM) % CLASS_NUM
+    # duplicated gallery samples of the same class, so that relevant samples
+    # get tied scores
+    gallery_feas[CLASS_NUM:2 * CLASS_NUM] = gallery_feas[:CLASS_NUM]
+    gallery_feas[2 * CLASS_NUM:3 * CLASS_NUM] = gallery_feas[:CLASS_NUM]
+    query_feas = rng.randn(QUERY_NUM, EMBEDDING_SIZE).astype("float32")
+    query_labels = rng.randint(0, CLASS_NUM, size=[QUERY_NUM])
+
+    def _pack(feas, labels):
+        return (QuantizedFeatures.quantize(paddle.to_tensor(feas)),
+                paddle.to_tensor(labels.reshape([-1, 1]).astype("int64")),
+                None)
+
+    return {
+        "gallery": _pack(gallery_feas, gallery_labels),
+        "query": _pack(query_feas, query_labels)
+    }
+
+
+def _build_trainer(metric_config, features):
+    # only the parts used by the retrieval eval, no model or dataloader
+    trainer = Trainer.__new__(Trainer)
+    trainer.config = {"Global": {"sim_block_size": 5}}
+    trainer.model = nn.Layer()
+    trainer.eval_metric_func = build_metrics(metric_config)
+    trainer._cal_feature = \
+        lambda name='gallery', gather=True, dtype=None: features[name]
+    return trainer
+
+
+class TestRetrievalMetrics(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        if logger._logger is None:
+            logger.init_logger()
+
+    def test_sharded_eval_matches_full_eval(self):
+        """
+        with a single rank the sharded eval must give the metrics of the
+        full sort of the gallery, tied scores included
+        """
+        features = _build_features()
+        for metric in METRICS:
+            trainer = _build_trainer([metric], features)
+            np.testing.assert_allclose(
+                trainer.eval_retrieval_sharded(),
+                trainer.eval_retrieval(),
+                rtol=1e-5,
+                err_msg=list(metric)[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
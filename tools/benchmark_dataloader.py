@@ -0,0 +1,264 @@
+# Copyright (c) 2021 PaddlePaddle Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import os
+import sys
+__dir__ = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.abspath(os.path.join(__dir__, '../')))
+
+import copy
+import time
+import argparse
+import itertools
+import numpy as np
+import paddle
+from prettytable import PrettyTable
+
+from ppcls.utils import config
+from ppcls.utils import logger
+from ppcls.utils.logger import init_logger
+from ppcls.data import build_dataloader
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+def parse_args():
+    parser = argparse.ArgumentParser("PaddleClas dataloader benchmark script")
+    parser.add_argument(
+        '-c',
+        '--config',
+        type=str,
+        default='configs/config.yaml',
+        help='config file path')
+    parser.add_argument(
+        '-o',
+        '--override',
+        action='append',
+        default=[],
+        help='config options to be overridden')
+    parser.add_argument(
+        '--mode',
+        type=str,
+        default='Train',
+        choices=['Train', 'Eval', 'Gallery', 'Query'],
+        help='which DataLoader section of the config to benchmark')
+    parser.add_argument(
+        '--num_workers',
+        type=int,
+        nargs='+',
+        default=None,
+        help='list of num_workers to sweep, default is the config value')
+    parser.add_argument(
+        '--use_shared_memory',
+        type=str,
+        nargs='+',
+        default=None,
+        help='list of use_shared_memory values (True/False) to sweep, '
+        'default is the config value')
+    parser.add_argument(
+        '--max_batches',
+        type=int,
+        default=100,
+        help='number of batches to time for every setting')
+    parser.add_argument(
+        '--warmup',
+        type=int,
+        default=5,
+        help='number of batches to skip before timing')
+    parser.add_argument(
+        '--profile_ops',
+        action='store_true',
+        help='time every transform op in the main process')
+    parser.add_argument(
+        '--profile_samples',
+        type=int,
+        default=200,
+        help='number of samples used when profile_ops is set')
+    return parser.parse_args()
+
+
+def str2bool(v):
+    return v.lower() in ("true", "t", "1", "yes")
+
+
+class TimedOperator(object):
+    """
+    wrap an operator created by create_operators and record its cost
+    """
+
+    def __init__(self, op):
+        self.op = op
+        self.name = op.__class__.__name__
+        self.costs = []
+
+    def __call__(self, data):
+        tic = time.perf_counter()
+        data = self.op(data)
+        self.costs.append(time.perf_counter() - tic)
+        return data
+
+
+def _worker_cpu_time(cpu_times):
+    """
+    record the max cpu time seen so far for every child process, workers
+    exit with the iterator so the counter has to be sampled while running
+    """
+    if psutil is None:
+        return
+    for child in psutil.Process().children(recursive=True):
+        try:
+            t = child.cpu_times()
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            continue
+        cpu_times[child.pid] = max(
+            cpu_times.get(child.pid, 0.), t.user + t.system)
+
+
+def benchmark_loader(loader_config, mode, device, max_batches, warmup):
+    data_loader = build_dataloader(loader_config, mode, device)
+    batch_costs = []
+    num_images = 0
+    cpu_times = {}
+    main_cpu_start = time.process_time()
+
+    tic = time.perf_counter()
+    for iter_id, batch in enumerate(data_loader()):
+        cost = time.perf_counter() - tic
+        if iter_id >= warmup:
+            batch_costs.append(cost)
+            num_images += batch[0].shape[0]
+        if iter_id % 10 == 0 or iter_id + 1 == warmup + max_batches:
+            _worker_cpu_time(cpu_times)
+        if iter_id + 1 >= warmup + max_batches:
+            break
+        tic = time.perf_counter()
+    main_cpu = time.process_time() - main_cpu_start
+
+    if len(batch_costs) == 0:
+        logger.warning("no batch is timed, the dataset is smaller than "
+                       "warmup({}) batches".format(warmup))
+        return None
+    batch_costs = np.array(batch_costs)
+    total_cost = batch_costs.sum()
+    worker_cpu = sum(cpu_times.values()) if psutil is not None else None
+    return {
+        "batches": len(batch_costs),
+        "ips": num_images / total_cost,
+        "p50": np.percentile(batch_costs, 50) * 1000,
+        "p99": np.percentile(batch_costs, 99) * 1000,
+        "main_cpu": main_cpu,
+        "worker_cpu": worker_cpu,
+    }
+
+
+def profile_ops(loader_config, mode, device, num_samples):
+    data_loader = build_dataloader(loader_config, mode, device)
+    dataset = data_loader.dataset
+    if not hasattr(dataset, "_transform_ops"):
+        logger.warning("dataset {} has no transform ops to profile".format(
+            dataset.__class__.__name__))
+        return
+    timed_ops = [TimedOperator(op) for op in dataset._transform_ops]
+    dataset._transform_ops = timed_ops
+
+    num_samples = min(num_samples, len(dataset))
+    sample_costs = []
+    for idx in range(num_samples):
+        tic = time.perf_counter()
+        dataset[idx]
+        sample_costs.append(time.perf_counter() - tic)
+    total_cost = sum(sample_costs)
+
+    table = PrettyTable(
+        ["op", "calls", "avg(ms)", "p99(ms)", "total(s)", "ratio(%)"])
+    op_total = 0.
+    for op in timed_ops:
+        costs = np.array(op.costs)
+        op_total += costs.sum()
+        table.add_row([
+            op.name, len(costs), "{:.3f}".format(costs.mean() * 1000),
+            "{:.3f}".format(np.percentile(costs, 99) * 1000),
+            "{:.3f}".format(costs.sum()),
+            "{:.2f}".format(costs.sum() / total_cost * 100)
+        ])
+    # file reading, transpose and other work outside of the ops
+    other = total_cost - op_total
+    table.add_row([
+        "others", num_samples, "{:.3f}".format(other / num_samples * 1000),
+        "-", "{:.3f}".format(other), "{:.2f}".format(other / total_cost * 100)
+    ])
+    logger.info("[{}] per-op cost over {} samples:\n{}".format(
+        mode, num_samples, table))
+
+
+def main(args):
+    cfg = config.get_config(args.config, overrides=args.override, show=False)
+    init_logger(name='root')
+    device = paddle.set_device(cfg["Global"].get("device", "cpu"))
+
+    # Gallery and Query live under DataLoader.Eval
+    if args.mode in ["Gallery", "Query"]:
+        loader_config = cfg["DataLoader"]["Eval"]
+    else:
+        loader_config = cfg["DataLoader"]
+    default_loader = loader_config[args.mode]["loader"]
+    num_workers_list = args.num_workers or [default_loader["num_workers"]]
+    if args.use_shared_memory is None:
+        shm_list = [default_loader["use_shared_memory"]]
+    else:
+        shm_list = [str2bool(v) for v in args.use_shared_memory]
+    if psutil is None:
+        logger.warning("psutil is not installed, worker cpu is not reported")
+
+    table = PrettyTable([
+        "num_workers", "use_shared_memory", "batches", "ips(images/sec)",
+        "p50(ms)", "p99(ms)", "main_cpu(s)", "worker_cpu(s)"
+    ])
+    for num_workers, use_shm in itertools.product(num_workers_list,
+                                                  shm_list):
+        cur_config = copy.deepcopy(loader_config)
+        cur_config[args.mode]["loader"]["num_workers"] = num_workers
+        cur_config[args.mode]["loader"]["use_shared_memory"] = use_shm
+        logger.info("benchmark {} loader with num_workers={}, "
+                    "use_shared_memory={}".format(args.mode, num_workers,
+                                                  use_shm))
+        result = benchmark_loader(cur_config, args.mode, device,
+                                  args.max_batches, args.warmup)
+        if result is None:
+            continue
+        table.add_row([
+            num_workers, use_shm, result["batches"],
+            "{:.2f}".format(result["ips"]), "{:.2f}".format(result["p50"]),
+            "{:.2f}".format(result["p99"]),
+            "{:.2f}".format(result["main_cpu"]), "N/A"
+            if result["worker_cpu"] is None else
+            "{:.2f}".format(result["worker_cpu"])
+        ])
+    logger.info("[{}] dataloader benchmark:\n{}".format(args.mode, table))
+
+    if args.profile_ops:
+        profile_ops(
+            copy.deepcopy(loader_config), args.mode, device,
+            args.profile_samples)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    main(args)
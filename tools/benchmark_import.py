@@ -0,0 +1,96 @@
+# Copyright (c) 2021 PaddlePaddle Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import os
+import sys
+import time
+import argparse
+import subprocess
+
+import numpy as np
+from prettytable import PrettyTable
+
+__dir__ = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.abspath(os.path.join(__dir__, '../'))
+
+CASES = [
+    ("python", "pass"),
+    ("paddle", "import paddle"),
+    ("ppcls.arch", "import ppcls.arch"),
+    ("build_model(ResNet50)", "from ppcls.arch import build_model; "
+     "build_model({'name': 'ResNet50'})"),
+    ("ppcls.engine.trainer", "import ppcls.engine.trainer"),
+    ("paddleclas", "import paddleclas"),
+]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser("PaddleClas import time benchmark")
+    parser.add_argument(
+        '--repeats',
+        type=int,
+        default=5,
+        help='number of fresh interpreters started for every case')
+    parser.add_argument(
+        '--backbone',
+        type=str,
+        default=None,
+        help='also time build_model of this backbone')
+    return parser.parse_args()
+
+
+def time_statement(statement, repeats):
+    """
+    run the statement in fresh interpreters and return the wall time, so that
+    nothing is cached in sys.modules
+    """
+    costs = []
+    for _ in range(repeats):
+        tic = time.perf_counter()
+        ret = subprocess.run(
+            [sys.executable, "-c", statement],
+            cwd=ROOT_DIR,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE)
+        costs.append(time.perf_counter() - tic)
+        if ret.returncode != 0:
+            return None, ret.stderr.decode().strip().split("\n")[-1]
+    return np.array(costs), None
+
+
+def main(args):
+    cases = list(CASES)
+    if args.backbone is not None:
+        cases.append(("build_model({})".format(args.backbone),
+                      "from ppcls.arch import build_model; "
+                      "build_model({{'name': '{}'}})".format(args.backbone)))
+    table = PrettyTable(["case", "avg(s)", "min(s)", "max(s)"])
+    for name, statement in cases:
+        costs, err = time_statement(statement, args.repeats)
+        if costs is None:
+            table.add_row([name, "failed: {}".format(err), "-", "-"])
+            continue
+        table.add_row([
+            name, "{:.3f}".format(costs.mean()), "{:.3f}".format(costs.min()),
+            "{:.3f}".format(costs.max())
+        ])
+    print(table)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    main(args)
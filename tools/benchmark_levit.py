@@ -0,0 +1,138 @@
+# Copyright (c) 2021 PaddlePaddle Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import os
+import sys
+__dir__ = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.abspath(os.path.join(__dir__, '../')))
+
+import time
+import argparse
+import numpy as np
+import paddle
+from prettytable import PrettyTable
+
+from ppcls.arch.backbone.model_zoo import levit
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        "forward latency of LeViT with the looped attention bias gather and "
+        "the fused gather with the eval cache")
+    parser.add_argument(
+        '--models',
+        type=str,
+        nargs='+',
+        default=['LeViT_128S', 'LeViT_256'],
+        help='LeViT models to benchmark')
+    parser.add_argument('--batch_size', type=int, default=32)
+    parser.add_argument('--device', type=str, default='gpu')
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--repeats', type=int, default=50)
+    return parser.parse_args()
+
+
+def looped_attention_biases(attention_biases, attention_bias_idxs):
+    """
+    the previous implementation, one gather for every row of the indices
+    """
+    gather_list = []
+    attention_bias_t = paddle.transpose(attention_biases, (1, 0))
+    nums = attention_bias_idxs.shape[0]
+    for idx in range(nums):
+        gather = paddle.gather(attention_bias_t, attention_bias_idxs[idx])
+        gather_list.append(gather)
+    shape0, shape1 = attention_bias_idxs.shape
+    gather = paddle.concat(gather_list)
+    return paddle.transpose(gather, (1, 0)).reshape((0, shape0, shape1))
+
+
+def looped_biases(layer):
+    """
+    the biases were recomputed by every forward, even in eval mode
+    """
+    return looped_attention_biases(layer.attention_biases,
+                                   layer.attention_bias_idxs)
+
+
+def _sync():
+    if paddle.is_compiled_with_cuda() and "gpu" in str(
+            paddle.get_device()):
+        paddle.device.cuda.synchronize()
+
+
+def time_forward(model, x, training, warmup, repeats):
+    """
+    Returns:
+        cost(float): average latency of a forward in ms
+        output(np.ndarray): output of the last forward
+    """
+    if training:
+        model.train()
+    else:
+        model.eval()
+    with paddle.no_grad():
+        for _ in range(warmup):
+            out = model(x)
+        _sync()
+        tic = time.perf_counter()
+        for _ in range(repeats):
+            out = model(x)
+        _sync()
+    if isinstance(out, (list, tuple)):
+        out = out[0]
+    return (time.perf_counter() - tic) / repeats * 1000, out.numpy()
+
+
+def main(args):
+    paddle.set_device(args.device)
+    fused = levit.get_attention_biases
+    table = PrettyTable(
+        ["model", "mode", "looped(ms)", "fused(ms)", "speedup", "max diff"])
+    for name in args.models:
+        paddle.seed(0)
+        model = getattr(levit, name)()
+        # random biases, the zero initialization would hide wrong indices
+        for layer in model.sublayers():
+            if isinstance(layer,
+                          (levit.Attention, levit.AttentionSubsample)):
+                layer.attention_biases.set_value(
+                    np.random.randn(*layer.attention_biases.shape).astype(
+                        "float32"))
+        x = paddle.rand([args.batch_size, 3, 224, 224])
+        for training in [True, False]:
+            costs = {}
+            outputs = {}
+            for impl, func in [("looped", looped_biases), ("fused", fused)]:
+                levit.get_attention_biases = func
+                model.train()
+                costs[impl], outputs[impl] = time_forward(
+                    model, x, training, args.warmup, args.repeats)
+            levit.get_attention_biases = fused
+            table.add_row([
+                name, "train" if training else "eval",
+                "{:.2f}".format(costs["looped"]),
+                "{:.2f}".format(costs["fused"]),
+                "{:.2f}x".format(costs["looped"] / costs["fused"]),
+                "{:.2e}".format(
+                    np.abs(outputs["looped"] - outputs["fused"]).max())
+            ])
+    print(table)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    main(args)
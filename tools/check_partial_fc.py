@@ -0,0 +1,124 @@
+# Copyright (c) 2021 PaddlePaddle Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import os
+import sys
+import argparse
+
+import numpy as np
+
+__dir__ = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.abspath(os.path.join(__dir__, '../')))
+
+import paddle
+import paddle.distributed as dist
+import paddle.nn.functional as F
+
+from ppcls.arch.gears import ArcMargin, PartialFCArcMargin
+from ppcls.arch.gears.partial_fc import shard_range
+from ppcls.loss import PartialFCLoss
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        "check the Partial-FC head against the dense ArcMargin head with "
+        "multiple CPU processes")
+    parser.add_argument('--nprocs', type=int, default=2)
+    parser.add_argument('--batch_size', type=int, default=8)
+    parser.add_argument('--embedding_size', type=int, default=16)
+    parser.add_argument('--class_num', type=int, default=40)
+    parser.add_argument('--sample_ratio', type=float, default=0.25)
+    # the loss of random embeddings with the default scale is clipped by
+    # cross_entropy, a smaller scale keeps the dense reference exact
+    parser.add_argument('--scale', type=float, default=16.0)
+    return parser.parse_args()
+
+
+def make_data(args):
+    rng = np.random.RandomState(0)
+    global_batch = args.batch_size * args.nprocs
+    feats = rng.randn(global_batch, args.embedding_size).astype("float32")
+    labels = rng.randint(
+        0, args.class_num, size=[global_batch, 1]).astype("int64")
+    weight = rng.randn(args.embedding_size,
+                       args.class_num).astype("float32")
+    return feats, labels, weight
+
+
+def dense_reference(args):
+    """
+    loss and gradients of the dense ArcMargin head on the global batch
+    """
+    feats, labels, weight = make_data(args)
+    head = ArcMargin(args.embedding_size, args.class_num, scale=args.scale)
+    head.fc.weight.set_value(weight)
+    x = paddle.to_tensor(feats, stop_gradient=False)
+    logits = head(x, paddle.to_tensor(labels))
+    loss = F.cross_entropy(logits, paddle.to_tensor(labels)).mean()
+    loss.backward()
+    return (float(loss.numpy()[0]), x.grad.numpy(),
+            head.fc.weight.grad.numpy())
+
+
+def worker(args):
+    paddle.set_device("cpu")
+    dist.init_parallel_env()
+    rank = dist.get_rank()
+    feats, labels, weight = make_data(args)
+    ref_loss, ref_x_grad, ref_w_grad = dense_reference(args)
+
+    start, end = shard_range(args.class_num)
+    local = slice(rank * args.batch_size, (rank + 1) * args.batch_size)
+
+    # all the centers are used, the result must be the same as dense
+    head = PartialFCArcMargin(
+        args.embedding_size, args.class_num, scale=args.scale)
+    head.weight.set_value(weight[:, start:end])
+    x = paddle.to_tensor(feats[local], stop_gradient=False)
+    out = head(x, paddle.to_tensor(labels[local]))
+    loss = PartialFCLoss()(out)["PartialFCLoss"]
+    loss.backward()
+    # the gradient of the embeddings is scaled by the number of ranks to
+    # compensate the average of allreduce_grads
+    np.testing.assert_allclose(float(loss.numpy()[0]), ref_loss, rtol=1e-5)
+    np.testing.assert_allclose(
+        x.grad.numpy() / args.nprocs,
+        ref_x_grad[local],
+        rtol=1e-4,
+        atol=1e-6)
+    np.testing.assert_allclose(
+        head.weight.grad.numpy(),
+        ref_w_grad[:, start:end],
+        rtol=1e-4,
+        atol=1e-6)
+
+    # sampled centers must keep every positive
+    head = PartialFCArcMargin(
+        args.embedding_size, args.class_num, sample_ratio=args.sample_ratio)
+    out = head(
+        paddle.to_tensor(feats[local]), paddle.to_tensor(labels[local]))
+    in_shard = (labels[:, 0] >= start) & (labels[:, 0] < end)
+    local_label = out["partial_fc_label"].numpy()
+    assert (local_label[in_shard] >= 0).all()
+    assert (local_label[~in_shard] == -1).all()
+    assert out["logits"].shape[1] >= int(
+        np.ceil(args.sample_ratio * (end - start)))
+    print("rank {}: Partial-FC matches the dense head".format(rank))
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    dist.spawn(worker, args=(args, ), nprocs=args.nprocs, backend="gloo")
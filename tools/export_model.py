@@ -17,6 +17,7 @@ from __future__ import division
 from __future__ import print_function
 import os
 import sys
+import json
 __dir__ = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(os.path.abspath(os.path.join(__dir__, '../')))
 
@@ -27,13 +28,17 @@ from ppcls.utils import config
 from ppcls.utils.logger import init_logger
 from ppcls.utils.config import print_config
 from ppcls.arch import build_model, RecModel, DistillationModel
+from ppcls.arch.fuse import fuse_model
 from ppcls.utils.save_load import load_dygraph_pretrain
 from ppcls.arch.gears.identity_head import IdentityHead
 
 
 class ExportModel(nn.Layer):
     """
-    ExportModel: add softmax onto the model
+    ExportModel: add softmax onto the model. When infer_output_keys is a list,
+    the outputs of these keys, such as the branches of MultiHeadModel, are
+    exported as several fetch targets in the same order, and
+    infer_add_softmax can be the list of keys to add softmax to.
     """
 
     def __init__(self, config):
@@ -50,7 +55,13 @@ class ExportModel(nn.Layer):
         if self.infer_output_key == "features" and isinstance(self.base_model,
                                                               RecModel):
             self.base_model.head = IdentityHead()
-        if config.get("infer_add_softmax", True):
+        self.infer_output_keys = config.get("infer_output_keys", None)
+        add_softmax = config.get("infer_add_softmax", True)
+        if self.infer_output_keys is not None:
+            self.softmax_keys = add_softmax if isinstance(
+                add_softmax, list) else []
+            add_softmax = len(self.softmax_keys) > 0
+        if add_softmax:
             self.softmax = nn.Softmax(axis=-1)
         else:
             self.softmax = None
@@ -67,6 +78,11 @@ class ExportModel(nn.Layer):
             x = x[0]
         if self.infer_model_name is not None:
             x = x[self.infer_model_name]
+        if self.infer_output_keys is not None:
+            return [
+                self.softmax(x[key]) if key in self.softmax_keys else x[key]
+                for key in self.infer_output_keys
+            ]
         if self.infer_output_key is not None:
             x = x[self.infer_output_key]
         if self.softmax is not None:
@@ -92,6 +108,10 @@ if __name__ == "__main__":
                               config["Global"]["pretrained_model"])
 
     model.eval()
+    # fold bn and drop dropout before export, the origin model is exported
+    # if the fused one is not numerically equivalent
+    if config["Global"].get("fuse_model", False):
+        model = fuse_model(model, config["Global"]["image_shape"])
 
     model = paddle.jit.to_static(
         model,
@@ -103,3 +123,9 @@ if __name__ == "__main__":
     paddle.jit.save(model,
                     os.path.join(config["Global"]["save_inference_dir"],
                                  "inference"))
+    # the names of the fetch targets are generated, keep the keys of them
+    if config["Arch"].get("infer_output_keys", None) is not None:
+        with open(
+                os.path.join(config["Global"]["save_inference_dir"],
+                             "inference_output_keys.json"), "w") as f:
+            json.dump(list(config["Arch"]["infer_output_keys"]), f)